@@ -0,0 +1,289 @@
+#    MAD Lab, University at Buffalo
+#    Copyright (C) 2018  Prakhar Jaiswal <prakharj@buffalo.edu>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Accessibility of a part from a set of approach directions.
+
+On a 3-axis machine the tool (beta) reaches the part along a fixed approach
+direction and its holder follows behind it, so a position of the tool can
+be reached from direction d only if the tool swept from it along +d out of
+the part's grid misses the part (see get_swept_tool and get_exit_length).
+The space outside the part, including all of the space past its grid, is
+free. The tool cuts the voxels of the grid covered by the (unswept) tool at
+some reachable position, and the part as manufactured from d is its grid
+less those voxels: the part and the empty voxels of its grid the tool
+cannot reach from d, which are the non-manufacturable voxels. A pocket
+open to +z only is cut from +z but not from -z, so opposite directions
+differ. The voxels not manufacturable from some direction (the union) and
+from every direction (the intersection, which no set-up among the
+directions can cut) are reported too.
+
+All directions share one padded grid, large enough for the longest sweep,
+so the part is transformed once and its spectrum used for all of them. The
+directions are processed in batches whose products with the part's
+spectrum are formed at once, and each swept tool is transformed only once.
+The unswept tool is transformed once for all directions, its spectrum
+moved to the place of the tool in each sweep by a phase (see
+get_shifted_spectrum).
+
+Usage: python accessibility.py part.obj tool.obj [options], see
+'python accessibility.py -h'
+"""
+
+import argparse
+import numpy as np
+
+from shape import Shape, get_padded_dims, pack_voxel
+from morphology import get_packed_shape, crop_voxels, report
+
+# approach directions by name, pointing from the part to the tool
+DIRECTIONS = {'x': (1, 0, 0), '-x': (-1, 0, 0), 'y': (0, 1, 0),
+                '-y': (0, -1, 0), 'z': (0, 0, 1), '-z': (0, 0, -1)}
+DEFAULT_DIRECTIONS = ['x', '-x', 'y', '-y', 'z', '-z']
+# number of directions whose spectra are held and multiplied at once
+BATCH = 4
+
+# fields of the table returned by 'get_accessibility'
+TABLE_DTYPE = [('index', int), ('dx', 'd'), ('dy', 'd'), ('dz', 'd'),
+                    ('length', int), ('as_man', int), ('non_man', int)]
+
+def parse_direction(text):
+    '''
+    Returns the unit vector of the direction 'text', a name of DIRECTIONS
+    or three comma separated components
+    '''
+    if text in DIRECTIONS:
+        direction = np.array(DIRECTIONS[text], dtype = 'd')
+    else:
+        direction = np.array([float(c) for c in text.split(',')])
+        if direction.shape != (3,):
+            raise ValueError('Direction needs three components: ' + text)
+    norm = np.sqrt(np.sum(direction ** 2))
+    if norm == 0:
+        raise ValueError('Zero direction ' + text)
+    return direction / norm
+
+def get_sweep_offsets(direction, length):
+    '''
+    Returns the voxel offsets (K x 3) of the digital segment from the origin
+    to 'length' voxels along the unit vector 'direction', consecutive
+    offsets at most one voxel apart along every axis
+    '''
+    nsteps = int(np.ceil(length * np.abs(direction).max()))
+    steps = np.linspace(0, length, nsteps + 1)
+    offsets = np.rint(steps[:, None] * direction).astype(int)
+    # dropping the repeats of the rounding, keeping the order of the segment
+    keep = np.ones(len(offsets), dtype = bool)
+    keep[1:] = np.any(offsets[1:] != offsets[:-1], axis = 1)
+    return offsets[keep]
+
+def get_exit_length(dims, tool_dims, direction):
+    '''
+    Returns the length in voxels a tool of 'tool_dims' has to be swept
+    along the unit vector 'direction' to leave a grid of 'dims' from any
+    position it overlaps the grid at
+    '''
+    lengths = [float(n + b) / abs(d) for n, b, d in
+                            zip(dims, tool_dims, direction) if d != 0]
+    return int(np.ceil(min(lengths)))
+
+def get_swept_tool(tool, direction, length):
+    '''
+    Returns the voxels 'tool' (3D boolean array) swept 'length' voxels
+    along 'direction', cropped to their bounding box, and the first corner
+    of the unswept tool in that box
+    Every voxel of the segment adds one shifted copy of the tool, on the
+    box of the swept tool only
+    '''
+    offsets = get_sweep_offsets(direction, length)
+    corner = -offsets.min(0)
+    offsets += corner
+    dims = np.array(tool.shape) + offsets.max(0)
+    swept = np.zeros(dims, dtype = bool)
+    for offset in offsets:
+        box = tuple(slice(o, o + n) for o, n in zip(offset, tool.shape))
+        swept[box] |= tool
+    return swept, corner
+
+def get_shifted_spectrum(voxel_ft, dims, offset):
+    '''
+    Returns the half spectrum of the grid of 'dims' circularly shifted by
+    'offset' voxels (as numpy.roll) from the half spectrum 'voxel_ft' of
+    the grid
+    '''
+    phase = np.ones(1, dtype = 'F')
+    for axis, (n, o) in enumerate(zip(dims, offset)):
+        k = np.arange(voxel_ft.shape[axis])
+        shape = [1, 1, 1]
+        shape[axis] = len(k)
+        phase = phase * np.exp(-2j * np.pi * k * o / n).astype('F').reshape(
+                                                                    shape)
+    return voxel_ft * phase
+
+def get_corner_grid(voxel, dims):
+    '''
+    Returns a Shape of 'dims' holding the voxels 'voxel' in its corner and
+    its half spectrum computed
+    '''
+    grid = np.zeros(dims, dtype = 'f')
+    grid[:voxel.shape[0], :voxel.shape[1], :voxel.shape[2]] = voxel
+    shape = Shape()
+    shape.set_voxel(grid)
+    shape.fourier_transform()
+    return shape
+
+def get_reached_batch(part, sweeps, tool, sza):
+    '''
+    Computes the voxels the tool reaches for each of the 'sweeps', as
+    (swept tool, corner of the tool in it) with the swept tools padded
+    and their spectra computed, from the padded part 'part' (in the corner
+    of its grid, with its spectrum computed) and the padded 'tool' (with
+    its spectrum computed)
+    The grid has to hold the part and any swept tool without wrap-around
+    Output: list of boolean arrays of the reached voxels of the part's
+    unpadded grid of 'sza'
+    '''
+    dims = part.get_voxel_shape()
+    size = np.prod(dims)
+    tool_ft = tool.get_voxel_ft()
+    swept_ft = np.array([swept.get_voxel_ft() for swept, corner in sweeps])
+
+    # overlaps of the part with the swept tools at each position of their
+    # box, all products with the part's spectrum at once
+    products = part.get_voxel_ft() * np.conj(swept_ft)
+    del swept_ft
+    reached = []
+    for (swept, corner), product in zip(sweeps, products):
+        corr = Shape()
+        corr.set_voxel_ft(product, dims)
+        corr.inverse_fourier_transform()
+        # the positions whose swept tool misses the part (the transforms
+        # are unnormalized)
+        free = Shape()
+        free.set_voxel(corr.get_voxel() < 0.5 * size)
+        free.fourier_transform()
+        del corr
+
+        # the tool at the free positions, in its place in the sweep
+        corr = Shape()
+        corr.set_voxel_ft(free.get_voxel_ft() *
+                    get_shifted_spectrum(tool_ft, dims, corner), dims)
+        corr.inverse_fourier_transform()
+        reached.append(corr.get_voxel()[:sza[0], :sza[1], :sza[2]] >
+                                                                0.5 * size)
+    return reached
+
+def get_accessibility(alpha, beta, directions, batch = BATCH,
+                                                        progress = None):
+    '''
+    Computes the as manufactured and non-manufacturable volume of part
+    'alpha' machined by tool 'beta' (Shapes with unpadded voxel data) from
+    each of 'directions' (unit vectors, see parse_direction), 'batch'
+    directions at a time
+    The tool is swept along each direction until it leaves the part's grid
+    (see get_exit_length) and can be larger than the part
+    'progress' is called as in morphology.py
+    Output: table (numpy record array with fields 'index', 'dx', 'dy',
+    'dz', 'length' (of the sweep), 'as_man' and 'non_man', one row per
+    direction) and the voxels not manufacturable from some and from every
+    direction, as Shapes (bit-packed) on the grid of 'alpha'
+    '''
+    directions = [np.asarray(d, dtype = 'd') for d in directions]
+    lo, tool = crop_voxels(beta.get_voxel() > 0.5)
+    voxel = alpha.get_voxel() > 0.5
+    sza = voxel.shape
+    lengths = []
+    swept = []
+    for direction in directions:
+        lengths.append(get_exit_length(sza, tool.shape, direction))
+        swept.append(get_swept_tool(tool, direction, lengths[-1]))
+
+    # one grid holds the part, in its corner, and each of the swept tools
+    report(progress, 0.0, 'Transforming the part')
+    dims = tuple(get_padded_dims(sza,
+                        np.max([s.shape for s, corner in swept], axis = 0)))
+    part = get_corner_grid(voxel, dims)
+    tool_grid = get_corner_grid(tool, dims)
+    part_bits = pack_voxel(voxel)
+
+    table = np.zeros(len(directions), dtype = TABLE_DTYPE)
+    union = np.zeros_like(part_bits)
+    common = ~union
+    for start in range(0, len(directions), batch):
+        stop = min(start + batch, len(directions))
+        report(progress, float(start) / len(directions),
+                'Directions %d-%d of %d' % (start + 1, stop, len(directions)))
+        sweeps = [(get_corner_grid(s, dims), corner)
+                                        for s, corner in swept[start:stop]]
+        reached = get_reached_batch(part, sweeps, tool_grid, sza)
+        for index, cut in enumerate(reached, start):
+            as_man = pack_voxel(~cut)
+            non_man = as_man & ~part_bits
+            union |= non_man
+            common &= non_man
+            row = table[index]
+            row['index'] = index
+            row['dx'], row['dy'], row['dz'] = directions[index]
+            row['length'] = lengths[index]
+            row['as_man'] = get_packed_shape(as_man, sza).get_volume()
+            row['non_man'] = get_packed_shape(non_man, sza).get_volume()
+    report(progress, 1.0, 'Done')
+    return table, get_packed_shape(union, sza), \
+                                            get_packed_shape(common, sza)
+
+def write_table(table, union, common, filename):
+    '''
+    Writes the accessibility table as whitespace separated text, with the
+    union and intersection volumes in the header
+    '''
+    header = ' '.join(name for name, dtype in TABLE_DTYPE)
+    header = 'non_man union %d, intersection %d\n%s' % (union.get_volume(),
+                                                common.get_volume(), header)
+    np.savetxt(filename, table, fmt = '%d %.6f %.6f %.6f %d %d %d',
+                                                        header = header)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description =
+                'Non-manufacturable volume per approach direction')
+    parser.add_argument('part', help = 'triangulated part file (A)')
+    parser.add_argument('tool', help = 'triangulated tool file (B)')
+    parser.add_argument('--directions', nargs = '*',
+                        default = DEFAULT_DIRECTIONS,
+                        help = 'approach directions, x, -x, y, -y, z, -z '
+                        'or dx,dy,dz (default: all six axis directions)')
+    parser.add_argument('--batch', type = int, default = BATCH)
+    parser.add_argument('--resA', type = int, default = 64)
+    parser.add_argument('--resB', type = int, default = 64)
+    parser.add_argument('--scaleA', type = float, default = 1)
+    parser.add_argument('--scaleB', type = float, default = 0.3)
+    parser.add_argument('--output', default = 'accessibility.txt')
+    args = parser.parse_args()
+
+    alpha = Shape()
+    alpha.set_filename(args.part)
+    alpha.set_resolution(args.resA)
+    alpha.set_scale(args.scaleA)
+    alpha.read_voxel()
+    beta = Shape()
+    beta.set_filename(args.tool)
+    beta.set_resolution(args.resB)
+    beta.set_scale(args.scaleB)
+    beta.read_voxel()
+
+    table, union, common = get_accessibility(alpha, beta,
+                    [parse_direction(d) for d in args.directions],
+                    args.batch)
+    write_table(table, union, common, args.output)
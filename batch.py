@@ -0,0 +1,283 @@
+#    MAD Lab, University at Buffalo
+#    Copyright (C) 2018  Prakhar Jaiswal <prakharj@buffalo.edu>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Headless batch processing of part/tool pairs.
+
+Runs the morphological operations of morphology.py without the GUI for the
+jobs listed in a JSON manifest, on a process pool. The manifest is either a
+list of jobs or an object with a "jobs" list and optional "defaults"
+applied to every job, e.g.
+
+    {"defaults": {"resA": 128, "scaleB": 0.3, "operations": ["as_man"]},
+     "jobs": [{"name": "bracket", "part": "data/testpart0.obj",
+               "tool": "data/testpart1.obj"},
+              {"part": "data/testpart1.obj", "tool": "data/testpart0.obj",
+               "operations": ["sum", "diff"], "engine": "spatial"}]}
+
+Job fields (see JOB_DEFAULTS): 'part' and 'tool' mesh files, 'operations'
+out of 'sum', 'diff' and 'as_man', 'resA'/'resB' and 'scaleA'/'scaleB' as in
+the GUI, 'voxelizer' and 'engine', 'format' of the results ('binvox' or
+'native', see voxel_file.py), 'compress' for zlib-compressed native files,
+'multires' to compute 'as_man' coarse-to-fine (see multires.py, its
+statistics are added to the record as 'multires') and 'scratch', a
+directory to memory-map the grids of large jobs in, which are then
+convolved tile by tile (see morphology.choose_engine). Every job writes its
+results into files named after the job in the output directory, in
+background threads while its next operations run, and appends one JSON
+line with the volumes, files and timings (or the error) of the job to
+'results.jsonl' there, as soon as it finishes.
+
+Usage: python batch.py manifest.json [options], see 'python batch.py -h'
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import traceback
+import multiprocessing
+
+from shape import Shape
+from morphology import prepare_shapes, get_minkowski_sum, \
+                        get_minkowski_diff, get_minkowski_sum_and_diff, \
+                        get_as_manufactured
+from multires import get_as_manufactured_multires
+from voxel_file import EXTENSION
+
+OPERATIONS = ('sum', 'diff', 'as_man')
+# file extension of the results by output format
+FORMATS = {'binvox': '.binvox', 'native': EXTENSION}
+
+# settings of a job not given in the manifest
+JOB_DEFAULTS = {'operations': ['sum', 'diff'], 'resA': 64, 'resB': 64,
+                'scaleA': 1, 'scaleB': 0.3, 'voxelizer': 'binvox',
+                'engine': None, 'format': 'binvox', 'compress': False,
+                'multires': False, 'scratch': None}
+
+def read_manifest(filename):
+    '''
+    Reads the jobs of a manifest, with the defaults filled in and a unique
+    'name' for every job
+    '''
+    with open(filename, 'r') as fid:
+        manifest = json.load(fid)
+    if isinstance(manifest, list):
+        manifest = {'jobs': manifest}
+    defaults = dict(JOB_DEFAULTS)
+    defaults.update(manifest.get('defaults', {}))
+
+    jobs = []
+    names = set()
+    for index, entry in enumerate(manifest['jobs']):
+        job = dict(defaults)
+        job.update(entry)
+        for key in ('part', 'tool'):
+            if key not in job:
+                raise ValueError('Job %d has no %s' % (index, key))
+        for operation in job['operations']:
+            if operation not in OPERATIONS:
+                raise ValueError('Job %d: unknown operation %s' %
+                                                    (index, operation))
+        if job['format'] not in FORMATS:
+            raise ValueError('Job %d: unknown format %s' %
+                                                    (index, job['format']))
+        if 'name' not in job:
+            job['name'] = '%05d_%s_%s' % (index,
+                    os.path.splitext(os.path.basename(job['part']))[0],
+                    os.path.splitext(os.path.basename(job['tool']))[0])
+        if job['name'] in names:
+            raise ValueError('Duplicate job name ' + job['name'])
+        names.add(job['name'])
+        job['index'] = index
+        jobs.append(job)
+    return jobs
+
+def get_shape(filename, resolution, scale, voxelizer, scratch = None):
+    shape = Shape()
+    shape.set_filename(filename)
+    shape.set_resolution(resolution)
+    shape.set_scale(scale)
+    shape.set_voxelizer(voxelizer)
+    shape.set_scratch(scratch)
+    return shape
+
+class SaveThread(threading.Thread):
+    '''
+    The SaveThread class writes a result shape to a file in the background
+    The traceback of an error is kept in 'error'
+    '''
+
+    def __init__(self, shape, filename, compress = False, info = None):
+        threading.Thread.__init__(self)
+        self.shape = shape
+        self.filename = filename
+        self.compress = compress
+        self.info = info
+        self.error = None
+
+    def run(self):
+        try:
+            self.shape.write_voxel(self.filename, self.compress, self.info)
+        except Exception:
+            self.error = traceback.format_exc()
+
+def run_job(job, output):
+    '''
+    Runs the operations of 'job' and writes the results into the directory
+    'output'
+    Output: record (dict) of the job with the volumes and files of the
+    results and the timings of the steps in seconds
+    '''
+    record = {'index': job['index'], 'name': job['name'],
+                'part': job['part'], 'tool': job['tool'],
+                'operations': job['operations'], 'volumes': {},
+                'files': {}, 'timings': {}}
+    timings = record['timings']
+    start = time.time()
+    savers = []
+
+    def save(key, shape):
+        # writing the result while the next operations run
+        filename = os.path.join(output, '%s_%s%s' % (job['name'], key,
+                                                    FORMATS[job['format']]))
+        info = {'operation': key, 'part': job['part'], 'tool': job['tool'],
+                'job': job['name']}
+        saver = SaveThread(shape, filename, job['compress'], info)
+        saver.start()
+        savers.append(saver)
+        record['volumes'][key] = shape.get_volume()
+        record['files'][key] = filename
+
+    try:
+        alpha = get_shape(job['part'], job['resA'], job['scaleA'],
+                                        job['voxelizer'], job['scratch'])
+        beta = get_shape(job['tool'], job['resB'], job['scaleB'],
+                                        job['voxelizer'], job['scratch'])
+        if not prepare_shapes(alpha, beta):
+            raise ValueError('Empty voxel model')
+        timings['prepare'] = time.time() - start
+        record['dims'] = [int(dim) for dim in alpha.get_voxel_shape()]
+
+        operations = job['operations']
+        engine = job['engine']
+        if 'sum' in operations and 'diff' in operations:
+            step = time.time()
+            msum, mdiff = get_minkowski_sum_and_diff(alpha, beta, engine)
+            timings['sum_and_diff'] = time.time() - step
+            save('sum', msum)
+            save('diff', mdiff)
+        elif 'sum' in operations:
+            step = time.time()
+            msum = get_minkowski_sum(alpha, beta, engine)
+            timings['sum'] = time.time() - step
+            save('sum', msum)
+        elif 'diff' in operations:
+            step = time.time()
+            mdiff = get_minkowski_diff(alpha, beta, engine)
+            timings['diff'] = time.time() - step
+            save('diff', mdiff)
+        if 'as_man' in operations:
+            step = time.time()
+            if job['multires']:
+                record['multires'] = {}
+                as_man, non_man = get_as_manufactured_multires(alpha, beta,
+                                        engine, stats = record['multires'])
+            else:
+                as_man, non_man = get_as_manufactured(alpha, beta, engine)
+            timings['as_man'] = time.time() - step
+            save('as_man', as_man)
+            save('non_man', non_man)
+        record['status'] = 'ok'
+    except Exception:
+        record['status'] = 'error'
+        record['error'] = traceback.format_exc()
+
+    # waiting for the results still being written
+    step = time.time()
+    for saver in savers:
+        saver.join()
+        if saver.error is not None and record['status'] == 'ok':
+            record['status'] = 'error'
+            record['error'] = saver.error
+    timings['write'] = time.time() - step
+    timings['total'] = time.time() - start
+    return record
+
+_output = None
+
+def _init_worker(output):
+    global _output
+    _output = output
+
+def _run_job(job):
+    return run_job(job, _output)
+
+def run_batch(jobs, output, nworkers = None, results = 'results.jsonl'):
+    '''
+    Runs 'jobs' (see read_manifest) on 'nworkers' processes (all cores if
+    None), writing the results into the directory 'output'
+    The record of every job is appended to the file 'results' in 'output'
+    as one JSON line when the job finishes, so an interrupted batch keeps
+    the finished jobs
+    Output: number of failed jobs
+    '''
+    if nworkers is None:
+        nworkers = multiprocessing.cpu_count()
+    try:
+        os.makedirs(output)
+    except OSError:
+        if not os.path.isdir(output):
+            raise
+
+    nfailed = 0
+    with open(os.path.join(output, results), 'a') as fid:
+        if nworkers == 1:
+            _init_worker(output)
+            records = (_run_job(job) for job in jobs)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(nworkers, _init_worker, (output,))
+            records = pool.imap_unordered(_run_job, jobs)
+        try:
+            for record in records:
+                if record['status'] != 'ok':
+                    nfailed += 1
+                fid.write(json.dumps(record, sort_keys = True) + '\n')
+                fid.flush()
+                sys.stderr.write('%s: %s (%.1fs)\n' % (record['name'],
+                            record['status'], record['timings']['total']))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+    return nfailed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description =
+                'Runs morphological operations on part/tool pairs headless')
+    parser.add_argument('manifest', help = 'JSON manifest of the jobs')
+    parser.add_argument('--output', default = 'results',
+                        help = 'output directory (default: results)')
+    parser.add_argument('--workers', type = int, default = None,
+                        help = 'number of processes (default: all cores)')
+    args = parser.parse_args()
+
+    nfailed = run_batch(read_manifest(args.manifest), args.output,
+                                                            args.workers)
+    sys.exit(1 if nfailed else 0)
@@ -62,11 +62,19 @@ True
 """
 
 import numpy as np
+from block_grid import BLOCK, BlockGrid
+
+# voxels of a dense model reordered at once by write, and decoded at once
+# by the slab-wise readers
+SLAB_SIZE = 1 << 24
+# bytes of run length encoded data read at once by the slab-wise readers
+CHUNK_BYTES = 1 << 20
 
 class Voxels(object):
     """ Holds a binvox model.
-    data is either a three-dimensional numpy boolean array (dense representation)
-    or a two-dimensional numpy float array (coordinate representation).
+    data is either a three-dimensional numpy boolean array (dense representation),
+    a two-dimensional numpy float array (coordinate representation) or a
+    block_grid.BlockGrid (block-sparse representation).
 
     dims, translate and scale are the model metadata.
 
@@ -114,7 +122,7 @@ def read_header(fp):
     line = fp.readline()
     return dims, translate, scale
 
-def read_as_3d_array(fp, fix_coords=True):
+def read_as_3d_array(fp, fix_coords=True, out=None):
     """ Read binary binvox format as array.
 
     Returns the model with accompanying metadata.
@@ -124,10 +132,13 @@ def read_as_3d_array(fp, fix_coords=True):
     are 8*(d^3) bytes, where d is the dimensions of the binvox model. Numpy
     boolean arrays use a byte per element).
 
+    The data is decoded slab by slab (see read_as_slabs) into out if given,
+    e.g. a memory-mapped array, otherwise into a new boolean array. Only
+    one slab is held in memory besides it.
+
     Doesn't do any checks on input except for the '#binvox' line.
     """
     dims, translate, scale = read_header(fp)
-    raw_data = np.frombuffer(fp.read(), dtype=np.uint8)
     # if just using reshape() on the raw data:
     # indexing the array as array[i,j,k], the indices map into the
     # coords as:
@@ -139,17 +150,105 @@ def read_as_3d_array(fp, fix_coords=True):
     # i -> x
     # j -> y
     # k -> z
-    values, counts = raw_data[::2], raw_data[1::2]
-    data = np.repeat(values, counts).astype(np.bool)
-    data = data.reshape(dims)
     if fix_coords:
-        # xzy to xyz TODO the right thing
-        data = np.transpose(data, (0, 2, 1))
+        shape = (dims[0], dims[2], dims[1])
         axis_order = 'xyz'
     else:
+        shape = tuple(dims)
         axis_order = 'xzy'
+    if out is None:
+        data = np.empty(shape, dtype=np.bool)
+    elif tuple(out.shape) != shape:
+        raise ValueError('out has shape %s, the model %s' %
+                                                (tuple(out.shape), shape))
+    else:
+        data = out
+    x0 = 0
+    for slab in iter_slabs(fp, dims, fix_coords):
+        data[x0:x0 + len(slab)] = slab
+        x0 += len(slab)
     return Voxels(data, dims, translate, scale, axis_order)
 
+def read_as_slabs(fp, fix_coords=True, slab_size=SLAB_SIZE):
+    """ Read binary binvox format as a stream of slabs.
+
+    Returns the model with an iterator over its voxels as data, in boolean
+    arrays of consecutive x-layers of about slab_size voxels each, in the
+    axis order of the model. The file is read and decoded lazily while
+    iterating, so only one slab is ever held in memory. The model can be
+    passed on to write as it is.
+
+    Doesn't do any checks on input except for the '#binvox' line.
+    """
+    dims, translate, scale = read_header(fp)
+    axis_order = 'xyz' if fix_coords else 'xzy'
+    return Voxels(iter_slabs(fp, dims, fix_coords, slab_size=slab_size),
+                                        dims, translate, scale, axis_order)
+
+def iter_runs(fp, chunk_bytes=CHUNK_BYTES):
+    """ Yields the values and counts of the runs of binvox data, read from
+    fp in chunks of about chunk_bytes. Mostly meant for internal use.
+    """
+    rest = b''
+    while True:
+        raw = fp.read(chunk_bytes)
+        if not raw:
+            break
+        raw = rest + raw
+        n = len(raw) - len(raw) % 2
+        rest = raw[n:]
+        raw_data = np.frombuffer(raw[:n], dtype=np.uint8)
+        yield raw_data[::2], raw_data[1::2]
+
+def iter_slabs(fp, dims, fix_coords=True, layers=None, slab_size=SLAB_SIZE):
+    """ Yields the voxels of binvox data (fp past the header) as boolean
+    arrays of 'layers' consecutive x-layers (about slab_size voxels if
+    None), in xyz order if fix_coords, xzy otherwise. Voxels missing at
+    the end of the data are empty. Mostly meant for internal use.
+    """
+    layer = dims[1]*dims[2]
+    if layers is None:
+        layers = max(1, slab_size // max(1, layer))
+    runs = iter_runs(fp)
+    # runs not decoded completely yet, as values and start and end indices
+    run_values = np.zeros(0, dtype=np.bool)
+    start_indices = np.zeros(0, dtype=np.int64)
+    end_indices = np.zeros(0, dtype=np.int64)
+    position = 0
+    for x0 in range(0, dims[0], layers):
+        x1 = min(x0 + layers, dims[0])
+        lo, hi = x0*layer, x1*layer
+        # reading on until the runs cover the slab
+        while position < hi:
+            try:
+                values, counts = next(runs)
+            except StopIteration:
+                break
+            if len(counts) == 0:
+                continue
+            ends = position + np.cumsum(counts, dtype=np.int64)
+            position = ends[-1]
+            run_values = np.concatenate((run_values, values.astype(np.bool)))
+            start_indices = np.concatenate((start_indices, ends - counts))
+            end_indices = np.concatenate((end_indices, ends))
+        # runs overlapping the slab, clipped to it
+        last = np.searchsorted(start_indices, hi, 'left')
+        lengths = np.minimum(end_indices[:last], hi) - \
+                                    np.maximum(start_indices[:last], lo)
+        slab = np.repeat(run_values[:last], lengths)
+        if len(slab) < hi - lo:
+            slab = np.concatenate((slab,
+                            np.zeros(hi - lo - len(slab), dtype=np.bool)))
+        slab = slab.reshape(x1 - x0, dims[1], dims[2])
+        if fix_coords:
+            slab = np.transpose(slab, (0, 2, 1))
+        yield slab
+        # dropping the runs that end in the slab
+        done = np.searchsorted(end_indices, hi, 'right')
+        run_values = run_values[done:]
+        start_indices = start_indices[done:]
+        end_indices = end_indices[done:]
+
 def read_as_coord_array(fp, fix_coords=True):
     """ Read binary binvox format as coordinates.
 
@@ -161,6 +260,28 @@ def read_as_coord_array(fp, fix_coords=True):
     scaling or translation.
 
     Use this to save memory if your model is very sparse (mostly empty).
+    The coordinates are int32 and the runs are expanded with array
+    operations, one chunk at a time (see read_as_coord_chunks).
+
+    Doesn't do any checks on input except for the '#binvox' line.
+    """
+    model = read_as_coord_chunks(fp, fix_coords)
+    data = np.empty((3, model.nvoxels), dtype=np.int32)
+    n = 0
+    for chunk in model.data:
+        data[:, n:n + chunk.shape[1]] = chunk
+        n += chunk.shape[1]
+    return Voxels(data, model.dims, model.translate, model.scale,
+                                                    model.axis_order)
+
+def read_as_coord_chunks(fp, fix_coords=True, chunk_size=SLAB_SIZE):
+    """ Read binary binvox format as coordinates, in chunks.
+
+    Like read_as_coord_array, but the data of the returned model is an
+    iterator over 3 x n int32 coordinate arrays of at most chunk_size
+    voxels each, in file order, so the voxels of a large model can be
+    processed without holding all of their coordinates. The total number
+    of voxels is stored as 'nvoxels' on the model.
 
     Doesn't do any checks on input except for the '#binvox' line.
     """
@@ -168,37 +289,73 @@ def read_as_coord_array(fp, fix_coords=True):
     raw_data = np.frombuffer(fp.read(), dtype=np.uint8)
 
     values, counts = raw_data[::2], raw_data[1::2]
+    end_indices = np.cumsum(counts, dtype=np.int64)
+    start_indices = end_indices - counts
+    # only the runs of set voxels matter
+    filled = values.astype(np.bool)
+    start_indices = start_indices[filled]
+    lengths = counts[filled].astype(np.int64)
+    # position of the first voxel of every run among the set voxels
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+
+    axis_order = 'xyz' if fix_coords else 'xzy'
+    model = Voxels(iter_coords(start_indices, offsets, dims, fix_coords,
+                        chunk_size), dims, translate, scale, axis_order)
+    model.nvoxels = int(offsets[-1])
+    return model
+
+def iter_coords(start_indices, offsets, dims, fix_coords, chunk_size):
+    """ Yields the coordinates of the set voxels of runs starting at
+    linear indices start_indices and at offsets among the set voxels, at
+    most chunk_size voxels at a time. Mostly meant for internal use.
+    """
+    total = int(offsets[-1])
+    for c0 in range(0, total, chunk_size):
+        c1 = min(c0 + chunk_size, total)
+        # runs overlapping the chunk and their number of voxels in it
+        first = np.searchsorted(offsets, c0, 'right') - 1
+        last = np.searchsorted(offsets, c1, 'left')
+        ncounts = np.diff(np.clip(offsets[first:last + 1], c0, c1))
+        # the voxels of a run follow on from its start index
+        nz_voxels = np.repeat(start_indices[first:last] - offsets[first:last],
+                                ncounts) + np.arange(c0, c1, dtype=np.int64)
+
+        # TODO are these dims correct?
+        # according to docs,
+        # index = x * wxh + z * width + y; // wxh = width * height = d * d
+        data = np.empty((3, c1 - c0), dtype=np.int32)
+        data[0] = nz_voxels // (dims[0]*dims[1])
+        zwpy = nz_voxels % (dims[0]*dims[1]) # z*w + y
+        z, y = (2, 1) if fix_coords else (1, 2)
+        data[z] = zwpy // dims[0]
+        data[y] = zwpy % dims[0]
+        yield data
+
+def read_as_block_array(fp, block=BLOCK, fix_coords=True):
+    """ Read binary binvox format as a block-sparse grid.
+
+    Returns binvox model with voxels in a block_grid.BlockGrid, which only
+    stores the blocks of block^3 voxels holding at least one voxel.
+
+    The runs are decoded one slab of 'block' x-layers at a time, so the
+    dense model is never allocated as a whole. Use this for large models
+    that are mostly empty.
 
-    sz = np.prod(dims)
-    index, end_index = 0, 0
-    end_indices = np.cumsum(counts)
-    indices = np.concatenate(([0], end_indices[:-1])).astype(end_indices.dtype)
-
-    values = values.astype(np.bool)
-    indices = indices[values]
-    end_indices = end_indices[values]
-
-    nz_voxels = []
-    for index, end_index in zip(indices, end_indices):
-        nz_voxels.extend(range(index, end_index))
-    nz_voxels = np.array(nz_voxels)
-    # TODO are these dims correct?
-    # according to docs,
-    # index = x * wxh + z * width + y; // wxh = width * height = d * d
-
-    x = nz_voxels / (dims[0]*dims[1])
-    zwpy = nz_voxels % (dims[0]*dims[1]) # z*w + y
-    z = zwpy / dims[0]
-    y = zwpy % dims[0]
+    Doesn't do any checks on input except for the '#binvox' line.
+    """
+    dims, translate, scale = read_header(fp)
     if fix_coords:
-        data = np.vstack((x, y, z))
+        grid = BlockGrid((dims[0], dims[2], dims[1]), block)
         axis_order = 'xyz'
     else:
-        data = np.vstack((x, z, y))
+        grid = BlockGrid(dims, block)
         axis_order = 'xzy'
+    for x0, slab in zip(range(0, dims[0], block),
+                                iter_slabs(fp, dims, fix_coords, block)):
+        if slab.any():
+            grid.set_region((x0, 0, 0), slab)
 
-    #return Voxels(data, dims, translate, scale, axis_order)
-    return Voxels(np.ascontiguousarray(data), dims, translate, scale, axis_order)
+    return Voxels(grid, dims, translate, scale, axis_order)
 
 def dense_to_sparse(voxel_data, dtype=np.int):
     """ From dense representation to sparse (coordinate) representation.
@@ -233,16 +390,19 @@ def write(voxel_model, fp):
     """ Write binary binvox format.
 
     Note that when saving a model in sparse (coordinate) format, it is first
-    converted to dense format.
+    converted to dense format. Dense (possibly memory-mapped) and
+    block-sparse models are reordered and run length encoded one slab of
+    x-layers at a time, with array operations. The data may also be an
+    iterable of slabs of consecutive x-layers (e.g. a generator, or the
+    data of read_as_slabs), which is consumed as it is written.
 
     Doesn't check if the model is 'sane'.
 
     """
-    if voxel_model.data.ndim==2:
+    voxel_data = voxel_model.data
+    if isinstance(voxel_data, np.ndarray) and voxel_data.ndim==2:
         # TODO avoid conversion to dense
-        dense_voxel_data = sparse_to_dense(voxel_model.data, voxel_model.dims)
-    else:
-        dense_voxel_data = voxel_model.data
+        voxel_data = sparse_to_dense(voxel_model.data, voxel_model.dims)
 
     fp.write('#binvox 1\n')
     fp.write('dim '+' '.join(map(str, voxel_model.dims))+'\n')
@@ -252,32 +412,80 @@ def write(voxel_model, fp):
     if not voxel_model.axis_order in ('xzy', 'xyz'):
         raise ValueError('Unsupported voxel model axis order')
 
-    if voxel_model.axis_order=='xzy':
-        voxels_flat = dense_voxel_data.flatten()
-    elif voxel_model.axis_order=='xyz':
-        voxels_flat = np.transpose(dense_voxel_data, (0, 2, 1)).flatten()
-
-    # keep a sort of state machine for writing run length encoding
-    state = voxels_flat[0]
-    ctr = 0
-    for c in voxels_flat:
-        if c==state:
-            ctr += 1
-            # if ctr hits max, dump
-            if ctr==255:
-                fp.write(chr(state))
-                fp.write(chr(ctr))
-                ctr = 0
+    # the run still open at the end of the former slab, as (value, length),
+    # carries over into the next one
+    run = None
+    for voxels_flat in get_slabs(voxel_data, voxel_model.axis_order):
+        if len(voxels_flat) == 0:
+            continue
+        values, lengths = get_runs(voxels_flat)
+        if run is not None and values[0] == run[0]:
+            lengths[0] += run[1]
+        elif run is not None:
+            values = np.concatenate(([run[0]], values))
+            lengths = np.concatenate(([run[1]], lengths))
+        run = (values[-1], lengths[-1])
+        fp.write(encode_runs(values[:-1], lengths[:-1]))
+    # flush out the last run
+    if run is not None:
+        fp.write(encode_runs(np.array([run[0]]), np.array([run[1]]),
+                                                            closed=False))
+
+def get_runs(voxels_flat):
+    """ Returns the values (as uint8) and lengths of the runs of equal
+    voxels in a flat array.
+    """
+    voxels_flat = np.asarray(voxels_flat).astype(np.uint8)
+    starts = np.flatnonzero(voxels_flat[1:] != voxels_flat[:-1]) + 1
+    starts = np.concatenate(([0], starts))
+    lengths = np.diff(np.concatenate((starts, [len(voxels_flat)])))
+    return voxels_flat[starts], lengths.astype(np.int64)
+
+def encode_runs(values, lengths, closed=True):
+    """ Returns the run length encoding of runs as binvox data bytes.
+
+    Runs are split into pairs of at most 255 voxels. As in the original
+    per-voxel encoder, a closed run (one followed by another run) whose
+    length is a multiple of 255 ends with an extra pair of count 0; the
+    last run of the data does not.
+    """
+    full, rest = np.divmod(lengths, 255)
+    extra = np.ones(len(lengths), dtype=np.bool) if closed else rest > 0
+    npairs = full + extra
+    pairs = np.empty((npairs.sum(), 2), dtype=np.uint8)
+    pairs[:, 0] = np.repeat(values, npairs)
+    pairs[:, 1] = 255
+    ends = np.cumsum(npairs) - 1
+    pairs[ends[extra], 1] = rest[extra]
+    return pairs.tostring()
+
+def get_slabs(data, axis_order, slab_size=SLAB_SIZE):
+    """ Yields the voxels of a dense array, a BlockGrid or an iterable of
+    slabs flattened in binvox (xzy) order, one slab of x-layers (of about
+    slab_size voxels, one layer of blocks, or as given) at a time.
+    """
+    if not isinstance(data, (BlockGrid, np.ndarray)):
+        for slab in data:
+            slab = np.asarray(slab)
+            if axis_order=='xyz':
+                slab = np.transpose(slab, (0, 2, 1))
+            yield slab.flatten()
+        return
+    if isinstance(data, BlockGrid):
+        dims = data.get_dims()
+        step = data.get_block_size()
+    else:
+        dims = data.shape
+        step = max(1, slab_size // max(1, dims[1]*dims[2]))
+    for x0 in range(0, dims[0], step):
+        x1 = min(x0 + step, dims[0])
+        if isinstance(data, BlockGrid):
+            slab = data.get_region((x0, 0, 0), (x1, dims[1], dims[2]))
         else:
-            # if switch state, dump
-            fp.write(chr(state))
-            fp.write(chr(ctr))
-            state = c
-            ctr = 1
-    # flush out remainders
-    if ctr > 0:
-        fp.write(chr(state))
-        fp.write(chr(ctr))
+            slab = data[x0:x1]
+        if axis_order=='xyz':
+            slab = np.transpose(slab, (0, 2, 1))
+        yield slab.flatten()
 
 if __name__ == '__main__':
     import doctest
@@ -0,0 +1,227 @@
+#    MAD Lab, University at Buffalo
+#    Copyright (C) 2018  Prakhar Jaiswal <prakharj@buffalo.edu>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Block-sparse voxel grids for large, mostly empty models.
+
+The grid is split into cubic blocks of BLOCK^3 voxels (smaller at the far
+edges) and only the blocks holding at least one voxel are stored, each as a
+dense numpy boolean array. Thin-walled parts at high resolutions and padded
+grids, which are mostly empty by construction, take memory in proportion to
+the number of occupied blocks only. Regions of the grid are converted to
+dense arrays on demand (see get_region), so slabs or windows can be
+processed without allocating the full cube.
+"""
+
+import numpy as np
+
+# default edge length of the blocks in voxels
+BLOCK = 32
+
+class BlockGrid:
+    '''
+    The BlockGrid class holds a binary voxel grid of 'dims' as a dictionary
+    from block index (i, j, k) to the dense boolean block of voxels
+    [i*block, (i+1)*block) x [j*block, ...) x [k*block, ...)
+    Empty blocks are never stored
+    '''
+
+    def __init__(self, dims, block = BLOCK):
+        self.dims = tuple(int(dim) for dim in dims)
+        self.block = int(block)
+        self.blocks = {}
+
+    def get_dims(self):
+        return self.dims
+
+    def get_block_size(self):
+        return self.block
+
+    def get_grid_shape(self):
+        '''
+        Returns the number of blocks along each axis
+        '''
+        return tuple(-(-dim // self.block) for dim in self.dims)
+
+    def get_block_bounds(self, index):
+        '''
+        Returns the first and one past the last voxel of block 'index'
+        '''
+        lo = tuple(i * self.block for i in index)
+        hi = tuple(min(l + self.block, dim) for l, dim in zip(lo, self.dims))
+        return lo, hi
+
+    def get_block(self, index):
+        '''
+        Returns the block 'index' or None if it is empty
+        '''
+        return self.blocks.get(tuple(index))
+
+    def set_block(self, index, data):
+        '''
+        Sets the block 'index' to 'data', dropping it if it is empty
+        '''
+        index = tuple(int(i) for i in index)
+        if data is None or not data.any():
+            self.blocks.pop(index, None)
+        else:
+            self.blocks[index] = np.asarray(data, dtype = bool)
+
+    def get_indices(self):
+        '''
+        Returns the indices of the non-empty blocks in x, y, z order
+        '''
+        return sorted(self.blocks)
+
+    def get_volume(self):
+        '''
+        Returns the number of set voxels
+        '''
+        return sum(int(np.count_nonzero(data))
+                                    for data in self.blocks.values())
+
+    def get_nbytes(self):
+        return sum(data.nbytes for data in self.blocks.values())
+
+    def isempty(self):
+        return len(self.blocks) == 0
+
+    def copy(self):
+        grid = BlockGrid(self.dims, self.block)
+        for index, data in self.blocks.items():
+            grid.blocks[index] = data.copy()
+        return grid
+
+    def get_region(self, lo, hi, dtype = bool):
+        '''
+        Returns the voxels in the box [lo, hi) as dense 3D numpy array,
+        assembled from the non-empty blocks that overlap it
+        '''
+        lo = np.array(lo, dtype = int)
+        hi = np.array(hi, dtype = int)
+        out = np.zeros(hi - lo, dtype = dtype)
+        first = np.maximum(lo, 0) // self.block
+        last = (np.minimum(hi, self.dims) - 1) // self.block
+        for index in self.blocks:
+            if np.any(np.array(index) < first) or \
+                                            np.any(np.array(index) > last):
+                continue
+            blo, bhi = self.get_block_bounds(index)
+            s = np.maximum(lo, blo)
+            e = np.minimum(hi, bhi)
+            if np.any(e <= s):
+                continue
+            out[s[0]-lo[0]:e[0]-lo[0], s[1]-lo[1]:e[1]-lo[1],
+                    s[2]-lo[2]:e[2]-lo[2]] = self.blocks[index][
+                    s[0]-blo[0]:e[0]-blo[0], s[1]-blo[1]:e[1]-blo[1],
+                    s[2]-blo[2]:e[2]-blo[2]]
+        return out
+
+    def set_region(self, lo, data):
+        '''
+        Sets the voxels in the box starting at 'lo' to the dense 3D array
+        'data' (parts outside the grid are ignored)
+        '''
+        lo = np.array(lo, dtype = int)
+        hi = np.minimum(lo + np.array(data.shape), self.dims)
+        start = np.maximum(lo, 0)
+        if np.any(hi <= start):
+            return
+        first = start // self.block
+        last = (hi - 1) // self.block
+        for i in range(first[0], last[0] + 1):
+            for j in range(first[1], last[1] + 1):
+                for k in range(first[2], last[2] + 1):
+                    index = (i, j, k)
+                    blo, bhi = self.get_block_bounds(index)
+                    s = np.maximum(start, blo)
+                    e = np.minimum(hi, bhi)
+                    block = self.blocks.get(index)
+                    if block is None:
+                        block = np.zeros(np.array(bhi) - blo, dtype = bool)
+                    else:
+                        block = block.copy()
+                    block[s[0]-blo[0]:e[0]-blo[0], s[1]-blo[1]:e[1]-blo[1],
+                            s[2]-blo[2]:e[2]-blo[2]] = data[
+                            s[0]-lo[0]:e[0]-lo[0], s[1]-lo[1]:e[1]-lo[1],
+                            s[2]-lo[2]:e[2]-lo[2]] > 0.5
+                    self.set_block(index, block)
+
+    def to_dense(self, dtype = bool):
+        '''
+        Returns the whole grid as dense 3D numpy array
+        '''
+        return self.get_region((0, 0, 0), self.dims, dtype)
+
+    def pad(self, dims):
+        '''
+        Returns the grid centered in a larger grid of 'dims', placed the
+        same way as by Shape.pad_voxel
+        Block-aligned offsets move the blocks without copying the voxels
+        '''
+        offset = (np.array(dims, dtype = int) - self.dims) // 2
+        grid = BlockGrid(dims, self.block)
+        if np.all(offset % self.block == 0) and \
+                            np.all(np.array(self.dims) % self.block == 0):
+            shift = offset // self.block
+            for index, data in self.blocks.items():
+                grid.blocks[tuple(np.array(index) + shift)] = data
+        else:
+            for index, data in self.blocks.items():
+                blo, bhi = self.get_block_bounds(index)
+                grid.set_region(offset + blo, data)
+        return grid
+
+    def combine(self, other, operation):
+        '''
+        Returns the blockwise combination of two grids of equal dims and
+        block size with the numpy 'operation' (e.g. np.logical_or)
+        Blocks empty in both grids are skipped
+        '''
+        if self.dims != other.dims or self.block != other.block:
+            raise ValueError('Block grids of different dims or block size')
+        grid = BlockGrid(self.dims, self.block)
+        for index in set(self.blocks) | set(other.blocks):
+            a = self.blocks.get(index)
+            b = other.blocks.get(index)
+            if a is None or b is None:
+                lo, hi = self.get_block_bounds(index)
+                empty = np.zeros(np.array(hi) - lo, dtype = bool)
+                a = empty if a is None else a
+                b = empty if b is None else b
+            grid.set_block(index, operation(a, b))
+        return grid
+
+    def union(self, other):
+        return self.combine(other, np.logical_or)
+
+    def intersection(self, other):
+        return self.combine(other, np.logical_and)
+
+    def difference(self, other):
+        '''
+        Returns the voxels set in this grid and not in 'other'
+        '''
+        return self.combine(other, lambda a, b: a & ~b)
+
+def dense_to_blocks(voxel, block = BLOCK):
+    '''
+    Converts a dense 3D numpy array (voxels larger than 0.5 are set) to a
+    BlockGrid
+    '''
+    grid = BlockGrid(voxel.shape, block)
+    grid.set_region((0, 0, 0), voxel)
+    return grid
@@ -0,0 +1,222 @@
+#    MAD Lab, University at Buffalo
+#    Copyright (C) 2018  Prakhar Jaiswal <prakharj@buffalo.edu>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Level-of-detail surfaces for the display of large voxel models.
+
+The time to extract the iso-surface of a voxel model and the number of its
+triangles grow with the resolution, so models of 256^3 voxels and more are
+displayed from downsampled grids. Every voxel of a downsampled grid covers
+factor^3 voxels of the model and is set if any of them is (max-pooling),
+so thin walls never vanish. A model is unpacked and downsampled to a
+coarse grid (COARSE_VOXELS) in the background and shown from it first,
+refined in the background to the default level of detail (DETAIL_VOXELS)
+and shown at full resolution only when zoomed in or asked for (see
+main.py). Every surface is decimated down to a triangle budget.
+"""
+
+import numpy as np
+
+from shape import get_slabs
+
+# voxels of the grid a model is displayed from first and by default
+COARSE_VOXELS = 1 << 18
+DETAIL_VOXELS = 1 << 21
+# triangles a displayed surface is decimated to
+TRIANGLE_BUDGET = 500000
+# estimated triangles of the extracted surface per face of a set voxel
+# that borders an empty one
+TRIANGLES_PER_FACE = 2
+
+def get_factor(dims, voxels):
+    '''
+    Returns the smallest power of two downsampling factor that leaves at
+    most 'voxels' voxels of a grid of 'dims'
+    '''
+    dims = np.array(dims, dtype = np.int64)
+    factor = 1
+    while np.prod(-(-dims // factor)) > voxels:
+        factor *= 2
+    return factor
+
+def downsample(voxel, factor):
+    '''
+    Returns the voxel grid downsampled by 'factor' along each axis as 3D
+    numpy array of 0's and 1's (uint8), each voxel set if any of the
+    voxels it covers is set (larger than 0.5)
+    Dims not divisible by 'factor' are extended with empty voxels
+    '''
+    dims = np.array(voxel.shape)
+    out = np.zeros(-(-dims // factor), dtype = np.uint8)
+    for sl in get_slabs(voxel, factor):
+        slab = voxel[sl] > 0.5
+        slab = np.pad(slab, [(0, -n % factor) for n in slab.shape],
+                                                            'constant')
+        n = [dim // factor for dim in slab.shape]
+        slab = slab.reshape(n[0], factor, n[1], factor, n[2], factor)
+        start = sl.start // factor
+        out[start:start + n[0]] = slab.any(axis = 5).any(axis = 3).any(
+                                                                axis = 1)
+    return out
+
+def count_faces(voxel):
+    '''
+    Returns the number of faces between set and empty voxels (larger and
+    not larger than 0.5), the voxels outside the grid taken as empty
+    '''
+    faces = 0
+    last = None
+    for sl in get_slabs(voxel):
+        slab = voxel[sl] > 0.5
+        # faces along the first axis, to the last layer of the former slab
+        layers = slab if last is None else np.concatenate((last, slab))
+        faces += np.count_nonzero(layers[1:] != layers[:-1])
+        faces += np.count_nonzero(slab[:, 1:] != slab[:, :-1])
+        faces += np.count_nonzero(slab[:, :, 1:] != slab[:, :, :-1])
+        faces += np.count_nonzero(slab[:, [0, -1]])
+        faces += np.count_nonzero(slab[:, :, [0, -1]])
+        if last is None:
+            faces += np.count_nonzero(slab[0])
+        last = slab[-1:]
+    if last is not None:
+        faces += np.count_nonzero(last)
+    return faces
+
+def get_reduction(voxel, budget = TRIANGLE_BUDGET):
+    '''
+    Returns the fraction of the triangles of the surface of 'voxel' to
+    drop in the decimation to keep about 'budget' triangles
+    '''
+    triangles = TRIANGLES_PER_FACE * count_faces(voxel)
+    if triangles <= budget:
+        return 0.0
+    return min(0.99, 1.0 - float(budget) / triangles)
+
+def get_level(voxel, factor, budget = TRIANGLE_BUDGET):
+    '''
+    Returns 'voxel' downsampled by 'factor' and the decimation of its
+    surface to about 'budget' triangles
+    '''
+    data = voxel if factor == 1 else downsample(voxel, factor)
+    return data, get_reduction(data, budget)
+
+def get_coarse_level(shape, budget = TRIANGLE_BUDGET):
+    '''
+    Unpacks the voxel data of 'shape' and downsamples it to the coarse
+    level of detail, the work of displaying a new model that is done in a
+    background thread (see main.py)
+    Output: the voxel grid, the version of the shape it belongs to and its
+    levels {factor: (grid, reduction)}, as taken by SurfaceView
+    '''
+    version = shape.get_version()
+    voxel = shape.get_voxel()
+    factor = get_factor(voxel.shape, COARSE_VOXELS)
+    return voxel, version, {factor: get_level(voxel, factor, budget)}
+
+class SurfaceView:
+    '''
+    The SurfaceView class displays the surface of a voxel model in a mayavi
+    scene at a level of detail (downsampling factor) that can be changed
+    It is made from the unpacked voxel grid of a shape and the levels
+    computed so far (see get_coarse_level), so that no voxel data is
+    unpacked or downsampled on the GUI thread
+    The downsampled grids are computed on demand and kept, get_level can
+    be called from a background thread, all other methods not
+    '''
+
+    def __init__(self, mlab, voxel, version, levels = None, contours = [1],
+            color = (1, 0, 0), opacity = 0.5, budget = TRIANGLE_BUDGET):
+        self.mlab = mlab
+        self.voxel = voxel
+        self.version = version
+        self.contours = contours
+        self.color = color
+        self.opacity = opacity
+        self.budget = budget
+        self.visible = True
+        # downsampled grids and decimation of their surfaces by factor
+        self.levels = dict(levels or {})
+        # factors of the grids being computed in the background
+        self.pending = set()
+        # the displayed factor and the data source of its pipeline
+        self.factor = None
+        self.source = None
+        self.surface = None
+
+    def get_version(self):
+        return self.version
+
+    def get_factor(self):
+        return self.factor
+
+    def get_coarse_factor(self):
+        return get_factor(self.voxel.shape, COARSE_VOXELS)
+
+    def get_detail_factor(self):
+        return get_factor(self.voxel.shape, DETAIL_VOXELS)
+
+    def has_level(self, factor):
+        return factor in self.levels
+
+    def get_level(self, factor):
+        '''
+        Returns the voxel grid downsampled by 'factor' and the decimation
+        of its surface, computed once
+        '''
+        if factor not in self.levels:
+            self.levels[factor] = get_level(self.voxel, factor, self.budget)
+        return self.levels[factor]
+
+    def set_level(self, factor):
+        '''
+        Displays the surface of the grid downsampled by 'factor', replacing
+        the one displayed before
+        '''
+        data, reduction = self.get_level(factor)
+        self.remove()
+        pipeline = self.mlab.pipeline
+        self.source = pipeline.scalar_field(data)
+        # the downsampled voxels are placed at the centers of the voxels of
+        # the model they cover
+        self.source.spacing = [factor] * 3
+        self.source.origin = [(factor - 1) / 2.0] * 3
+        contour = pipeline.contour(self.source)
+        contour.filter.contours = list(self.contours)
+        decimate = pipeline.decimate_pro(contour)
+        decimate.filter.target_reduction = reduction
+        self.surface = pipeline.surface(decimate, color = self.color,
+                                                opacity = self.opacity)
+        self.surface.visible = self.visible
+        self.factor = factor
+
+    def set_visible(self, flag = True):
+        self.visible = flag
+        if self.surface is not None:
+            self.surface.visible = flag
+
+    def is_visible(self):
+        return self.visible
+
+    def remove(self):
+        '''
+        Removes the displayed surface from the scene
+        '''
+        if self.source is not None:
+            # removing the data source removes its whole pipeline
+            self.source.remove()
+        self.source = None
+        self.surface = None
+        self.factor = None
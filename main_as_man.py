@@ -31,38 +31,189 @@ os.environ['ETS_TOOLKIT'] = 'qt4'
 import sip
 sip.setapi('QString', 2)
 
-from traits.api import HasTraits, Instance, on_trait_change
+from traits.api import HasTraits, Instance, Dict, List, Bool, Float, \
+        on_trait_change
 from traitsui.api import View, Item
 from mayavi import mlab
 from mayavi.core.ui.api import MayaviScene, MlabSceneModel, \
         SceneEditor
 
 from PyQt4 import QtGui, QtCore
+import tempfile
 import numpy as np
 from numpy import *
-from scipy.ndimage.interpolation import shift
 
-from shape import Shape         
+from shape import Shape
+from morphology import prepare_shapes, get_as_manufactured
+from multires import get_as_manufactured_multires
+from worker import ComputeThread
+from lod import SurfaceView, get_coarse_level
+from voxel_file import EXTENSION
+
+# file types offered by the save dialogs
+SAVE_FILTER = 'binvox (*.binvox);;Morph3D voxels (*%s)' % EXTENSION
+# highest resolution offered by the spin boxes
+MAX_RESOLUTION = 1024
+# above this resolution the grids are memory-mapped in SCRATCH_DIR, which
+# has them convolved tile by tile (see get_scratch)
+SCRATCH_RESOLUTION = 256
+SCRATCH_DIR = os.path.join(tempfile.gettempdir(), 'morph3d')
 
 ################################################################################
 # The Visualization class
 class Visualization(HasTraits):
     scene = Instance(MlabSceneModel, ())
 
+    # the displayed surface of every shape, name -> SurfaceView or None
+    views = Dict()
+    # whether to display all surfaces at full resolution
+    full_detail = Bool(False)
+    # camera distance when the first surface was displayed, zooming in
+    # from there refines the surfaces
+    distance = Float(0)
+    # the threads unpacking new models and computing their coarse level of
+    # detail in the background, the shape versions they load by name and
+    # their results (see lod.get_coarse_level) by name
+    loaders = List()
+    loading = Dict()
+    loaded = Dict()
+    # the threads computing finer levels of detail in the background
+    refiners = List()
+    # set while refine runs, as displaying a surface moves the camera
+    refining = Bool(False)
+
+    def get_shapes(self):
+        '''
+        Returns the displayed shapes as (name, shape, color, opacity)
+        '''
+        return [('alpha', alpha, (1, 1, 0), 0.3),
+                ('beta', beta, (0, 0, 1), 0.5),
+                ('as_man', as_man, (0, 1, 0), 0.3),
+                ('non_man', non_man, (1, 0, 0), 0.5)]
+
     @on_trait_change('scene.activated')
+    def activated(self):
+        '''
+        Displays the voxel models once the scene is ready and refines them
+        when the camera zooms in
+        '''
+        self.scene.camera.add_observer('ModifiedEvent',
+                                        lambda obj, event: self.refine())
+        self.update_plot()
+
     def update_plot(self):
         '''
-        Clears the current mayavi screen and redraws all four voxel models
-        '''
-        self.scene.mlab.clf()
-        alpha.display(self.scene.mlab, contours = [1],
-                        color = (1, 1, 0), opacity = 0.3)
-        beta.display(self.scene.mlab, contours = [1],
-                        color = (0, 0, 1), opacity = 0.5)
-        as_man.display(self.scene.mlab, contours = [1],
-                        color = (0, 1, 0), opacity = 0.3)
-        non_man.display(self.scene.mlab, contours = [1],
-                        color = (1, 0, 0), opacity = 0.5)
+        Updates the display of all four voxel models
+        Every shape keeps its own surface, which is shown or hidden in place
+        and extracted again only if the voxel data of the shape changed
+        New surfaces are shown at a coarse level of detail first, which is
+        computed in the background (see start_loader); only the finished
+        grids are displayed here
+        '''
+        self.scene.disable_render = True
+        try:
+            for name, shape, color, opacity in self.get_shapes():
+                view = self.views.get(name)
+                if shape.visible and (view is None or
+                                view.get_version() != shape.get_version()):
+                    if view is not None:
+                        view.remove()
+                    view = None
+                    loaded = self.loaded.pop(name, None)
+                    if loaded is not None and \
+                                        loaded[1] == shape.get_version():
+                        voxel, version, levels = loaded
+                        view = SurfaceView(self.scene.mlab, voxel, version,
+                                levels, contours = [1], color = color,
+                                opacity = opacity)
+                        view.set_level(view.get_coarse_factor())
+                        if self.distance == 0:
+                            self.distance = self.scene.camera.distance
+                    elif not shape.isempty():
+                        self.start_loader(name, shape)
+                    self.views[name] = view
+                if view is not None:
+                    view.set_visible(shape.visible)
+        finally:
+            self.scene.disable_render = False
+        self.refine()
+
+    def get_factor(self, view):
+        '''
+        Returns the downsampling factor 'view' is to be displayed at, the
+        default level of detail halved for every doubling of the zoom
+        '''
+        if self.full_detail:
+            return 1
+        factor = view.get_detail_factor()
+        zoom = self.distance / max(self.scene.camera.distance, 1e-9)
+        while factor > 1 and zoom >= 2:
+            factor //= 2
+            zoom /= 2
+        return factor
+
+    def refine(self):
+        '''
+        Brings the visible surfaces to the level of detail they are to be
+        displayed at, computing the downsampled grids in the background
+        '''
+        if self.refining:
+            return
+        self.refining = True
+        try:
+            for view in self.views.values():
+                if view is None or not view.is_visible():
+                    continue
+                factor = self.get_factor(view)
+                if factor == view.get_factor() or factor in view.pending:
+                    continue
+                if view.has_level(factor):
+                    view.set_level(factor)
+                else:
+                    self.start_refiner(view, factor)
+        finally:
+            self.refining = False
+
+    def start_loader(self, name, shape):
+        '''
+        Unpacks the voxel data of 'shape' and computes its coarse level of
+        detail in a background thread, and displays it once it is done
+        '''
+        version = shape.get_version()
+        if self.loading.get(name) == version:
+            return
+        loader = ComputeThread(lambda progress: get_coarse_level(shape))
+        self.loading[name] = version
+        def done(result):
+            # the results of loads superseded by a newer one are dropped
+            if self.loading.get(name) == version:
+                self.loaded[name] = result
+        def finished():
+            self.loaders.remove(loader)
+            # a failed load is not retried until the shape changes
+            if self.loading.get(name) == version and name in self.loaded:
+                del self.loading[name]
+                self.update_plot()
+        loader.done.connect(done)
+        loader.finished.connect(finished)
+        self.loaders.append(loader)
+        loader.start()
+
+    def start_refiner(self, view, factor):
+        '''
+        Computes the grid of 'view' downsampled by 'factor' in a background
+        thread and refines the display once it is done
+        '''
+        refiner = ComputeThread(lambda progress: view.get_level(factor))
+        view.pending.add(factor)
+        def finished():
+            view.pending.discard(factor)
+            self.refiners.remove(refiner)
+            if view in self.views.values():
+                self.refine()
+        refiner.finished.connect(finished)
+        self.refiners.append(refiner)
+        refiner.start()
 
     view = View(Item('scene', editor=SceneEditor(scene_class=MayaviScene),
                 height=600, width=800, show_label=False), resizable=True)
@@ -95,6 +246,16 @@ class Window(QtGui.QMainWindow):
         super(Window, self).__init__()
         self.setWindowTitle("Morph3D")
         self.setStyleSheet('background-color: white')
+        # the background computation (a ComputeThread) while it runs, and
+        # whether to start it again once it stopped
+        self.worker = None
+        self.restart = False
+        self.computed_ok = False
+        # the background threads saving results and reading the parts, and
+        # the latest read of each part ('A' or 'B')
+        self.savers = []
+        self.readers = []
+        self.reading = {}
         self.home()
         
     def home(self):
@@ -138,6 +299,12 @@ class Window(QtGui.QMainWindow):
         self.partB.resize(self.partB.sizeHint())
         self.file_grid.addWidget(self.partB, 2, 0)
         
+        # progress bar of the background computation, shown while it runs
+        self.progress = QtGui.QProgressBar(self.container)
+        self.progress.setRange(0, 100)
+        self.progress.hide()
+        self.file_grid.addWidget(self.progress, 3, 0)
+        
         # adding file subgrid to layout
         self.layout.addLayout(self.file_grid, 0, 0)
         
@@ -158,7 +325,7 @@ class Window(QtGui.QMainWindow):
         # spin-box to set resolution for shape A
         self.resA = QtGui.QSpinBox(self.container)
         self.resA.setPrefix("A: ")
-        self.resA.setRange(16, 128)
+        self.resA.setRange(16, MAX_RESOLUTION)
         self.resA.setValue(64)
         self.resA.setSingleStep(16)
         self.resA.resize(self.resA.minimumSizeHint())
@@ -168,7 +335,7 @@ class Window(QtGui.QMainWindow):
         # spin-box to set resolution for shape B
         self.resB = QtGui.QSpinBox(self.container)
         self.resB.setPrefix("B: ")
-        self.resB.setRange(16, 128)
+        self.resB.setRange(16, MAX_RESOLUTION)
         self.resB.setValue(64)
         self.resB.setSingleStep(16)
         self.resB.resize(self.resB.minimumSizeHint())
@@ -252,6 +419,12 @@ class Window(QtGui.QMainWindow):
         self.vis_grid.addWidget(self.as_man_cb)
         self.vis_grid.addWidget(self.non_man_cb)
         
+        # checkbox to display the surfaces at full resolution instead of
+        # at the level of detail set by the zoom
+        self.detail_cb = QtGui.QCheckBox("Full detail", self.container)
+        self.detail_cb.stateChanged.connect(self.detail_vis)
+        self.vis_grid.addWidget(self.detail_cb)
+        
         # adding visibility subsubgrid inside right subgrid
         self.right_grid.addLayout(self.vis_grid, 3, 0)
         
@@ -295,7 +468,7 @@ class Window(QtGui.QMainWindow):
         if len(name) != 0:
             self.partA.setText("Part A: " + name)
             alpha.set_filename(name)
-            alpha.read_voxel()
+            self.start_reader('A', alpha)
             self.resetAll()
         
     def file_openB(self):
@@ -308,9 +481,49 @@ class Window(QtGui.QMainWindow):
         if len(name) != 0:
             self.partB.setText("Part B: " + name)
             beta.set_filename(name)
-            beta.read_voxel()
+            self.start_reader('B', beta)
             self.resetAll()
         
+    def start_reader(self, part, shape):
+        '''
+        Reads the voxel model of part 'A' or 'B' in a background thread, on
+        a copy of its shape 'shape', and displays it once it is read
+        A read is dropped if the part was opened again meanwhile
+        '''
+        shape = shape.copy_settings()
+        def read(progress):
+            shape.read_voxel()
+            return shape
+        reader = ComputeThread(read, self)
+        reader.done.connect(lambda shape: self.read_done(part, reader, shape))
+        reader.failed.connect(self.compute_failed)
+        reader.finished.connect(lambda: self.readers.remove(reader))
+        self.readers.append(reader)
+        self.reading[part] = reader
+        reader.start()
+    
+    def read_done(self, part, reader, shape):
+        '''
+        Reader 'done' callback function
+        Replaces the shape of part 'A' or 'B' with the one read, keeping the
+        settings changed while it was read
+        '''
+        global alpha, beta
+        if self.reading.get(part) is not reader:
+            return
+        del self.reading[part]
+        if part == 'A':
+            shape.set_resolution(alpha.get_resolution())
+            shape.set_scale(alpha.get_scale())
+            shape.set_visibility(self.partA_cb.isChecked())
+            alpha = shape
+        else:
+            shape.set_resolution(beta.get_resolution())
+            shape.set_scale(beta.get_scale())
+            shape.set_visibility(self.partB_cb.isChecked())
+            beta = shape
+        self.update()
+    
     def res_changeA(self, value):
         '''
         Spin-box 'resA' callback function
@@ -318,7 +531,7 @@ class Window(QtGui.QMainWindow):
         '''
         global alpha
         alpha.set_resolution(value)
-        self.reset()
+        self.changed()
         
     def res_changeB(self, value):
         '''
@@ -327,7 +540,7 @@ class Window(QtGui.QMainWindow):
         '''
         global beta
         beta.set_resolution(value)
-        self.reset()
+        self.changed()
         
     def scale_changeA(self, value):
         '''
@@ -336,7 +549,7 @@ class Window(QtGui.QMainWindow):
         '''
         global alpha
         alpha.set_scale(value)
-        self.reset()
+        self.changed()
         
     def scale_changeB(self, value):
         '''
@@ -345,7 +558,7 @@ class Window(QtGui.QMainWindow):
         '''
         global beta
         beta.set_scale(value)
-        self.reset()
+        self.changed()
         
     def partA_vis(self):
         '''
@@ -383,34 +596,146 @@ class Window(QtGui.QMainWindow):
         non_man.toggle_visibility()
         self.update()
         
+    def detail_vis(self):
+        '''
+        Checkbox 'detail_cb' callback function
+        Toggles the display at full resolution
+        '''
+        visualization = self.mayavi_widget.visualization
+        visualization.full_detail = self.detail_cb.isChecked()
+        visualization.refine()
+        
     def save_as_man_cb(self):
         '''
         Pushbutton 'save_as_man' callback function
-        Prompts the user to save shape 'as_man' as binvox file
+        Prompts the user to save shape 'as_man' as binvox or native file
         '''
         global as_man
-        name = QtGui.QFileDialog.getSaveFileName(self, 'Save File')
-        as_man.write_voxel(name)
+        self.save_shape(as_man, 'as-manufactured')
         
     def save_non_man_cb(self):
         '''
         Pushbutton 'save_non_man' callback function
-        Prompts the user to save shape 'non_man' as binvox file
+        Prompts the user to save shape 'non_man' as binvox or native file
         '''
         global non_man
-        name = QtGui.QFileDialog.getSaveFileName(self, 'Save File')
-        non_man.write_voxel(name)
-        
+        self.save_shape(non_man, 'non-manufacturable')
+        
+    def save_shape(self, shape, operation):
+        '''
+        Prompts the user for a file name and saves the result 'shape' of
+        'operation' in the background, as native file (see voxel_file.py)
+        if the name ends with its extension, as binvox file otherwise
+        '''
+        name = QtGui.QFileDialog.getSaveFileName(self, 'Save File', '',
+                                                        SAVE_FILTER)
+        if len(name) == 0:
+            return
+        info = {'operation': operation, 'partA': alpha.get_filename(),
+                'partB': beta.get_filename()}
+        saver = ComputeThread(lambda progress:
+                        shape.write_voxel(name, info = info), self)
+        saver.failed.connect(self.compute_failed)
+        saver.finished.connect(lambda: self.savers.remove(saver))
+        self.savers.append(saver)
+        saver.start()
+    
     def compute(self):
         '''
         Pushbutton 'morph' callback function
-        Computes the minkowski sum and difference and displays it
+        Starts computing the as manufactured model in the background,
+        or cancels the running computation
+        '''
+        if self.worker is None:
+            self.start_compute()
+        else:
+            self.restart = False
+            self.worker.cancel()
+            self.morph.setText('Cancelling...')
+            self.morph.setEnabled(False)
+    
+    def start_compute(self):
+        '''
+        Starts the background computation on copies of 'alpha' and 'beta',
+        whose grids are memory-mapped at high resolutions (see get_scratch)
+        The pushbutton 'morph' turns into a cancel button meanwhile
+        '''
+        shapes = (alpha.copy_settings(), beta.copy_settings())
+        scratch = get_scratch(alpha, beta)
+        for shape in shapes:
+            shape.set_scratch(scratch)
+        self.worker = ComputeThread(lambda progress:
+                        compute_job(shapes[0], shapes[1], progress), self)
+        self.worker.progress.connect(self.show_progress)
+        self.worker.done.connect(self.computed)
+        self.worker.failed.connect(self.compute_failed)
+        self.worker.finished.connect(self.compute_finished)
+        self.computed_ok = False
+        self.morph.setText('CANCEL')
+        self.morph.setEnabled(True)
+        self.progress.setValue(0)
+        self.progress.show()
+        self.worker.start()
+    
+    def show_progress(self, fraction, message):
+        '''
+        Worker 'progress' callback function
         '''
-        compute()
+        self.progress.setValue(int(100*fraction))
+        self.progress.setFormat(message + ' (%p%)')
+    
+    def computed(self, results):
+        '''
+        Worker 'done' callback function
+        Replaces the shapes with the computed ones and displays them
+        Results of inputs changed in the meantime are dropped
+        '''
+        global alpha, beta, as_man, non_man
+        if self.restart:
+            return
+        alpha, beta, result1, result2 = results
+        alpha.set_visibility(self.partA_cb.isChecked())
+        beta.set_visibility(self.partB_cb.isChecked())
+        if result1 is not None:
+            as_man, non_man = result1, result2
+            as_man.set_visibility(self.as_man_cb.isChecked())
+            non_man.set_visibility(self.non_man_cb.isChecked())
+        self.computed_ok = True
         self.morph.setText('Done!')
         self.morph.setEnabled(False)
         self.update()
     
+    def compute_failed(self, error):
+        '''
+        Worker 'failed' callback function
+        '''
+        QtGui.QMessageBox.critical(self, 'Morph3D', error)
+    
+    def compute_finished(self):
+        '''
+        Worker 'finished' callback function
+        Starts the computation again if the inputs changed while it ran
+        '''
+        self.worker = None
+        self.progress.hide()
+        if self.restart:
+            self.restart = False
+            self.start_compute()
+        elif not self.computed_ok:
+            self.reset()
+    
+    def changed(self):
+        '''
+        Called when the inputs change
+        Restarts a running computation with the new inputs, otherwise
+        resets the pushbutton 'morph'
+        '''
+        if self.worker is not None:
+            self.restart = True
+            self.worker.cancel()
+        else:
+            self.reset()
+    
     def update(self):
         '''
         Updates the mayavi subwindow display
@@ -430,9 +755,11 @@ class Window(QtGui.QMainWindow):
         shapes as_man and non_man
         '''
         global as_man, non_man
-        self.reset()
+        self.changed()
         as_man = Shape()
         non_man = Shape()
+        as_man.set_packed(True)
+        non_man.set_packed(True)
         as_man.set_visibility(self.as_man_cb.isChecked())
         non_man.set_visibility(self.non_man_cb.isChecked())
         self.update()
@@ -440,65 +767,29 @@ class Window(QtGui.QMainWindow):
 ################################################################################
 # Global functions
 
-def get_norm_corr(alpha, beta):
+def get_scratch(alpha, beta):
     '''
-    Computes normalized convolution of two shapes (3D rasterized models)
-    Uses Fast Fourier Transform (FFT) to compute convolution efficiently
-    Input: 'alpha' and 'beta' - Instances of class 'Shape()'
-    Output: 'corr' - Instance of class 'Shape()'
+    Returns the directory the grids of 'alpha' and 'beta' are memory-mapped
+    in while computing, SCRATCH_DIR if either resolution is above
+    SCRATCH_RESOLUTION and None (in memory) otherwise
     '''
-    # taking Fourier tranform of shapes 'alpha' and 'beta'
-    alpha.fourier_transform()
-    beta.fourier_transform()
-    
-    # setting 'corr.voxel_ft' as product of fourier transforms of two shapes
-    corr = Shape()
-    corr.set_voxel_ft(alpha.get_voxel_ft() * beta.get_voxel_ft())
-    
-    # computing inverse Fourier transform for 'corr' and normalizing it
-    corr.inverse_fourier_transform()
-    corr.normalize()
+    if max(alpha.get_resolution(), beta.get_resolution()) > \
+                                                    SCRATCH_RESOLUTION:
+        return SCRATCH_DIR
+    return None
 
-    return corr
-    
-def minkowski_as_man(alpha, beta):
+def minkowski_as_man(alpha, beta, engine = None):
     '''
     Computes as manufactured model using convolution algebra
     Input: 'alpha' and 'beta' - Instances of class 'Shape()'
-    Output stored in global variables 'as_man'
+    'engine' - 'fft', 'spatial', 'blocked', 'edt' or None for the cheapest
+    Output stored in global variables 'as_man' and 'non_man'
     '''
     global as_man, non_man
     
-    erosion_alpha_by_beta = Shape()
-    ref_beta = Shape()
-    
-    ref_beta.set_voxel(beta.get_voxel()[::-1, ::-1, ::-1])
-    
-    # minkowski sum would set of all cells with positive value
-    # hence, using a small number of (0.01% of volume of shape 'beta')
-    # to mitigate the precision error
-    level_sum = 0.0001*(beta.get_volume()-0.5)
-    
-    # minkowski difference would set of all cells with value larger than
-    # volume of 'beta'
-    # using a number slightly smaller than the volume of shape 'beta'
-    # to mitigate the precision error
-    level_diff = 1*(beta.get_volume()-0.5)
-    
-    # getting the convolution of two shapes
-    corr = get_norm_corr(alpha, ref_beta)
-    
-    # computing minkowski difference as sublevel sets of convolution
-    erosion_alpha_by_beta.set_voxel(corr.get_sublevel_set(level_diff))
-    
-    # getting the convolution of erosion by beta
-    corr2 = get_norm_corr(erosion_alpha_by_beta, beta)
-    
-    # computing minkowski difference as sublevel sets of convolution
-    as_man.set_voxel(shift(corr2.get_sublevel_set(level_sum), shift=(1, 1, 1), mode='wrap'))
-    
-    # computing non-manufacturable portion
-    non_man.set_voxel(1*(logical_and(alpha.get_voxel() == 1, as_man.get_voxel() != 1)))
+    result, non_result = get_as_manufactured(alpha, beta, engine)
+    as_man.set_bits(result.get_bits(), result.get_voxel_shape())
+    non_man.set_bits(non_result.get_bits(), non_result.get_voxel_shape())
 
 def compute():
     '''
@@ -510,23 +801,27 @@ def compute():
     '''
     global alpha, beta, as_man, non_man, as_man, non_man
     
-    alpha.read_voxel()
-    beta.read_voxel()
-    if (not alpha.isempty()) and (not beta.isempty()):
-    
-        # Getting the total size for convolution
-        sza = alpha.get_voxel_shape()
-        szb = beta.get_voxel_shape()
-        szc = sza + szb
-        dims = [int(pow(2, ceil(log(dim)/log(2)))) for dim in szc]
-        
-        # Padding the shapes with zeros
-        alpha.pad_voxel(dims)
-        beta.pad_voxel(dims)
+    # Reading and padding the shapes
+    if prepare_shapes(alpha, beta):
         
         # Computing the as manufactured model
         minkowski_as_man(alpha, beta)
 
+def compute_job(alpha, beta, progress = None):
+    '''
+    Reads and pads the shapes 'alpha' and 'beta' and computes the as
+    manufactured model coarse-to-fine (see multires.py), reporting the
+    stages to 'progress' (see morphology.py)
+    Run by the window in the background on copies of the global shapes
+    Output: 'alpha', 'beta' and the results 'as_man' and 'non_man' (None
+    if either shape is empty)
+    '''
+    results = (None, None)
+    if prepare_shapes(alpha, beta, progress):
+        results = get_as_manufactured_multires(alpha, beta,
+                                                    progress = progress)
+    return (alpha, beta) + tuple(results)
+
 ################################################################################
 
 if __name__ == "__main__":
@@ -536,6 +831,8 @@ if __name__ == "__main__":
     beta = Shape()
     as_man = Shape()
     non_man = Shape()
+    as_man.set_packed(True)
+    non_man.set_packed(True)
     
     beta.set_scale(0.3)
     
@@ -0,0 +1,859 @@
+#    MAD Lab, University at Buffalo
+#    Copyright (C) 2018  Prakhar Jaiswal <prakharj@buffalo.edu>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Engines for the convolution of two shapes and the choice between them.
+
+The Minkowski sum and difference are sublevel sets of the convolution of the
+part (alpha) with the tool (beta). It is computed either with FFTs over the
+whole padded grid ('fft', see get_norm_corr in main.py), directly in space
+by adding up one shifted copy of alpha per tool voxel ('spatial'), which is
+much cheaper for small tools, or with FFTs over tiles of the grid sized to
+the tool ('blocked', overlap-save), which thresholds every tile into the
+bit-packed results as soon as it is computed, so that besides the part and
+the results it only holds a tile at a time (see get_blocked_sets). The
+spatial and blocked engines compute the exact integer counts the FFT
+approximates, on the same grid and with the same placement, so thresholding
+any of them gives identical voxels. For tools that are digital balls or
+axis-aligned cylinders (ball-end and flat-end cutters) of up to about 5000
+voxels, the 'edt' engine finds the voxels within the tool's radius of the
+part or of its complement with Euclidean distance transforms in linear time,
+and returns counts that threshold to the same sets (see get_edt_corr and
+get_edt_model).
+
+The morphological operations themselves (get_minkowski_sum,
+get_minkowski_diff, get_minkowski_sum_and_diff and get_as_manufactured)
+take padded Shapes and return new result Shapes, so they can be used
+without the GUI, e.g. by batch.py. They accept an optional 'progress'
+callback, called as progress(fraction, message) at the start of every
+stage, which may raise Cancelled to abort the computation there.
+"""
+
+import time
+import logging
+import multiprocessing
+import numpy as np
+
+from scipy import ndimage
+
+from shape import Shape, new_array, is_smooth, get_padded_dims, multiply, \
+                    get_slabs
+from plan_cache import fft_plans
+from spectrum_cache import tool_spectra
+
+logger = logging.getLogger(__name__)
+
+ENGINES = ('fft', 'spatial', 'blocked', 'edt')
+# the FFT size of the tiles of the blocked engine is about TILE_FACTOR times
+# the tool size (a quarter of each tile is overlap), but at least MIN_TILE
+TILE_FACTOR = 4
+MIN_TILE = 32
+
+class Cancelled(Exception):
+    '''
+    Raised by a progress callback to abort a computation
+    '''
+    pass
+
+def report(progress, fraction, message):
+    '''
+    Reports the start of a stage to the 'progress' callback, if any
+    'fraction' is the part of a full computation (reading, padding and one
+    operation) done before the stage
+    '''
+    if progress is not None:
+        progress(fraction, message)
+
+class CostModel:
+    '''
+    The CostModel class estimates the run time of the convolution engines
+    The FFT engine costs about 'fft' seconds per M*log2(M) per transform,
+    the spatial engine 'spatial' seconds per grid voxel per tool voxel and
+    the EDT engine 'edt' seconds per grid voxel, where M is the number of
+    voxels in the padded grid. The constants are measured on this machine
+    the first time they are needed
+    '''
+
+    def __init__(self, fft = None, spatial = None, edt = None):
+        self.fft = fft
+        self.spatial = spatial
+        self.edt = edt
+
+    def calibrate(self):
+        '''
+        Measures the cost constants with small test problems
+        '''
+        dims = (32, 32, 32)
+        size = np.prod(dims)
+        voxel = np.zeros(dims, dtype = 'f')
+        fft_plans.get_plan(dims, 'forward')
+        start = time.time()
+        for i in range(4):
+            fft_plans.forward(voxel)
+        self.fft = (time.time() - start) / (4 * size * np.log2(size))
+
+        alpha = np.zeros(dims, dtype = np.uint8)
+        offsets = np.indices((2, 2, 2)).reshape(3, -1).T
+        start = time.time()
+        for i in range(4):
+            add_shifted(np.zeros(dims, dtype = np.int32), alpha, offsets)
+        self.spatial = (time.time() - start) / (4 * len(offsets) * size)
+
+        # a transform of the part and one of its complement per convolution
+        alpha = np.random.RandomState(0).rand(*dims) > 0.5
+        start = time.time()
+        for i in range(4):
+            ndimage.distance_transform_edt(alpha)
+        self.edt = 2 * (time.time() - start) / (4 * size)
+
+    def get_fft_cost(self, dims, ntransforms):
+        if self.fft is None:
+            self.calibrate()
+        size = float(np.prod(dims))
+        return self.fft * ntransforms * size * np.log2(size)
+
+    def get_spatial_cost(self, dims, volume):
+        if self.spatial is None:
+            self.calibrate()
+        return self.spatial * volume * float(np.prod(dims))
+
+    def get_edt_cost(self, dims):
+        if self.edt is None:
+            self.calibrate()
+        return self.edt * float(np.prod(dims))
+
+    def get_blocked_cost(self, dims, tool_dims):
+        '''
+        Estimates the blocked engine as a forward and an inverse transform
+        per tile, assuming every tile is occupied
+        '''
+        tile = get_tile_dims(dims, tool_dims)
+        ntiles = np.prod([-(-n // (m - b + 1))
+                            for n, m, b in zip(dims, tile, tool_dims)])
+        return ntiles * self.get_fft_cost(tile, 2)
+
+# cost constants shared by all computations in this process
+cost_model = CostModel()
+
+def estimate_costs(dims, volume, tool_dims, nconv = 1, ntransforms = None,
+                                                            edt = False):
+    '''
+    Returns the estimated run times of 'nconv' convolutions on a grid of
+    'dims' with a tool of 'volume' voxels and bounding box 'tool_dims', as
+    a list of (seconds, engine), the 'fft' engine doing 'ntransforms' FFTs
+    (3 per convolution by default)
+    The 'edt' engine is included if 'edt' is set (see get_edt_model)
+    '''
+    if ntransforms is None:
+        ntransforms = 3 * nconv
+    fft_cost = cost_model.get_fft_cost(dims, ntransforms)
+    spatial_cost = nconv * cost_model.get_spatial_cost(dims, volume)
+    blocked_cost = nconv * cost_model.get_blocked_cost(dims, tool_dims)
+    costs = [(fft_cost, 'fft'), (spatial_cost, 'spatial'),
+                                    (blocked_cost, 'blocked')]
+    if edt:
+        costs.append((nconv * cost_model.get_edt_cost(dims), 'edt'))
+    return costs
+
+def get_engine_costs(alpha, beta, nconv = 1):
+    '''
+    Returns the estimated run times of 'nconv' convolutions of 'alpha' with
+    'beta' (padded Shapes) as a list of (seconds, engine), and the number
+    of FFTs the 'fft' engine needs
+    '''
+    # forward and inverse transform of each convolution, plus the tool's
+    # transform unless its spectrum is cached
+    ntransforms = 2 * nconv
+    if not tool_spectra.has_spectrum(beta):
+        ntransforms += nconv
+    origin, tool = crop_voxels(beta.get_voxel() > 0.5)
+    costs = estimate_costs(alpha.get_voxel_shape(), beta.get_volume(),
+                            tool.shape, nconv, ntransforms,
+                            get_edt_model(tool) is not None)
+    return costs, ntransforms
+
+def choose_engine(alpha, beta, operation, nconv = 1, engine = None):
+    '''
+    Returns the cheapest engine (one of ENGINES) for 'nconv'
+    convolutions of 'alpha' with 'beta' (padded Shapes) in 'operation' and
+    logs why
+    An explicitly requested 'engine' is returned unchanged. Otherwise a
+    grid with a scratch directory set gets the 'blocked' engine, the only
+    one that does not hold full grids in memory
+    '''
+    dims = alpha.get_voxel_shape()
+    if engine is not None:
+        if engine not in ENGINES:
+            raise ValueError('Unknown engine ' + str(engine))
+        logger.info('%s: %s engine requested', operation, engine)
+        return engine
+    if alpha.get_scratch() is not None:
+        logger.info('%s: blocked engine (dims %s memory-mapped in %s)',
+                    operation, 'x'.join(str(dim) for dim in dims),
+                    alpha.get_scratch())
+        return 'blocked'
+
+    costs, ntransforms = get_engine_costs(alpha, beta, nconv)
+    engine = min(costs)[1]
+    logger.info('%s: %s engine (tool volume %d, dims %s, %d transforms): '
+                'estimated %s', operation, engine, beta.get_volume(),
+                'x'.join(str(dim) for dim in dims), ntransforms,
+                ' vs '.join('%.3gs %s' % (cost, name)
+                                        for cost, name in sorted(costs)))
+    return engine
+
+def add_shifted(out, voxel, offsets):
+    '''
+    Adds to 'out' one copy of 'voxel' circularly shifted by each of the
+    'offsets' (K x 3), without allocating temporary grids
+    '''
+    dims = voxel.shape
+    for offset in offsets:
+        # the circular shift splits into (at most) 8 rectangular blocks
+        parts = []
+        for n, s in zip(dims, offset):
+            s = int(s) % n
+            parts.append([(slice(s, n), slice(0, n - s)),
+                            (slice(0, s), slice(n - s, n))] if s else
+                                    [(slice(0, n), slice(0, n))])
+        for dx, sx in parts[0]:
+            for dy, sy in parts[1]:
+                for dz, sz in parts[2]:
+                    out[dx, dy, dz] += voxel[sx, sy, sz]
+    return out
+
+def get_spatial_corr(alpha, beta, reflect = False):
+    '''
+    Computes the convolution of two shapes directly in space
+    The result equals the one of get_norm_corr (with the same 'reflect'),
+    but holds exact integer counts
+    Input: 'alpha' and 'beta' - Instances of class 'Shape()' of equal dims
+    Output: 'corr' - Instance of class 'Shape()'
+    '''
+    voxel = (alpha.get_voxel() > 0.5).astype(np.uint8)
+    tool = beta.get_voxel() > 0.5
+    if reflect:
+        tool = tool[::-1, ::-1, ::-1]
+    dims = np.array(voxel.shape)
+    # get_norm_corr's fftshift moves the FFT convolution by half the grid
+    offsets = np.argwhere(tool) + dims // 2
+
+    counts = np.zeros(voxel.shape, dtype = np.int32)
+    add_shifted(counts, voxel, offsets)
+
+    corr = Shape()
+    corr.set_voxel(counts)
+    return corr
+
+def get_norm_corr(alpha, beta, real = True, reflect = False,
+                                                    normalize = True):
+    '''
+    Computes normalized convolution of two shapes (3D rasterized models)
+    Uses Fast Fourier Transform (FFT) to compute convolution efficiently
+    With 'real' set, real-to-complex transforms are used which halves the
+    memory and time needed for the spectra of the (always real) voxel data
+    With 'reflect' set, 'beta' reflected through the origin is used
+    With 'normalize' unset the raw inverse transform is returned, to be
+    normalized by Shape.get_sublevel_sets
+    The spectrum of the tool 'beta' is taken from the cache 'tool_spectra'
+    Input: 'alpha' and 'beta' - Instances of class 'Shape()'
+    Output: 'corr' - Instance of class 'Shape()'
+    '''
+    # taking Fourier tranform of shapes 'alpha' and 'beta'
+    alpha.fourier_transform(real)
+    beta_ft = tool_spectra.get_spectrum(beta, real, reflect)
+    
+    # setting 'corr.voxel_ft' as product of fourier transforms of two shapes
+    # the product is memory-mapped if 'alpha' has a scratch directory
+    corr = Shape()
+    corr.set_scratch(alpha.get_scratch())
+    dims = alpha.get_voxel_shape() if real else None
+    corr.set_voxel_ft(multiply(alpha.get_voxel_ft(), beta_ft,
+                                            corr.get_scratch()), dims)
+    
+    # computing inverse Fourier transform for 'corr' and normalizing it
+    corr.inverse_fourier_transform()
+    if normalize:
+        corr.normalize()
+
+    return corr
+
+def get_corr(alpha, beta, engine = 'fft', reflect = False,
+                                                    normalize = True):
+    '''
+    Computes the convolution of two shapes with 'engine', 'fft' for
+    get_norm_corr, 'spatial' for the direct (exact) spatial convolution,
+    'blocked' for the (exact) tiled FFT convolution or 'edt' for the
+    distance transforms of get_edt_corr
+    'normalize' only applies to 'fft', see get_norm_corr
+    Input: 'alpha' and 'beta' - Instances of class 'Shape()'
+    Output: 'corr' - Instance of class 'Shape()'
+    '''
+    if engine == 'spatial':
+        return get_spatial_corr(alpha, beta, reflect)
+    if engine == 'blocked':
+        return get_blocked_corr(alpha, beta, reflect)
+    if engine == 'edt':
+        return get_edt_corr(alpha, beta, reflect)
+    return get_norm_corr(alpha, beta, reflect = reflect,
+                                                normalize = normalize)
+
+def get_corr_sets(alpha, beta, levels, engine = 'fft', reflect = False,
+                                    packed = False, offsets = (0, 0, 0)):
+    '''
+    Returns the sublevel sets at each of 'levels' of the convolution of
+    two shapes with 'engine' (see get_corr), as Shape.get_sublevel_sets
+    with 'packed' and 'offsets' does
+    The 'blocked' engine thresholds every tile as soon as it is computed
+    (see get_blocked_sets), the other engines the whole convolution
+    Input: 'alpha' and 'beta' - Instances of class 'Shape()'
+    '''
+    if engine == 'blocked':
+        return get_blocked_sets(alpha, beta, levels, reflect, packed,
+                                                                offsets)
+    corr = get_corr(alpha, beta, engine, reflect, normalize = False)
+    return corr.get_sublevel_sets(levels, engine == 'fft', packed, offsets)
+
+def get_levels(beta):
+    '''
+    Returns the levels (sum, diff) the convolution with 'beta' is
+    thresholded at for the minkowski sum and difference
+    '''
+    return get_volume_levels(beta.get_volume())
+
+def get_volume_levels(volume):
+    '''
+    Returns the levels of get_levels for a tool of 'volume' voxels
+    '''
+    # minkowski sum would set of all cells with positive value
+    # hence, using a small number of (0.01% of volume of shape 'beta')
+    # to mitigate the precision error
+    level_sum = 0.0001*(volume-0.5)
+    # minkowski difference would set of all cells with value larger than
+    # volume of 'beta'
+    # using a number slightly smaller than the volume of shape 'beta'
+    # to mitigate the precision error
+    level_diff = 1*(volume-0.5)
+    return level_sum, level_diff
+
+def has_exact_levels(volume):
+    '''
+    Returns whether the levels of get_levels for a tool of 'volume' voxels
+    set exactly the counts of at least one voxel (sum) and of all voxels
+    (difference), which holds for tools of up to about 5000 voxels
+    Larger tools also leave out sum counts of a few voxels or let
+    difference counts miss a few, as Shape.get_sublevel_sets sets the
+    values above 0.9999 times the level
+    '''
+    level_sum, level_diff = get_volume_levels(volume)
+    return 0.9999*level_sum < 1 and 0.9999*level_diff >= volume - 1
+
+def get_packed_shape(bits, dims):
+    '''
+    Returns a new Shape in packed mode holding the packed 'bits' of 'dims'
+    '''
+    shape = Shape()
+    shape.set_packed(True)
+    shape.set_bits(bits, dims)
+    return shape
+
+def prepare_shapes(alpha, beta, progress = None):
+    '''
+    Reads the voxel models of 'alpha' and 'beta' and pads both to the grid
+    their convolution needs (see get_padded_dims)
+    Returns False if either of them is empty
+    '''
+    report(progress, 0.0, 'Reading part A')
+    alpha.read_voxel()
+    report(progress, 0.15, 'Reading part B')
+    beta.read_voxel()
+    if alpha.isempty() or beta.isempty():
+        return False
+    
+    # Getting the total size for convolution
+    report(progress, 0.3, 'Padding')
+    sza = alpha.get_voxel_shape()
+    szb = beta.get_voxel_shape()
+    dims = get_padded_dims(sza, szb)
+    
+    # Padding the shapes with zeros
+    alpha.pad_voxel(dims)
+    beta.pad_voxel(dims)
+    return True
+
+def get_minkowski_sum(alpha, beta, engine = None, progress = None):
+    '''
+    Computes minkowski sum using convolution algebra
+    Input: 'alpha' and 'beta' - padded instances of class 'Shape()'
+    'engine' - 'fft', 'spatial', 'blocked', 'edt' or None for the cheapest
+    Output: 'msum' - Instance of class 'Shape()' (bit-packed)
+    '''
+    engine = choose_engine(alpha, beta, 'minkowski_sum', 1, engine)
+    
+    level_sum, level_diff = get_levels(beta)
+    
+    # computing minkowski sum as sublevel set of convolution of two shapes,
+    # bit-packed
+    report(progress, 0.4, 'Convolving')
+    bits = get_corr_sets(alpha, beta, [level_sum], engine, packed = True)
+    return get_packed_shape(bits[0], alpha.get_voxel_shape())
+
+def get_minkowski_diff(alpha, beta, engine = None, progress = None):
+    '''
+    Computes minkowski difference using convolution algebra
+    Input: 'alpha' and 'beta' - padded instances of class 'Shape()'
+    'engine' - 'fft', 'spatial', 'blocked', 'edt' or None for the cheapest
+    Output: 'mdiff' - Instance of class 'Shape()' (bit-packed)
+    '''
+    engine = choose_engine(alpha, beta, 'minkowski_diff', 1, engine)
+    
+    level_sum, level_diff = get_levels(beta)
+    
+    # computing minkowski difference as sublevel set of convolution of two
+    # shapes, bit-packed
+    report(progress, 0.4, 'Convolving')
+    bits = get_corr_sets(alpha, beta, [level_diff], engine, packed = True)
+    return get_packed_shape(bits[0], alpha.get_voxel_shape())
+
+def get_minkowski_sum_and_diff(alpha, beta, engine = None, progress = None):
+    '''
+    Computes minkowski sum and difference using convolution algebra, from
+    a single convolution
+    Input: 'alpha' and 'beta' - padded instances of class 'Shape()'
+    'engine' - 'fft', 'spatial', 'blocked', 'edt' or None for the cheapest
+    Output: 'msum' and 'mdiff' - Instances of class 'Shape()' (bit-packed)
+    '''
+    engine = choose_engine(alpha, beta, 'minkowski_sum_and_diff', 1, engine)
+    
+    # computing minkowski sum and difference as sublevel sets of convolution
+    # of two shapes in one pass, bit-packed
+    report(progress, 0.4, 'Convolving')
+    bits = get_corr_sets(alpha, beta, get_levels(beta), engine,
+                                                            packed = True)
+    dims = alpha.get_voxel_shape()
+    return get_packed_shape(bits[0], dims), get_packed_shape(bits[1], dims)
+
+def get_as_manufactured(alpha, beta, engine = None, progress = None):
+    '''
+    Computes as manufactured model using convolution algebra, the opening
+    of 'alpha' by 'beta' (erosion by 'beta' followed by dilation)
+    Input: 'alpha' and 'beta' - padded instances of class 'Shape()'
+    'engine' - 'fft', 'spatial', 'blocked', 'edt' or None for the cheapest
+    Output: 'as_man' and 'non_man' (the non-manufacturable portion of
+    'alpha') - Instances of class 'Shape()' (bit-packed)
+    '''
+    erosion_alpha_by_beta = Shape()
+    erosion_alpha_by_beta.set_scratch(alpha.get_scratch())
+    
+    # choosing between the FFT and the spatial engine
+    engine = choose_engine(alpha, beta, 'minkowski_as_man', 2, engine)
+    level_sum, level_diff = get_levels(beta)
+    
+    # computing minkowski difference as sublevel set of the convolution of
+    # 'alpha' with reflected 'beta'
+    report(progress, 0.4, 'Eroding')
+    erosion = get_corr_sets(alpha, beta, [level_diff], engine, True)
+    erosion_alpha_by_beta.set_voxel(erosion[0])
+    del erosion
+    
+    # computing minkowski sum as sublevel set of the convolution of erosion
+    # by beta, shifted by one voxel along each axis and bit-packed
+    report(progress, 0.65, 'Dilating')
+    bits = get_corr_sets(erosion_alpha_by_beta, beta, [level_sum], engine,
+                                                    False, True, (1, 1, 1))
+    as_man = get_packed_shape(bits[0], alpha.get_voxel_shape())
+    
+    # computing non-manufacturable portion, on the packed bits
+    non_man = get_packed_shape(alpha.get_bits() & ~as_man.get_bits(),
+                                                alpha.get_voxel_shape())
+    return as_man, non_man
+
+def get_tool_dims(beta):
+    '''
+    Returns the dims of the bounding box of the voxels of 'beta'
+    '''
+    coords = np.argwhere(beta.get_voxel() > 0.5)
+    if len(coords) == 0:
+        return [1, 1, 1]
+    return list(coords.max(0) - coords.min(0) + 1)
+
+def get_tile_dims(dims, tool_dims):
+    '''
+    Returns the FFT size of the tiles of the blocked engine for a grid of
+    'dims' and a tool of 'tool_dims', per axis the smallest 2/3/5/7-smooth
+    size of about TILE_FACTOR times the tool (no larger than needed to
+    cover the whole axis in one tile)
+    '''
+    tile = []
+    for n, b in zip(dims, tool_dims):
+        m = min(max(TILE_FACTOR * b, MIN_TILE), n + b - 1)
+        while not is_smooth(m):
+            m += 1
+        tile.append(m)
+    return tile
+
+_blocked = {}
+
+def _init_blocked(voxel, kernel_ft, tile, tool_dims, start, levels):
+    '''
+    Sets up the blocked convolution in a worker process
+    '''
+    _blocked['voxel'] = voxel
+    _blocked['kernel_ft'] = kernel_ft
+    _blocked['tile'] = tile
+    _blocked['tool_dims'] = tool_dims
+    _blocked['start'] = start
+    _blocked['levels'] = levels
+
+def _convolve_tile(origin):
+    '''
+    Returns (origin, block) for the output tile starting at 'origin', or
+    (origin, None) if its input window is empty
+    The window of the part read by the tile is gathered with wrap-around,
+    convolved circularly with the tool at the tile's FFT size, and the
+    outputs not affected by the wrap-around (overlap-save) are kept
+    'block' holds the counts, or with levels set a list of boolean blocks
+    of the counts above 0.9999 times each level (as in
+    Shape.get_sublevel_sets)
+    '''
+    voxel = _blocked['voxel']
+    tile = _blocked['tile']
+    tool_dims = _blocked['tool_dims']
+    index = [(o + s + np.arange(m)) % n for o, s, m, n in
+                        zip(origin, _blocked['start'], tile, voxel.shape)]
+    window = voxel[np.ix_(*index)] > 0.5
+    if not window.any():
+        return origin, None
+    window_ft = fft_plans.forward(window.astype(np.float32))
+    window_ft *= _blocked['kernel_ft']
+    corr = fft_plans.backward(window_ft, tile)
+    valid = tuple(slice(b - 1, m) for b, m in zip(tool_dims, tile))
+    # the float32 transforms are exact up to rounding of the integer counts
+    counts = np.rint(corr[valid] / np.prod(tile)).astype(np.int32)
+    if _blocked['levels'] is None:
+        return origin, counts
+    return origin, [counts > 0.9999*level for level in _blocked['levels']]
+
+def get_blocked_tiles(alpha, beta, reflect = False, offsets = (0, 0, 0),
+                            levels = None, tile = None, nworkers = 1):
+    '''
+    Generates the tiles of the convolution of two shapes computed with FFTs
+    over tiles of the grid (overlap-save), as (box, block) with 'box' the
+    slices of the output the tile covers and 'block' as returned by
+    _convolve_tile for 'levels', or None for a tile of zero counts
+    The output is circularly shifted by 'offsets' (as numpy.roll) and
+    otherwise equals the one of get_spatial_corr (with the same 'reflect')
+    'tile' is the FFT size of the tiles (see get_tile_dims if None) and
+    'nworkers' the number of processes (all cores if None)
+    The spectrum of the tool cropped to its bounding box is taken from the
+    cache 'tool_spectra', and tiles whose input window is empty are
+    skipped
+    Input: 'alpha' and 'beta' - Instances of class 'Shape()' of equal dims
+    '''
+    voxel = alpha.get_voxel()
+    tool = beta.get_voxel() > 0.5
+    if reflect:
+        tool = tool[::-1, ::-1, ::-1]
+    dims = np.array(voxel.shape)
+    coords = np.argwhere(tool)
+    if len(coords) == 0:
+        coords = np.zeros((1, 3), dtype = int)
+    hi = coords.max(0)
+    tool_dims = list(hi - coords.min(0) + 1)
+    if tile is None:
+        tile = get_tile_dims(dims, tool_dims)
+    tile = [max(int(m), b) for m, b in zip(tile, tool_dims)]
+    kernel_ft = tool_spectra.get_spectrum(beta, True, reflect, tile)
+
+    # output k sums alpha[k - offsets - dims//2 - p] over the tool voxels p
+    # (see get_spatial_corr), so a tile at 'origin' reads the window of the
+    # part starting at origin - offsets - dims//2 - hi
+    start = list(-np.array(offsets) - dims // 2 - hi)
+    step = [m - b + 1 for m, b in zip(tile, tool_dims)]
+    origins = [(x, y, z) for x in range(0, dims[0], step[0])
+                            for y in range(0, dims[1], step[1])
+                            for z in range(0, dims[2], step[2])]
+
+    initargs = (voxel, kernel_ft, tile, tool_dims, start, levels)
+    if nworkers is None:
+        nworkers = multiprocessing.cpu_count()
+    pool = None
+    nempty = 0
+    try:
+        if nworkers == 1:
+            _init_blocked(*initargs)
+            results = (_convolve_tile(origin) for origin in origins)
+        else:
+            pool = multiprocessing.Pool(nworkers, _init_blocked, initargs)
+            results = pool.imap_unordered(_convolve_tile, origins, 8)
+        for origin, block in results:
+            end = np.minimum(np.array(origin) + step, dims)
+            box = tuple(slice(o, e) for o, e in zip(origin, end))
+            size = tuple(end - origin)
+            if block is None:
+                nempty += 1
+            elif levels is None:
+                block = block[:size[0], :size[1], :size[2]]
+            else:
+                block = [mask[:size[0], :size[1], :size[2]]
+                                                    for mask in block]
+            yield box, block
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        _blocked.clear()
+    logger.info('blocked convolution: %d of %d tiles of %s empty', nempty,
+                len(origins), 'x'.join(str(m) for m in tile))
+
+def get_blocked_corr(alpha, beta, reflect = False, tile = None,
+                                                        nworkers = 1):
+    '''
+    Computes the convolution of two shapes with FFTs over tiles of the grid
+    (see get_blocked_tiles), only holding a tile and its spectrum at a time
+    besides the output
+    The result equals the one of get_spatial_corr (with the same 'reflect')
+    and is memory-mapped if a scratch directory is set on 'alpha'
+    Input: 'alpha' and 'beta' - Instances of class 'Shape()' of equal dims
+    Output: 'corr' - Instance of class 'Shape()'
+    '''
+    counts = new_array(alpha.get_voxel_shape(), np.int32, alpha.get_scratch())
+    for box, block in get_blocked_tiles(alpha, beta, reflect, tile = tile,
+                                                    nworkers = nworkers):
+        if block is not None:
+            counts[box] = block
+
+    corr = Shape()
+    corr.set_scratch(alpha.get_scratch())
+    corr.set_voxel(counts)
+    return corr
+
+def get_blocked_sets(alpha, beta, levels, reflect = False, packed = False,
+                            offsets = (0, 0, 0), tile = None, nworkers = 1):
+    '''
+    Computes the sublevel sets at each of 'levels' of the convolution of
+    two shapes as get_blocked_corr followed by Shape.get_sublevel_sets
+    (with 'packed' and 'offsets'), thresholding every tile straight into
+    the outputs, so only a tile and the outputs are held at a time
+    The outputs are memory-mapped if a scratch directory is set on 'alpha'
+    Input: 'alpha' and 'beta' - Instances of class 'Shape()' of equal dims
+    Output: list of 3D boolean arrays, or numpy.packbits bits
+    '''
+    dims = alpha.get_voxel_shape()
+    scratch = alpha.get_scratch()
+    if packed:
+        outs = [new_array([(np.prod(dims) + 7)//8], np.uint8, scratch)
+                                                        for level in levels]
+    else:
+        outs = [new_array(dims, bool, scratch) for level in levels]
+    for box, block in get_blocked_tiles(alpha, beta, reflect, offsets,
+                                                levels, tile, nworkers):
+        if block is None:
+            # the counts are zero, above levels below zero only
+            size = tuple(s.stop - s.start for s in box)
+            block = [np.full(size, 0 > 0.9999*level) for level in levels]
+        for out, mask in zip(outs, block):
+            if packed:
+                set_packed_block(out, mask, [s.start for s in box], dims)
+            else:
+                out[box] = mask
+    return outs
+
+def set_packed_block(bits, block, origin, dims):
+    '''
+    Sets the voxels of the boolean 'block' at 'origin' in the
+    numpy.packbits 'bits' of a grid of 'dims', keeping the other voxels of
+    the bytes it touches
+    The bits are only ever set, the outputs of get_blocked_sets starting
+    cleared and its tiles not overlapping
+    '''
+    index = np.ravel_multi_index(tuple((np.argwhere(block) +
+                                                    origin).T), dims)
+    if len(index) == 0:
+        return
+    # the set voxels in increasing order, added up per byte
+    byte = index >> 3
+    value = (0x80 >> (index & 7)).astype(np.uint8)
+    first = np.flatnonzero(np.r_[True, byte[1:] != byte[:-1]])
+    bits[byte[first]] |= np.add.reduceat(value, first).astype(np.uint8)
+
+def crop_voxels(voxel):
+    '''
+    Returns the first corner of the bounding box of the set voxels of
+    'voxel' (3D boolean array) and the voxels in it
+    '''
+    coords = np.argwhere(voxel)
+    if len(coords) == 0:
+        return np.zeros(3, dtype = int), np.zeros((1, 1, 1), dtype = bool)
+    lo = coords.min(0)
+    hi = coords.max(0) + 1
+    return lo, voxel[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]]
+
+def get_ball_radius2(voxel):
+    '''
+    Returns the squared radius of the digital ball (or disc, in 2D) that
+    'voxel' (boolean array cropped to its set voxels) is, the set of
+    voxels within the radius of the center of an odd cube, None if it is
+    not one
+    '''
+    n = voxel.shape[0]
+    if n % 2 == 0 or any(dim != n for dim in voxel.shape) or \
+                                                    not voxel.any():
+        return None
+    dist2 = np.sum((np.indices(voxel.shape) - n // 2) ** 2, axis = 0)
+    radius2 = dist2[voxel].max()
+    if not np.array_equal(voxel, dist2 <= radius2):
+        return None
+    return int(radius2)
+
+def get_tool_model(tool):
+    '''
+    Returns the model of the tool voxels 'tool' (3D boolean array cropped
+    to its bounding box, see crop_voxels) if it is a digital ball or an
+    axis-aligned cylinder with a digital disc as section, None otherwise
+    The model is a dict of the squared 'radius2' of the ball or disc, the
+    'axes' it spans, its 'center' in the box (0 along the cylinder's axis)
+    and the 'axis' and 'length' of the cylinder (None and 1 for a ball)
+    '''
+    radius2 = get_ball_radius2(tool)
+    if radius2 is not None:
+        return {'radius2': radius2, 'axes': (0, 1, 2), 'axis': None,
+                'length': 1, 'center': [dim // 2 for dim in tool.shape]}
+    for axis in range(3):
+        section = tool.take([0], axis)
+        if not (tool == section).all():
+            continue
+        radius2 = get_ball_radius2(section.squeeze(axis))
+        if radius2 is not None:
+            center = [dim // 2 for dim in tool.shape]
+            center[axis] = 0
+            return {'radius2': radius2,
+                    'axes': tuple(a for a in range(3) if a != axis),
+                    'axis': axis, 'length': tool.shape[axis],
+                    'center': center}
+    return None
+
+def get_edt_model(tool):
+    '''
+    Returns the model of the tool voxels 'tool' (see get_tool_model) if the
+    edt engine applies to it, None otherwise
+    Its output only tells whether all, some or none of the tool voxels are
+    set, which thresholds like the counts of the other engines only if the
+    levels are exact (see has_exact_levels)
+    '''
+    if not has_exact_levels(np.count_nonzero(tool)):
+        return None
+    return get_tool_model(tool)
+
+def get_within(voxel, radius2, axes):
+    '''
+    Returns whether each voxel of 'voxel' (3D boolean array) has a set
+    voxel and whether it has only set voxels within the squared distance
+    'radius2' along 'axes' (all three or two of them, per slice across the
+    third), from the Euclidean distance transforms of the complement and
+    of 'voxel'
+    '''
+    near = np.zeros(voxel.shape, dtype = bool)
+    inside = np.zeros(voxel.shape, dtype = bool)
+    if len(axes) == 3:
+        slices = [Ellipsis]
+    else:
+        axis = [a for a in range(3) if a not in axes][0]
+        slices = [(slice(None),) * axis + (i,)
+                                    for i in range(voxel.shape[axis])]
+    for sl in slices:
+        part = voxel[sl]
+        # the transforms are undefined without voxels to measure to
+        if part.all():
+            near[sl] = True
+            inside[sl] = True
+        elif part.any():
+            dist = ndimage.distance_transform_edt(~part)
+            near[sl] = np.rint(dist * dist) <= radius2
+            dist = ndimage.distance_transform_edt(part)
+            inside[sl] = np.rint(dist * dist) > radius2
+    return near, inside
+
+def get_runs(voxel, length, axis):
+    '''
+    Returns the number of set voxels of 'voxel' among the 'length' ending at
+    each voxel along 'axis', for the voxels from index 'length' - 1 on
+    '''
+    counts = np.cumsum(voxel, axis = axis, dtype = np.int32)
+    zero = np.zeros_like(counts.take([0], axis))
+    counts = np.concatenate((zero, counts), axis)
+    n = counts.shape[axis]
+    return counts.take(range(length, n), axis) - \
+                                    counts.take(range(0, n - length), axis)
+
+def get_edt_corr(alpha, beta, reflect = False):
+    '''
+    Computes the convolution of 'alpha' with a ball or cylinder tool 'beta'
+    (see get_tool_model) with Euclidean distance transforms, slab by slab
+    over windows grown by the tool's radius (and length) only
+    Instead of the counts of get_spatial_corr (with the same 'reflect'),
+    the result holds the tool volume where all of them are set (erosion),
+    1 where only some are (dilation) and 0 elsewhere, so it thresholds to
+    the same Minkowski sum and difference for the tools the levels are
+    exact for (see get_edt_model), larger tools raise ValueError
+    Input: 'alpha' and 'beta' - Instances of class 'Shape()' of equal dims
+    Output: 'corr' - Instance of class 'Shape()'
+    '''
+    voxel = alpha.get_voxel()
+    tool = beta.get_voxel() > 0.5
+    if reflect:
+        tool = tool[::-1, ::-1, ::-1]
+    origin, tool = crop_voxels(tool)
+    model = get_tool_model(tool)
+    if model is None:
+        raise ValueError('The edt engine needs a ball or cylinder tool')
+    volume = int(np.count_nonzero(tool))
+    if not has_exact_levels(volume):
+        raise ValueError('The edt engine needs a tool of at most about 5000 '
+                            'voxels, not %d' % volume)
+    dims = np.array(voxel.shape)
+
+    # output k is set where the tool voxels u (in the box) cover the part
+    # at k - dims//2 - origin - u (see get_spatial_corr), i.e. the ball or
+    # disc around k - shift, swept along the cylinder's axis
+    shift = dims // 2 + origin + model['center']
+    radius = int(np.floor(np.sqrt(model['radius2'])))
+    high = [radius if a in model['axes'] else 0 for a in range(3)]
+    low = list(high)
+    # the first voxels along the cylinder's axis only feed the sweep
+    first = list(high)
+    if model['axis'] is not None:
+        low[model['axis']] += model['length'] - 1
+
+    counts = new_array(dims, np.int32, alpha.get_scratch())
+    for sl in get_slabs(counts):
+        ranges = [(sl.start, sl.stop), (0, dims[1]), (0, dims[2])]
+        index = [np.arange(start - s - l, stop - s + h) % n for (start, stop),
+                        s, l, h, n in zip(ranges, shift, low, high, dims)]
+        window = voxel[np.ix_(*index)] > 0.5
+        near, inside = get_within(window, model['radius2'], model['axes'])
+        if model['axis'] is not None:
+            axis, length = model['axis'], model['length']
+            near = get_runs(near, length, axis) > 0
+            inside = get_runs(inside, length, axis) == length
+        core = tuple(slice(f, f + stop - start)
+                                for (start, stop), f in zip(ranges, first))
+        counts[sl] = np.where(inside[core], volume, near[core])
+
+    corr = Shape()
+    corr.set_scratch(alpha.get_scratch())
+    corr.set_voxel(counts)
+    return corr
@@ -0,0 +1,326 @@
+#    MAD Lab, University at Buffalo
+#    Copyright (C) 2018  Prakhar Jaiswal <prakharj@buffalo.edu>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Coarse-to-fine computation of the as manufactured model.
+
+Whether a voxel belongs to the opening of the part by the tool (see
+get_as_manufactured in morphology.py) only depends on the voxels of the
+part within the margin of the voxel, the dims of the tool's bounding box
+minus one along each axis: these are all the voxels the placements of the
+tool holding it can touch. So the grid is first split into blocks of
+block^3 voxels, classified from whether each is empty or full:
+
+- a block whose neighbourhood (the block grown by the margin) holds no
+  voxel of the part is outside the as manufactured model,
+- a block whose neighbourhood is full is inside it.
+
+Only the remaining blocks, along the surface of the part, are computed at
+full resolution, in cores of several blocks each. A core grown by the
+margin on every side (its window) holds all the voxels its result depends
+on, so get_as_manufactured on the window alone gives exactly the voxels of
+the full-resolution result in the core. Cores next to each other along the
+last axis share a window. The whole grid is computed instead when the
+windows are estimated (with the cost model of morphology.py) or, once some
+are done, measured to take longer than it.
+"""
+
+import time
+import logging
+import numpy as np
+
+from shape import Shape, new_array, get_slabs, pack_voxel, is_smooth
+from morphology import (get_as_manufactured, get_packed_shape,
+                        get_engine_costs, estimate_costs, crop_voxels,
+                        get_edt_model, report)
+
+logger = logging.getLogger(__name__)
+
+# edge of the blocks classified at the coarse level, in voxels
+BLOCK = 4
+# smallest edge of the cores computed at full resolution, in voxels
+MIN_CORE = 16
+# fraction of the estimated time of the windows after which the time they
+# actually take is extrapolated, to give up on them if the full grid is
+# cheaper after all
+PROJECT_FRACTION = 0.05
+
+def get_window_size(n):
+    '''
+    Returns the smallest even 2/3/5/7-smooth size not smaller than 'n'
+    '''
+    n += n % 2
+    while not is_smooth(n):
+        n += 2
+    return n
+
+def get_block_bounds(voxel, block = BLOCK):
+    '''
+    Returns whether any and whether all of the voxels of each block of
+    'block'^3 voxels of 'voxel' are set (larger than 0.5), as 3D boolean
+    arrays with one element per block
+    The blocks at the far ends of axes not divisible by 'block' are
+    completed with empty voxels for any and with full ones for all
+    '''
+    dims = np.array(voxel.shape)
+    nblocks = -(-dims // block)
+    anyset = np.zeros(nblocks, dtype = bool)
+    allset = np.zeros(nblocks, dtype = bool)
+    for sl in get_slabs(voxel, block):
+        slab = voxel[sl] > 0.5
+        pad = [(0, -n % block) for n in slab.shape]
+        n = [(dim + p[1]) // block for dim, p in zip(slab.shape, pad)]
+        start = sl.start // block
+        for out, value, reduce in ((anyset, False, np.any),
+                                    (allset, True, np.all)):
+            padded = np.pad(slab, pad, 'constant', constant_values = value)
+            padded = padded.reshape(n[0], block, n[1], block, n[2], block)
+            out[start:start + n[0]] = reduce(reduce(reduce(padded, 5), 3), 1)
+    return anyset, allset
+
+def grow_blocks(blocks, radius, value):
+    '''
+    Returns whether each block of 'blocks' has a block equal to 'value'
+    within 'radius' blocks along each axis, the grid wrapping around as the
+    convolution does
+    '''
+    out = blocks == value
+    for axis, r in enumerate(radius):
+        grown = out.copy()
+        for shift in range(1, min(r, out.shape[axis] - 1) + 1):
+            grown |= np.roll(out, shift, axis) | np.roll(out, -shift, axis)
+        out = grown
+    return out
+
+def classify_blocks(voxel, margin, block = BLOCK):
+    '''
+    Returns the blocks of 'voxel' certainly inside and certainly outside
+    the as manufactured model for a tool of margin 'margin', as 3D boolean
+    arrays with one element per block
+    '''
+    anyset, allset = get_block_bounds(voxel, block)
+    radius = [-(-int(m) // block) for m in margin]
+    inside = ~grow_blocks(allset, radius, False)
+    outside = ~grow_blocks(anyset, radius, True)
+    return inside, outside
+
+def expand_blocks(out, blocks, block):
+    '''
+    Sets the voxels of 'out' covered by the set elements of 'blocks'
+    '''
+    dims = out.shape
+    for i in range(blocks.shape[0]):
+        if blocks[i].any():
+            layer = np.repeat(np.repeat(blocks[i], block, 0), block, 1)
+            layer = layer[:dims[1], :dims[2]]
+            sl = slice(i * block, min((i + 1) * block, dims[0]))
+            out[sl] |= layer
+
+def get_cores(uncertain, core_blocks):
+    '''
+    Returns the cores of 'core_blocks' blocks along each axis holding an
+    uncertain block, consecutive ones along the last axis merged, as tuples
+    of three slices of blocks
+    '''
+    nblocks = uncertain.shape
+    pad = [(0, -n % c) for n, c in zip(nblocks, core_blocks)]
+    n = [(dim + p[1]) // c for dim, p, c in zip(nblocks, pad, core_blocks)]
+    cores = np.pad(uncertain, pad, 'constant').reshape(n[0], core_blocks[0],
+                            n[1], core_blocks[1], n[2], core_blocks[2])
+    cores = cores.any(axis = 5).any(axis = 3).any(axis = 1)
+    out = []
+    for i, j in np.ndindex(n[0], n[1]):
+        # starts and ends of the runs of uncertain cores along the row
+        row = np.concatenate(([False], cores[i, j], [False]))
+        edges = np.flatnonzero(row[1:] != row[:-1])
+        for k0, k1 in zip(edges[::2], edges[1::2]):
+            out.append(tuple(slice(a * c, min(b * c, dim)) for a, b, c, dim
+                        in zip((i, j, k0), (i + 1, j + 1, k1), core_blocks,
+                                                                nblocks)))
+    return out
+
+def get_cost(costs, engine = None):
+    '''
+    Returns the estimated time of 'engine' among 'costs' (see
+    morphology.estimate_costs), of the cheapest one if None
+    '''
+    if engine is None:
+        return min(costs)[0]
+    return dict((name, cost) for cost, name in costs)[engine]
+
+def get_windows(uncertain, dims, tool, block = BLOCK, engine = None):
+    '''
+    Returns the windows refining the 'uncertain' blocks of a grid of 'dims'
+    for the voxels 'tool' (see crop_tool), as a list of the start and end
+    voxel of their cores, the dims of their grids and their estimated time,
+    and the estimated time of all
+    The edge of the cores (a power of two times MIN_CORE voxels) is chosen
+    to minimize the time
+    '''
+    margin = np.array(tool.shape) - 1
+    volume = np.count_nonzero(tool)
+    edt = get_edt_model(tool) is not None
+    best = None
+    edge = MIN_CORE
+    while True:
+        core_blocks = [-(-edge // block)] * 3
+        windows = []
+        cost = 0.0
+        for core in get_cores(uncertain, core_blocks):
+            lo = np.array([sl.start for sl in core]) * block
+            hi = np.minimum(np.array([sl.stop for sl in core]) * block, dims)
+            size = [get_window_size(n) for n in hi - lo + 2 * margin]
+            window_cost = get_cost(estimate_costs(size, volume,
+                                    tool.shape, 2, edt = edt), engine)
+            windows.append((lo, hi, size, window_cost))
+            cost += window_cost
+        if best is None or cost < best[1]:
+            best = windows, cost
+        if edge >= max(dims):
+            return best
+        edge *= 2
+
+def crop_tool(beta):
+    '''
+    Returns the voxels of the bounding box of 'beta' as 3D boolean array
+    '''
+    return crop_voxels(beta.get_voxel() > 0.5)[1]
+
+def get_tool_window(tool, dims):
+    '''
+    Returns a padded Shape of 'dims' holding the voxels 'tool' (see
+    crop_tool) in its corner
+    '''
+    grid = np.zeros(dims, dtype = 'f')
+    grid[:tool.shape[0], :tool.shape[1], :tool.shape[2]] = tool
+    shape = Shape()
+    shape.set_voxel(grid)
+    return shape
+
+def refine_windows(voxel, windows, cost, full_cost, inside, tool,
+                block = BLOCK, engine = None, scratch = None, progress = None):
+    '''
+    Computes the as manufactured model of 'voxel' from the blocks certainly
+    'inside' it and the 'windows' (see get_windows) for the voxels 'tool'
+    Output: the packed voxels, None if the windows turn out to take longer
+    than 'full_cost', the estimated time of the full grid
+    '''
+    dims = voxel.shape
+    margin = np.array(tool.shape) - 1
+    out = new_array(dims, bool, scratch)
+    expand_blocks(out, inside, block)
+    tools = {}
+    start = time.time()
+    done = 0.0
+    for i, (lo, hi, size, window_cost) in enumerate(windows):
+        report(progress, 0.45 + 0.5 * i / len(windows),
+                'Refining window %d/%d' % (i + 1, len(windows)))
+        if done >= PROJECT_FRACTION * cost:
+            projected = (time.time() - start) * cost / done
+            if projected > full_cost:
+                logger.info('as_man multires: windows projected at %.3gs vs '
+                        '%.3gs for the full grid', projected, full_cost)
+                return None
+        index = [np.arange(l - m, h + m) % n
+                for l, h, m, n in zip(lo, hi, margin, dims)]
+        grid = np.zeros(size, dtype = 'f')
+        shape = [len(ix) for ix in index]
+        grid[:shape[0], :shape[1], :shape[2]] = voxel[np.ix_(*index)]
+        part = Shape()
+        part.set_voxel(grid)
+        key = tuple(size)
+        if key not in tools:
+            tools[key] = get_tool_window(tool, size)
+        result, _ = get_as_manufactured(part, tools[key], engine)
+        out[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]] = result.get_voxel()[
+                        margin[0]:margin[0] + hi[0] - lo[0],
+                        margin[1]:margin[1] + hi[1] - lo[1],
+                        margin[2]:margin[2] + hi[2] - lo[2]] > 0.5
+        done += window_cost
+    return pack_voxel(out)
+
+def get_as_manufactured_multires(alpha, beta, engine = None, block = BLOCK,
+                            verify = False, stats = None, progress = None):
+    '''
+    Computes the as manufactured model as get_as_manufactured, at full
+    resolution only near the surface of the part (see above)
+    Input: 'alpha' and 'beta' - padded instances of class 'Shape()'
+    'engine' - 'fft', 'spatial', 'blocked', 'edt' or None for the cheapest
+    'block' - edge of the blocks classified at the coarse level
+    'verify' - also computes the full-resolution result, checks that both
+    match (returning the full-resolution one if not) and times it
+    'stats' - dict filled with the number of blocks by class, the number of
+    windows, the refined fraction of the grid, the time and the speedup
+    Output: 'as_man' and 'non_man' (the non-manufacturable portion of
+    'alpha') - Instances of class 'Shape()' (bit-packed)
+    '''
+    if stats is None:
+        stats = {}
+    start = time.time()
+    dims = np.array(alpha.get_voxel_shape())
+    tool = crop_tool(beta)
+    margin = np.array(tool.shape) - 1
+    voxel = alpha.get_voxel()
+
+    report(progress, 0.4, 'Classifying blocks')
+    inside, outside = classify_blocks(voxel, margin, block)
+    uncertain = ~(inside | outside)
+    windows, cost = get_windows(uncertain, dims, tool, block, engine)
+    costs, _ = get_engine_costs(alpha, beta, 2)
+    full_cost = get_cost(costs, engine)
+    stats.update(blocks = int(inside.size),
+                certain_in = int(np.count_nonzero(inside)),
+                certain_out = int(np.count_nonzero(outside)),
+                windows = len(windows),
+                refined_fraction = float(uncertain.sum()) / uncertain.size)
+
+    stats['estimated_time'] = cost
+    bits = None
+    if cost < full_cost:
+        bits = refine_windows(voxel, windows, cost, full_cost, inside, tool,
+                    block, engine, alpha.get_scratch(), progress)
+    else:
+        logger.info('as_man multires: %d windows estimated at %.3gs vs '
+                    '%.3gs for the full grid', len(windows), cost, full_cost)
+    if bits is None:
+        logger.info('as_man multires: computing the full grid')
+        as_man, non_man = get_as_manufactured(alpha, beta, engine, progress)
+        stats.update(windows = 0, refined_fraction = 1.0)
+    else:
+        as_man = get_packed_shape(bits, dims)
+        non_man = get_packed_shape(alpha.get_bits() & ~bits, dims)
+    stats['time'] = time.time() - start
+
+    if verify:
+        start = time.time()
+        full, full_non_man = get_as_manufactured(alpha, beta, engine)
+        stats['full_time'] = time.time() - start
+        stats['match'] = bool(np.array_equal(full.get_bits(),
+                                                    as_man.get_bits()))
+        if not stats['match']:
+            logger.error('as_man multires: result differs from the full '
+                        'resolution one, which is returned')
+            as_man, non_man = full, full_non_man
+    else:
+        stats['full_time'] = full_cost
+    stats['speedup'] = stats['full_time'] / max(stats['time'], 1e-9)
+    logger.info('as_man multires: %d of %d blocks certain (%d in, %d out), '
+                '%d windows, %.3gs, speedup %.3g over the full grid%s',
+                stats['certain_in'] + stats['certain_out'], stats['blocks'],
+                stats['certain_in'], stats['certain_out'], stats['windows'],
+                stats['time'], stats['speedup'],
+                '' if verify else ' (estimated)')
+    return as_man, non_man
@@ -0,0 +1,205 @@
+#    MAD Lab, University at Buffalo
+#    Copyright (C) 2018  Prakhar Jaiswal <prakharj@buffalo.edu>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+import fftw3f
+
+# default file the FFTW wisdom is kept in between processes
+WISDOM_FILE = os.path.join(os.path.expanduser('~'), '.morph3d',
+                                                        'fftw3f.wisdom')
+
+class PlanCache:
+    '''
+    The PlanCache class keeps FFTW plans, together with the arrays they were
+    planned on, keyed by the real-space shape and the transform type
+    The forward and backward plans of a grid share its two arrays (real
+    space and spectrum), and the least recently used grids are dropped
+    once the arrays kept exceed the byte budget, so large grids do not pile
+    up copies of themselves. A grid larger than the budget on its own is
+    dropped as soon as its transform is done, and planned again (from the
+    wisdom) the next time
+    Planning happens once per key, so the slower but faster executing
+    planner modes ('measure', 'patient') pay off for the grid sizes that are
+    transformed repeatedly. The accumulated wisdom is saved to a file and
+    loaded again when a new cache is created, so later processes skip the
+    planning too
+    The plans share their arrays, so a lock lets one thread of a process
+    at a time plan or transform
+    '''
+
+    def __init__(self, flags = ['measure'], wisdom = WISDOM_FILE,
+                                            nthreads = 1, budget = 1 << 30):
+        '''
+        'flags' are the FFTW planner flags, 'wisdom' the wisdom file (None to
+        not persist wisdom), 'nthreads' the number of threads per transform
+        and 'budget' the bytes of the plans' arrays kept
+        '''
+        self.flags = list(flags)
+        self.wisdom = wisdom
+        self.nthreads = nthreads
+        self.budget = budget
+        self.plans = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.RLock()
+        self.load_wisdom()
+
+    def set_flags(self, flags):
+        '''
+        Sets the planner flags, plans made with other flags are dropped
+        '''
+        self.flags = list(flags)
+        self.clear()
+
+    def set_nthreads(self, nthreads):
+        self.nthreads = nthreads
+        self.clear()
+
+    def set_budget(self, budget):
+        with self.lock:
+            self.budget = budget
+            self.evict()
+
+    def clear(self):
+        with self.lock:
+            self.plans.clear()
+            self.nbytes = 0
+
+    def evict(self):
+        '''
+        Drops the grids that alone exceed the budget, then the least
+        recently used grids beyond the budget (the plan and arrays of a
+        dropped grid stay valid for a caller until it is done with them)
+        '''
+        for key, entry in list(self.plans.items()):
+            if get_nbytes(entry) > self.budget:
+                del self.plans[key]
+                self.nbytes -= get_nbytes(entry)
+        while self.nbytes > self.budget:
+            key, entry = self.plans.popitem(last = False)
+            self.nbytes -= get_nbytes(entry)
+
+    def get_plan(self, dims, direction, real = True):
+        '''
+        Returns (plan, inarray, outarray) for transforming real-space data of
+        shape 'dims' in 'direction', creating the plan if needed
+        With 'real' set the transform is real-to-complex ('forward') or
+        complex-to-real ('backward') with the half spectrum of shape
+        dims[:-1] + (dims[-1]/2 + 1,), otherwise complex-to-complex
+        '''
+        dims = tuple(int(dim) for dim in dims)
+        if real:
+            shapes = (dims, dims[:-1] + (dims[-1]//2 + 1,))
+            dtypes = ('f', 'F')
+        else:
+            shapes, dtypes = (dims, dims), ('F', 'F')
+        key = (dims, real)
+        
+        with self.lock:
+            if key in self.plans:
+                entry = self.plans.pop(key)
+            else:
+                # planning may overwrite the arrays, so they are filled only
+                # when a plan is executed
+                entry = {'arrays': (np.zeros(shapes[0], dtype = dtypes[0]),
+                                    np.zeros(shapes[1], dtype = dtypes[1]))}
+                self.nbytes += get_nbytes(entry)
+            self.plans[key] = entry
+            space, spectrum = entry['arrays']
+            if direction == 'forward':
+                inarray, outarray = space, spectrum
+            else:
+                inarray, outarray = spectrum, space
+            if direction not in entry:
+                entry[direction] = fftw3f.Plan(inarray, outarray,
+                                    direction = direction, flags = self.flags,
+                                    nthreads = self.nthreads)
+                self.save_wisdom()
+            self.evict()
+            return entry[direction], inarray, outarray
+
+    def forward(self, voxel, real = True, out = None):
+        '''
+        Returns the Fourier transform of 'voxel' (the half spectrum if 'real')
+        The result is copied into 'out' (e.g. a memmap) if given
+        '''
+        with self.lock:
+            plan, inarray, outarray = self.get_plan(voxel.shape, 'forward',
+                                                                        real)
+            inarray[...] = voxel
+            plan()
+            if out is not None:
+                out[...] = outarray
+                return out
+            return outarray.copy()
+
+    def backward(self, voxel_ft, dims = None, out = None):
+        '''
+        Returns the unnormalized inverse Fourier transform of 'voxel_ft'
+        'dims' is the real-space shape if 'voxel_ft' is a half spectrum and
+        None if it is a full spectrum (the output is then complex)
+        The result is copied into 'out' (e.g. a memmap) if given
+        '''
+        real = dims is not None
+        if not real:
+            dims = voxel_ft.shape
+        with self.lock:
+            plan, inarray, outarray = self.get_plan(dims, 'backward', real)
+            inarray[...] = voxel_ft
+            plan()
+            if out is not None:
+                out[...] = outarray
+                return out
+            return outarray.copy()
+
+    def load_wisdom(self):
+        '''
+        Imports the wisdom saved in the wisdom file, if any
+        '''
+        if self.wisdom is not None and os.path.isfile(self.wisdom):
+            fftw3f.import_wisdom_from_file(self.wisdom)
+
+    def save_wisdom(self):
+        '''
+        Saves the current wisdom to the wisdom file
+        The saved wisdom is imported first so that wisdom gathered by other
+        processes is kept, and the file is replaced atomically
+        '''
+        if self.wisdom is None:
+            return
+        directory = os.path.dirname(self.wisdom)
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+        self.load_wisdom()
+        fd, tmp = tempfile.mkstemp(suffix = '.wisdom', dir = directory)
+        os.close(fd)
+        fftw3f.export_wisdom_to_file(tmp)
+        os.rename(tmp, self.wisdom)
+
+def get_nbytes(entry):
+    '''
+    Returns the bytes of the arrays of a grid's entry of PlanCache
+    '''
+    return sum(array.nbytes for array in entry['arrays'])
+
+# plans shared by all transforms in this process
+fft_plans = PlanCache()
@@ -0,0 +1,168 @@
+#    MAD Lab, University at Buffalo
+#    Copyright (C) 2018  Prakhar Jaiswal <prakharj@buffalo.edu>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Rotation of point clouds and voxel grids for orientation studies.
+
+Rotations are given by Euler angles (phi, theta, psi) as in the orientation
+samples file 'oim20.eul'. All functions accept a single rotation or a batch
+of them and work on whole arrays of points at once.
+"""
+
+import numpy as np
+from scipy.ndimage import map_coordinates, spline_filter
+
+def read_rotation_samples(filename):
+    '''
+    Reads the Euler angle (phi, theta, psi) samples, one per row
+    '''
+    return np.loadtxt(filename, ndmin = 2)
+
+def get_rot_mat(angles):
+    '''
+    Returns the rotation matrix for Euler angles (phi, theta, psi)
+    'angles' may also be an N x 3 array, the output is then N x 3 x 3
+    '''
+    angles = np.asarray(angles, dtype = 'd')
+    phi, theta, psi = angles[..., 0], angles[..., 1], angles[..., 2]
+    cphi = np.cos(phi)
+    sphi = np.sin(phi)
+    ctheta = np.cos(theta)
+    stheta = np.sin(theta)
+    cpsi = np.cos(psi)
+    spsi = np.sin(psi)
+    rot = np.zeros(angles.shape[:-1] + (3, 3))
+    rot[..., 0, 0] = cpsi*cphi-spsi*ctheta*sphi
+    rot[..., 0, 1] = -cpsi*sphi-spsi*ctheta*cphi
+    rot[..., 0, 2] = spsi*stheta
+    rot[..., 1, 0] = spsi*cphi+cpsi*ctheta*sphi
+    rot[..., 1, 1] = -spsi*sphi+cpsi*ctheta*cphi
+    rot[..., 1, 2] = -cpsi*stheta
+    rot[..., 2, 0] = stheta*sphi
+    rot[..., 2, 1] = stheta*cphi
+    rot[..., 2, 2] = ctheta
+    return rot
+
+def rotate(pts, rot_mat, center = None):
+    '''
+    Rotates the points 'pts' (3 or N x 3) by 'rot_mat' (3 x 3, or M x 3 x 3
+    for M rotations at once) about 'center' (the origin if None)
+    Output: rotated points of shape pts.shape, or M x pts.shape
+    '''
+    pts = np.asarray(pts, dtype = 'd')
+    if center is not None:
+        pts = pts - center
+    out = np.einsum('...ij,nj->...ni', rot_mat, np.atleast_2d(pts))
+    if center is not None:
+        out += center
+    if pts.ndim == 1:
+        out = out[..., 0, :]
+    return out
+
+def get_centroid(voxel):
+    '''
+    Returns the centroid of the occupied voxels (voxel coordinates)
+    '''
+    coords = np.nonzero(voxel)
+    if len(coords[0]) == 0:
+        return (np.array(voxel.shape) - 1) / 2.0
+    return np.array([c.mean() for c in coords])
+
+def get_bounded_dims(voxel, center = None):
+    '''
+    Returns the cubic dims that hold the occupied voxels rotated about
+    'center' (the centroid if None) in any orientation
+    '''
+    if center is None:
+        center = get_centroid(voxel)
+    coords = np.transpose(np.nonzero(voxel))
+    if len(coords) == 0:
+        return list(voxel.shape)
+    radius = np.sqrt(((coords - center)**2).sum(1).max())
+    # the voxel half diagonal and one voxel of margin for interpolation
+    side = int(np.ceil(2*(radius + np.sqrt(3)/2.0))) + 2
+    return [side + side % 2] * 3
+
+class Rotator:
+    '''
+    The Rotator class resamples one voxel grid in many orientations
+    The centered coordinates of the output grid are computed once and
+    reused for every rotation, so each rotation costs one 3 x 3 matrix
+    product over the output points and one interpolation
+    '''
+
+    def __init__(self, voxel, dims = None, center = None, order = 1,
+                                                            level = 0.5):
+        '''
+        'voxel' is rotated about 'center' (its centroid if None) into a grid
+        of 'dims' (large enough for any orientation if None) whose center
+        the rotation center is mapped to. 'order' is the spline order of
+        the interpolation and 'level' the threshold for the output voxels
+        '''
+        # one layer of empty voxels around the grid, so that points an
+        # rounding error outside the edge still interpolate the edge voxels
+        self.voxel = np.pad(np.asarray(voxel, dtype = 'f'), 1, 'constant')
+        if order > 1:
+            # the spline coefficients are computed once for all rotations
+            self.voxel = spline_filter(self.voxel, order, output = 'f')
+        self.center = get_centroid(voxel) if center is None else \
+                                                        np.asarray(center)
+        self.dims = get_bounded_dims(voxel, self.center) if dims is None \
+                                                        else list(dims)
+        self.order = order
+        self.level = level
+        # output voxel coordinates relative to the output center, 3 x P
+        # the output center has the same fractional part as the rotation
+        # center so that the identity maps voxels exactly onto voxels
+        out_center = np.floor((np.array(self.dims) - 1) / 2.0) + \
+                                        (self.center - np.floor(self.center))
+        grid = np.indices(self.dims, dtype = 'f').reshape(3, -1)
+        self.coords = grid - out_center[:, None].astype('f')
+
+    def get_dims(self):
+        return self.dims
+
+    def rotate_voxel(self, rot_mat):
+        '''
+        Returns the voxel grid rotated by 'rot_mat' as 3D numpy boolean array
+        '''
+        # output points are mapped back by the inverse (transposed) rotation
+        src = np.dot(np.asarray(rot_mat, dtype = 'f').T, self.coords)
+        src += self.center[:, None] + 1
+        values = map_coordinates(self.voxel, src, order = self.order,
+                                                            prefilter = False)
+        return (values > self.level).reshape(self.dims)
+
+    def rotate_voxels(self, rot_mats):
+        '''
+        Returns the voxel grid rotated by each of 'rot_mats' (M x 3 x 3) as
+        M x dims numpy boolean array, resampled in a single interpolation
+        The memory used grows with M, so large sets of rotations should be
+        passed in batches
+        '''
+        rot_mats = np.asarray(rot_mats, dtype = 'f')
+        src = np.einsum('mji,jp->imp', rot_mats, self.coords)
+        src += self.center[:, None, None] + 1
+        values = map_coordinates(self.voxel, src.reshape(3, -1),
+                                    order = self.order, prefilter = False)
+        return (values > self.level).reshape([len(rot_mats)] + self.dims)
+
+def rotate_voxel(voxel, rot_mat, dims = None, center = None, level = 0.5):
+    '''
+    Rotates the voxel grid by 'rot_mat' about 'center' (its centroid if None)
+    into a grid of 'dims' (large enough for any orientation if None)
+    '''
+    return Rotator(voxel, dims, center, level = level).rotate_voxel(rot_mat)
@@ -15,11 +15,23 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import hashlib
+import itertools
+import tempfile
 import numpy as np
 from numpy import *
-import subprocess
 import binvox_rw
-import fftw3f
+import voxel_file
+from block_grid import BLOCK, dense_to_blocks
+from plan_cache import fft_plans
+from voxel_cache import voxel_cache
+
+# number of set bits of every byte value, to count bit-packed voxels
+POPCOUNT = array([bin(i).count('1') for i in range(256)], dtype = uint8)
+# bytes of voxel data the chunked operations process at once
+SLAB_BYTES = 64 << 20
+# source of the version numbers of the voxel data, see update_version
+versions = itertools.count(1)
 
 class Shape:
     '''
@@ -33,8 +45,31 @@ class Shape:
         '''
         # The voxel data (to be stored as 3D numpy array of 0's and 1's
         self.voxel = array([])
+        # bit-packed voxel data (one bit per voxel, numpy.packbits order)
+        # and its dims, used instead of 'voxel' when not None
+        self.bits = None
+        self.bits_shape = None
+        # if set, binary voxel data passed to set_voxel is stored bit-packed
+        self.packed = False
+        # block-sparse voxel data (block_grid.BlockGrid), used instead of
+        # 'voxel' when not None
+        self.blocks = None
+        # if set, read_voxel loads the model block-sparse
+        self.sparse = False
+        # directory the large grids (padded voxels, spectra, convolutions)
+        # are memory-mapped in, None to keep them in memory
+        self.scratch = None
+        # version of the voxel data, changed whenever the data is replaced
+        # so that views of it (e.g. displayed surfaces) know when to update
+        self.version = 0
         # Fourier transform of the voxel data
         self.voxel_ft = array([])
+        # shape of the real voxel data whose half spectrum is stored in
+        # voxel_ft (None when voxel_ft holds the full complex spectrum)
+        self.ft_dims = None
+        # version of the voxel data voxel_ft is the transform of, None if
+        # it is not known to be one, see fourier_transform
+        self.ft_version = None
         self.visible = True
         # the actual resolution of the shape taking scale into consideration
         self.size = 64
@@ -42,59 +77,204 @@ class Shape:
         self.resolution = 64
         self.scale = 1
         self.filename = ""
+        # 'binvox' to rasterize with the bundled binvox executable or
+        # 'native' to use the NumPy voxelizer (see voxelizer.py)
+        self.voxelizer = 'binvox'
+        # SHA-1 of the input file contents and the (mtime, size) it was
+        # computed for, see get_filehash
+        self.filehash = ""
+        self.filestat = None
+
+    def copy_settings(self):
+        '''
+        Returns a new Shape with the input file, resolution, scale,
+        voxelizer, visibility and storage settings of this one, but without
+        its voxel data
+        '''
+        shape = Shape()
+        shape.filename = self.filename
+        shape.filehash = self.filehash
+        shape.filestat = self.filestat
+        shape.resolution = self.resolution
+        shape.scale = self.scale
+        shape.size = self.size
+        shape.voxelizer = self.voxelizer
+        shape.visible = self.visible
+        shape.packed = self.packed
+        shape.sparse = self.sparse
+        shape.scratch = self.scratch
+        return shape
 
     def read_voxel(self):
         '''
         Reads in a triangulated 3D model file (.obj, .stl, etc.), rasterizes 
-        it using 'binvox', and saves the data as 3D numpy array of 0's and 1's
+        it using 'binvox' (or the native voxelizer, see set_voxelizer), and
+        saves the data as 3D numpy array of 0's and 1's
+        The rasterized models are kept in the shared cache 'voxel_cache'
         '''
         if len(self.filename) != 0:
-            binvox = self.filename[:self.filename.rfind('.')] + '.binvox'
-            
-            if not os.path.isfile(binvox):
-                subprocess.call("./binvox -d "+ str(self.size) +
-                                    " " + self.filename, shell = True)
-            
-            fid = open(binvox, 'r')
-            model = binvox_rw.read_as_3d_array(fid)
-            
-            if model.dims[0] != self.size:
-                os.remove(binvox)
-                subprocess.call("./binvox -d "+ str(self.size) +
-                                    " " + self.filename, shell = True)
-                fid = open(binvox, 'r')
-                model = binvox_rw.read_as_3d_array(fid)
-            
-            self.voxel = 1*model.data
+            if self.sparse:
+                self.blocks = voxel_cache.get_block_grid(self)
+                self.voxel = array([])
+            else:
+                self.blocks = None
+                data = voxel_cache.get_voxel(self)
+                if self.scratch is None:
+                    self.voxel = 1*data
+                else:
+                    self.voxel = new_array(data.shape, uint8, self.scratch)
+                    for sl in get_slabs(data):
+                        self.voxel[sl] = data[sl]
+            self.bits = None
+            self.bits_shape = None
+            self.update_version()
             if self.scale != 1:
                 self.pad_voxel([self.resolution] * 3)
 
-    def write_voxel(self, filename):
-        '''
-        Write the voxel model data into a .binvox file
-        '''
-        if len(filename) != 0 and not self.isempty():
-            fp = open(filename, 'w')
-            data = self.voxel > 0
-            dims = list(self.get_voxel_shape())
-            translate = [0.0, 0.0, 0.0]
-            scale = 1.0
-            axis_order = 'xyz'
-            model = binvox_rw.Voxels(data, dims, translate, scale, axis_order)
-            binvox_rw.write(model, fp)
-    
+    def write_voxel(self, filename, compress = False, info = None):
+        '''
+        Write the voxel model data into a .binvox file, or a native file if
+        'filename' ends with voxel_file.EXTENSION (see write_native)
+        The data is written slab by slab, never copying the whole grid
+        '''
+        if len(filename) != 0 and voxel_file.is_voxel_file(filename):
+            self.write_native(filename, compress, info)
+        elif len(filename) != 0 and not self.isempty():
+            with open(filename, 'wb') as fp:
+                if self.blocks is not None:
+                    data = self.blocks
+                else:
+                    # the sublevel set at 0, one slab at a time
+                    data = (slab > 0 for slab in self.get_voxel_slabs())
+                # the header holds the dims in the file's x, z, y order
+                sz = self.get_voxel_shape()
+                dims = [sz[0], sz[2], sz[1]]
+                translate = [0.0, 0.0, 0.0]
+                scale = 1.0
+                axis_order = 'xyz'
+                model = binvox_rw.Voxels(data, dims, translate, scale,
+                                                                axis_order)
+                binvox_rw.write(model, fp)
+
+    def write_native(self, filename, compress = False, info = None):
+        '''
+        Writes the voxel model bit-packed into a native file (see
+        voxel_file.py), zlib-compressed if 'compress' is set, with the
+        resolution, scale, input file and the dict 'info' as provenance
+        '''
+        with open(filename, 'wb') as fp:
+            voxel_file.write(fp, self.get_bits(), self.get_voxel_shape(),
+                        compress, resolution = self.resolution,
+                        scale = self.scale, filename = self.filename,
+                        filehash = self.filehash, voxelizer = self.voxelizer,
+                        info = info or {})
+
+    def read_native(self, filename):
+        '''
+        Reads the voxel model from a native file (see voxel_file.py) with
+        the resolution, scale and input file recorded in it
+        Uncompressed data is memory-mapped, not read
+        Output: the 'info' recorded in the file
+        '''
+        bits, header = voxel_file.read(filename)
+        self.set_bits(bits, header['dims'])
+        self.filename = header.get('filename', '')
+        self.filehash = header.get('filehash', '')
+        self.filestat = None
+        self.voxelizer = header.get('voxelizer', self.voxelizer)
+        self.scale = header.get('scale', self.scale)
+        self.set_resolution(header.get('resolution', self.resolution))
+        return header.get('info', {})
+
     def set_voxel(self, voxel):
         '''
         Sets the voxel field to voxel and updates the resolution
+        The data is stored bit-packed if the packed mode is set
+        '''
+        if self.packed:
+            self.set_bits(pack_voxel(voxel), voxel.shape)
+        else:
+            self.voxel = voxel
+            self.bits = None
+            self.bits_shape = None
+            self.blocks = None
+            self.update_version()
+            self.set_resolution(self.get_voxel_shape()[0])
+
+    def set_bits(self, bits, dims):
+        '''
+        Sets the voxel data to the bit-packed 'bits' of a 3D array of 'dims'
+        (as returned by numpy.packbits) and updates the resolution
+        '''
+        self.bits = bits
+        self.bits_shape = tuple(int(dim) for dim in dims)
+        # clearing the bits past the last voxel, so they are never counted
+        # (only if any is set, so read-only or memory-mapped bits are kept)
+        nbits = prod(self.bits_shape)
+        mask = (0xff << (8 - nbits % 8)) & 0xff
+        if nbits % 8 != 0 and len(bits) > 0 and bits[-1] & ~mask & 0xff:
+            self.bits = bits.copy()
+            self.bits[-1] &= mask
+        self.voxel = array([])
+        self.blocks = None
+        self.update_version()
+        self.set_resolution(self.bits_shape[0])
+
+    def set_block_grid(self, grid):
+        '''
+        Sets the voxel data to the block-sparse 'grid' (block_grid.BlockGrid)
+        and updates the resolution
+        '''
+        self.blocks = grid
+        self.voxel = array([])
+        self.bits = None
+        self.bits_shape = None
+        self.update_version()
+        self.set_resolution(grid.get_dims()[0])
+
+    def update_version(self):
+        '''
+        Marks the voxel data as changed by giving it a new version number,
+        unique among all shapes
         '''
-        self.voxel = voxel
-        self.set_resolution(self.get_voxel_shape()[0])
+        self.version = next(versions)
 
-    def set_voxel_ft(self, voxel_ft):
+    def set_scratch(self, directory):
+        '''
+        Sets the directory the large grids of this shape (and of the shapes
+        computed from it) are memory-mapped in, None to keep them in memory
+        '''
+        self.scratch = directory
+
+    def set_sparse(self, flag = True):
+        '''
+        Sets whether read_voxel loads the model block-sparse
+        '''
+        self.sparse = flag
+
+    def set_packed(self, flag = True):
+        '''
+        Sets the packed mode, converting the current voxel data
+        Only binary (0/1) voxel data should be stored packed
+        '''
+        self.packed = flag
+        if flag and self.bits is None and not self.isempty():
+            self.set_voxel(self.voxel)
+        elif not flag and self.bits is not None:
+            self.set_voxel(self.get_voxel())
+
+    def set_voxel_ft(self, voxel_ft, dims = None):
         '''
         Sets the voxel_ft field to voxel_ft
+        'dims' is the shape of the real voxel data if voxel_ft is the half
+        spectrum of a real-to-complex transform, None for a full spectrum
+        If the shape holds voxel data, voxel_ft is taken as its transform
+        (e.g. computed once and shared between processes), which
+        fourier_transform then does not redo
         '''
         self.voxel_ft = voxel_ft
+        self.ft_dims = None if dims is None else tuple(dims)
+        self.ft_version = None if self.isempty() else self.version
 
     def set_size(self):
         '''
@@ -119,6 +299,16 @@ class Shape:
 
     def set_filename(self, filename):
         self.filename = filename
+        self.filehash = ""
+        self.filestat = None
+
+    def set_voxelizer(self, voxelizer):
+        '''
+        Selects the voxelizer used by read_voxel, 'binvox' or 'native'
+        '''
+        if voxelizer not in ('binvox', 'native'):
+            raise ValueError('Unknown voxelizer ' + str(voxelizer))
+        self.voxelizer = voxelizer
 
     def set_visibility(self, flag = True):
         self.visible = flag
@@ -127,27 +317,121 @@ class Shape:
         self.visible = not self.visible
 
     def get_voxel(self):
+        '''
+        Returns the voxel data, unpacked to a new 3D numpy array of 0's and
+        1's (uint8) if it is stored bit-packed
+        '''
+        if self.blocks is not None:
+            return self.blocks.to_dense(uint8)
+        if self.bits is not None:
+            nbits = prod(self.bits_shape)
+            return unpackbits(self.bits)[:nbits].reshape(self.bits_shape)
         return self.voxel
 
+    def get_voxel_slabs(self):
+        '''
+        Yields the voxel data as 3D numpy arrays of consecutive layers along
+        the first axis, of about SLAB_BYTES unpacked
+        Bit-packed data is unpacked one slab at a time
+        '''
+        if self.bits is None:
+            voxel = self.get_voxel()
+            for sl in get_slabs(voxel):
+                yield voxel[sl]
+            return
+        dims = self.bits_shape
+        layer = prod(dims[1:])
+        # slabs have to start on whole bytes of the packed data
+        multiple = 1
+        while (multiple * layer) % 8 != 0:
+            multiple += 1
+        step = max(1, SLAB_BYTES // max(1, layer))
+        step = -(-step // multiple) * multiple
+        for x0 in range(0, dims[0], step):
+            x1 = min(x0 + step, dims[0])
+            bits = self.bits[x0 * layer // 8:-(-x1 * layer // 8)]
+            yield unpackbits(bits)[:(x1 - x0) * layer].reshape(
+                                                    (x1 - x0,) + dims[1:])
+
+    def is_packed(self):
+        return self.bits is not None
+
+    def is_sparse(self):
+        return self.blocks is not None
+
+    def get_bits(self):
+        '''
+        Returns the voxel data bit-packed (voxels larger than 0.5 are set)
+        '''
+        if self.bits is not None:
+            return self.bits
+        return pack_voxel(self.get_voxel())
+
+    def get_block_grid(self, block = BLOCK):
+        '''
+        Returns the voxel data block-sparse (voxels larger than 0.5 are set)
+        '''
+        if self.blocks is not None:
+            return self.blocks
+        return dense_to_blocks(self.get_voxel(), block)
+
     def get_voxel_ft(self):
         return self.voxel_ft
 
     def get_size(self):
         return self.size
 
+    def get_resolution(self):
+        return self.resolution
+
     def get_scale(self):
         return self.scale
 
     def get_filename(self):
         return self.filename
 
+    def get_voxelizer(self):
+        return self.voxelizer
+
+    def get_scratch(self):
+        return self.scratch
+
+    def get_version(self):
+        return self.version
+
+    def get_filehash(self):
+        '''
+        Returns the SHA-1 hex digest of the contents of the input file
+        The digest is recomputed only if the file's mtime or size changed
+        '''
+        if len(self.filename) == 0:
+            return ""
+        st = os.stat(self.filename)
+        filestat = (st.st_mtime, st.st_size)
+        if filestat != self.filestat:
+            sha = hashlib.sha1()
+            with open(self.filename, 'rb') as fid:
+                for chunk in iter(lambda: fid.read(1 << 20), b''):
+                    sha.update(chunk)
+            self.filehash = sha.hexdigest()
+            self.filestat = filestat
+        return self.filehash
+
     def get_voxel_shape(self):
+        if self.blocks is not None:
+            return array(self.blocks.get_dims())
+        if self.bits is not None:
+            return array(self.bits_shape)
         return array(self.voxel.shape)
 
     def isempty(self):
         '''
         Returns if the voxel field is empty
         '''
+        if self.blocks is not None:
+            return prod(self.blocks.get_dims()) == 0
+        if self.bits is not None:
+            return prod(self.bits_shape) == 0
         return self.voxel.size == 0
 
     def get_sublevel_set(self, level):
@@ -156,62 +440,268 @@ class Shape:
         The output is a 3D numpy array with 1's in all cell were voxel field
         has value larger than 99.99% of level and 0's elsewhere
         99.99% is used to account for any precision error
-        '''
-        return 1 * (self.voxel > 0.9999*level)
+        With a scratch directory set, the output is a memory-mapped uint8
+        array computed slab by slab
+        '''
+        voxel = self.get_voxel()
+        sublevel_set = new_array(voxel.shape,
+                    int if self.scratch is None else uint8, self.scratch)
+        for sl in get_slabs(voxel):
+            sublevel_set[sl] = voxel[sl] > 0.9999*level
+        return sublevel_set
+
+    def get_sublevel_sets(self, levels, normalize = False, packed = False,
+                                                    offsets = (0, 0, 0)):
+        '''
+        Returns the sublevel sets of the voxel model at each of 'levels'
+        (see get_sublevel_set), computed together in one pass over slabs
+        without full-size temporaries
+        With 'normalize' set the voxel field is taken as a raw inverse
+        transform and normalized on the fly as by 'normalize' (which is not
+        needed then); the sets are also circularly shifted by 'offsets'
+        The outputs are 3D numpy boolean arrays, or numpy.packbits bits
+        with 'packed' set (see set_bits), memory-mapped if a scratch
+        directory is set
+        '''
+        voxel = self.get_voxel()
+        dims = array(voxel.shape)
+        size = prod(dims)
+        offsets = array(offsets) + (dims//2 if normalize else 0)
+        layer = prod(dims[1:])
+        multiple = 1
+        if packed:
+            # slabs have to start on whole bytes of the packed output
+            outs = [new_array([(size + 7)//8], uint8, self.scratch)
+                                                    for level in levels]
+            while (multiple * layer) % 8 != 0:
+                multiple += 1
+        else:
+            outs = [new_array(dims, bool, self.scratch) for level in levels]
+        for sl in get_slabs(voxel, multiple):
+            slab = get_shifted_slab(voxel, sl, offsets)
+            if normalize:
+                slab = slab / size
+            for out, level in zip(outs, levels):
+                mask = slab > 0.9999*level
+                if packed:
+                    bits = packbits(mask)
+                    start = sl.start * layer // 8
+                    out[start:start + len(bits)] = bits
+                else:
+                    out[sl] = mask
+        return outs
 
     def get_volume(self):
         '''
         Returns the volume or the number of high cells in the voxel model
-        '''
-        sublevel_set = self.get_sublevel_set(1)
-        return np.count_nonzero(sublevel_set)
+        Bit-packed data is counted directly on the packed bytes and
+        block-sparse data on the non-empty blocks
+        '''
+        if self.blocks is not None:
+            return self.blocks.get_volume()
+        if self.bits is not None:
+            return int(POPCOUNT[self.bits].sum(dtype = int64))
+        voxel = self.get_voxel()
+        return sum(np.count_nonzero(voxel[sl] > 0.9999)
+                                        for sl in get_slabs(voxel))
 
     def pad_voxel(self, dims):
         '''
         Pads the voxel field with zero to enflate the size upto 'dims'
         The actual data is centered in the 3D array of size 'dims'
+        Block-sparse data stays block-sparse, with a scratch directory set
+        the padded array is memory-mapped and filled slab by slab
         '''
+        if self.blocks is not None:
+            self.blocks = self.blocks.pad(dims)
+            self.update_version()
+            return
         sz = self.get_voxel_shape()
-        voxel = self.voxel
-        self.voxel = zeros(dims, dtype = 'f')
+        voxel = self.get_voxel()
+        self.bits = None
+        self.bits_shape = None
+        self.voxel = new_array(dims, 'f', self.scratch)
 
         sid = (dims - sz)/2
         eid = sid + sz
-        self.voxel[sid[0]:eid[0], sid[1]:eid[1], sid[2]:eid[2]] = voxel
+        for sl in get_slabs(voxel):
+            self.voxel[sid[0] + sl.start:sid[0] + sl.stop, sid[1]:eid[1],
+                                                sid[2]:eid[2]] = voxel[sl]
+        self.update_version()
 
-    def fourier_transform(self):
+    def fourier_transform(self, real = True):
         '''
         Computes the Fast Fourier Transform of the rasterized 3D model
-        '''
-        voxel = self.voxel.astype('f')
-        self.voxel_ft = voxel.astype('F')
-        trans = fftw3f.Plan(voxel, self.voxel_ft, direction='forward')
-        trans()
+        If 'real' is True, a real-to-complex transform is used and only the
+        non-redundant half of the spectrum (n/2+1 entries along the last
+        axis) is stored, otherwise the full complex spectrum is stored
+        The FFTW plans are reused from the shared plan cache 'fft_plans'
+        The transform itself runs in memory and the spectrum is copied into
+        an array of its own, memory-mapped if a scratch directory is set
+        (the morphological operations do not transform such grids unless
+        asked to, see morphology.choose_engine)
+        The transform is skipped if the spectrum of the same kind is already
+        held for the current voxel data
+        '''
+        if self.ft_version == self.version and self.voxel_ft.size > 0 \
+                                    and (self.ft_dims is not None) == real:
+            return
+        voxel = self.get_voxel()
+        dims = voxel.shape[:-1] + (voxel.shape[-1]//2 + 1,) if real \
+                                                            else voxel.shape
+        out = new_array(dims, 'F', self.scratch)
+        self.voxel_ft = fft_plans.forward(voxel, real, out)
+        self.ft_dims = tuple(voxel.shape) if real else None
+        self.ft_version = self.version
 
     def inverse_fourier_transform(self):
         '''
         Computes Inverse Fourier Transform to get back the rasterized 3D model
+        A half spectrum (ft_dims set) is transformed complex-to-real, a full
+        spectrum complex-to-complex keeping only the real part
         '''
         if self.voxel_ft.size == 0:
             pass
+        elif self.ft_dims is not None:
+            out = new_array(self.ft_dims, 'f', self.scratch)
+            self.voxel = fft_plans.backward(self.voxel_ft, self.ft_dims, out)
+            self.update_version()
         else:
-            self.voxel = zeros(self.voxel_ft.shape, dtype = 'f')
-            trans = fftw3f.Plan(self.voxel_ft, self.voxel, direction='backward')
-            trans()
+            self.voxel = fft_plans.backward(self.voxel_ft).real.astype('f')
+            self.update_version()
 
     def normalize(self):
         '''
         Normalizes the Inverse Fourier Tranform
+        The fftshift centers the result for the even dims chosen by
+        get_padded_dims
+        Both are applied one slab of the output at a time
         '''
-        self.voxel /= prod(self.voxel.shape)
-        self.voxel = fft.fftshift(self.voxel)
+        voxel = self.voxel
+        dims = array(voxel.shape)
+        size = prod(dims)
+        self.voxel = new_array(dims, voxel.dtype, self.scratch)
+        for sl in get_slabs(self.voxel):
+            # fftshift moves every axis by half its length
+            self.voxel[sl] = get_shifted_slab(voxel, sl, dims//2) / size
+        self.update_version()
 
     def display(self, mlab, contours = [1], color = (1, 0, 0), opacity = 0.5):
         '''
         Displays the voxel model if the visible flag is set to true and the
         voxel field is not empty
+        Output: the mayavi iso-surface module, None if nothing is displayed
         '''
         if self.visible and not self.isempty():
-            mlab.contour3d(self.voxel, contours = contours,
+            return mlab.contour3d(self.get_voxel(), contours = contours,
                 color = color, opacity = opacity)
-            
+        return None
+
+def new_array(dims, dtype, directory = None):
+    '''
+    Returns a zero-filled array of 'dims', memory-mapped to a file in
+    'directory' if given, in memory otherwise
+    The file is unlinked right away and vanishes with the array
+    '''
+    dims = tuple(int(dim) for dim in dims)
+    if directory is None or prod(dims) == 0:
+        return zeros(dims, dtype = dtype)
+    try:
+        os.makedirs(directory)
+    except OSError:
+        if not os.path.isdir(directory):
+            raise
+    with tempfile.TemporaryFile(dir = directory) as fid:
+        return np.memmap(fid, dtype = dtype, mode = 'w+', shape = dims)
+
+def get_slabs(voxel, multiple = 1):
+    '''
+    Returns slices along the first axis that split 'voxel' into slabs of
+    about SLAB_BYTES (a multiple of 'multiple' layers), so that
+    memory-mapped grids are processed one slab in memory at a time
+    '''
+    n = voxel.shape[0] if voxel.ndim > 0 else 0
+    if n == 0:
+        return []
+    step = max(1, SLAB_BYTES // max(1, voxel.nbytes // n))
+    step = -(-step // multiple) * multiple
+    return [slice(i, min(i + step, n)) for i in range(0, n, step)]
+
+def get_shifted_slab(voxel, sl, offsets):
+    '''
+    Returns the slab 'sl' of 'voxel' circularly shifted by 'offsets' (as
+    numpy.roll), reading only the layers the slab needs
+    '''
+    src = (arange(sl.start, sl.stop) - offsets[0]) % voxel.shape[0]
+    return roll(roll(voxel[src], offsets[1], 1), offsets[2], 2)
+
+def pack_voxel(voxel):
+    '''
+    Returns numpy.packbits(voxel > 0.5), computed slab by slab
+    '''
+    flat = voxel.reshape(-1)
+    step = 8 * max(1, SLAB_BYTES // 8)
+    if len(flat) <= step:
+        return packbits(flat > 0.5)
+    return concatenate([packbits(flat[i:i + step] > 0.5)
+                                    for i in range(0, len(flat), step)])
+
+def multiply(a, b, directory = None):
+    '''
+    Returns the elementwise product of the spectra 'a' and 'b', slab by
+    slab into an array memory-mapped in 'directory' if given
+    '''
+    if directory is None:
+        return a * b
+    out = new_array(a.shape, result_type(a, b), directory)
+    for sl in get_slabs(out):
+        out[sl] = a[sl] * b[sl]
+    return out
+
+def get_reflected_spectrum(voxel_ft, dims):
+    '''
+    Returns the spectrum of the real grid of 'dims' reflected as
+    voxel[::-1, ::-1, ::-1] from the spectrum 'voxel_ft' of the grid (the
+    half spectrum of a real-to-complex transform or the full one), or a
+    stack of them along the first axis
+    The reflection is the complex conjugate shifted by one voxel
+    '''
+    phase = ones(1, dtype = 'F')
+    for axis, n in enumerate(dims):
+        k = arange(voxel_ft.shape[axis - 3])
+        shape = [1, 1, 1]
+        shape[axis] = len(k)
+        phase = phase * exp(2j * pi * k / n).astype('F').reshape(shape)
+    return conj(voxel_ft) * phase
+
+def is_smooth(n, primes = (2, 3, 5, 7)):
+    '''
+    Returns True if 'n' has no prime factors other than 'primes'
+    '''
+    for p in primes:
+        while n % p == 0:
+            n //= p
+    return n == 1
+
+def get_padded_dims(sza, szb):
+    '''
+    Returns the dims of the grid to convolve shapes of sizes 'sza' and 'szb'
+    in, chosen per axis as the smallest even 2/3/5/7-smooth size (fast for
+    FFTW) that holds the full linear convolution without wrap-around
+    Odd sizes are skipped since fftshift in 'normalize' centers the result
+    consistently only for even sizes. The convolution is also checked to
+    stay inside the grid once pad_voxel and normalize have centered it
+    '''
+    dims = []
+    for a, b in zip(sza, szb):
+        a, b = int(a), int(b)
+        n = a + b - 1
+        while True:
+            n += n % 2
+            # first index of the centered convolution, see 'normalize'
+            start = ((n - a)//2 + (n - b)//2 + n//2) % n
+            if is_smooth(n) and start + a + b - 2 <= n - 1:
+                break
+            n += 2
+        dims.append(n)
+    return dims
@@ -0,0 +1,204 @@
+#    MAD Lab, University at Buffalo
+#    Copyright (C) 2018  Prakhar Jaiswal <prakharj@buffalo.edu>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from shape import Shape, get_reflected_spectrum
+
+class SpectrumCache:
+    '''
+    The SpectrumCache class keeps the Fourier transforms of tool shapes (beta)
+    so that the same tool applied to many parts is transformed only once
+    Spectra are keyed by the tool file hash, resolution, scale, voxelizer,
+    padded dims, transform type, reflection and the tile size of the
+    blocked engine (see 'transform'), and evicted in least
+    recently used order once their total size exceeds the memory budget
+    If a directory is set, spectra are also saved there as .npy files and
+    loaded back memory-mapped, so a fresh process does not redo the FFT
+    A lock serializes the threads of a process using the cache
+    '''
+
+    def __init__(self, budget = 1 << 30, directory = None):
+        '''
+        'budget' is the memory budget in bytes, 'directory' an optional
+        directory to persist the spectra in
+        '''
+        self.budget = budget
+        self.directory = directory
+        self.spectra = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+
+    def set_budget(self, budget):
+        with self.lock:
+            self.budget = budget
+            self.evict()
+
+    def set_directory(self, directory):
+        self.directory = directory
+
+    def get_key(self, shape, real = True, reflect = False, tile = None):
+        '''
+        Returns the cache key of the spectrum of 'shape', or None if the shape
+        was not read from a file and hence cannot be identified
+        The voxelizer is part of the key, as in the voxel cache
+        '''
+        if len(shape.get_filename()) == 0:
+            return None
+        dims = tuple(int(dim) for dim in shape.get_voxel_shape())
+        key = (shape.get_filehash(), int(shape.get_resolution()),
+                float(shape.get_scale()), shape.get_voxelizer(), dims,
+                bool(real), bool(reflect))
+        if tile is not None:
+            key += (tuple(int(m) for m in tile),)
+        return key
+
+    def has_spectrum(self, shape, real = True, reflect = False, tile = None):
+        '''
+        Returns True if the spectrum of 'shape' is in memory
+        '''
+        with self.lock:
+            return self.get_key(shape, real, reflect, tile) in self.spectra
+
+    def get_spectrum(self, shape, real = True, reflect = False, tile = None):
+        '''
+        Returns the Fourier transform of the voxel data of 'shape' (reflected
+        through the origin if 'reflect' is set), from the cache if possible
+        With 'tile' set, it is the transform of the voxels cropped to their
+        bounding box at the FFT size 'tile' (see 'transform')
+        The returned array must not be modified
+        '''
+        with self.lock:
+            key = self.get_key(shape, real, reflect, tile)
+            if key is not None and key in self.spectra:
+                self.hits += 1
+                spectrum = self.spectra.pop(key)
+                self.spectra[key] = spectrum
+                return spectrum
+        
+            self.misses += 1
+            spectrum = None
+            if key is not None:
+                spectrum = self.load(key)
+            if spectrum is None:
+                spectrum = self.transform(shape, real, reflect, tile)
+                if key is not None:
+                    spectrum = self.save(key, spectrum)
+            if key is not None:
+                self.insert(key, spectrum)
+            return spectrum
+
+    def transform(self, shape, real = True, reflect = False, tile = None):
+        '''
+        Computes the Fourier transform of the voxel data of 'shape'
+        The reflected spectrum is derived from the one of 'shape', which
+        the shape keeps (see Shape.fourier_transform), so a tool convolved
+        both ways is transformed only once
+        With 'tile' set, the set voxels are cropped to their bounding box
+        and placed in the corner of a grid of 'tile', the kernel of the
+        tiles of the blocked engine (see morphology.get_blocked_tiles)
+        '''
+        if tile is not None:
+            voxel = shape.get_voxel() > 0.5
+            if reflect:
+                voxel = voxel[::-1, ::-1, ::-1]
+            coords = np.argwhere(voxel)
+            kernel = np.zeros(tile, dtype = np.float32)
+            if len(coords) > 0:
+                lo = coords.min(0)
+                hi = coords.max(0) + 1
+                kernel[tuple(slice(0, h - l) for l, h in zip(lo, hi))] = \
+                            voxel[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]]
+            shape = Shape()
+            shape.set_voxel(kernel)
+            shape.fourier_transform(real)
+            return shape.get_voxel_ft()
+        shape.fourier_transform(real)
+        if reflect:
+            return get_reflected_spectrum(shape.get_voxel_ft(),
+                                                    shape.get_voxel_shape())
+        return shape.get_voxel_ft()
+
+    def insert(self, key, spectrum):
+        '''
+        Adds a spectrum to the cache and evicts the least recently used
+        spectra if the memory budget is exceeded
+        '''
+        self.spectra[key] = spectrum
+        self.nbytes += spectrum.nbytes
+        self.evict()
+
+    def evict(self):
+        '''
+        Drops the least recently used spectra until the cache fits in the
+        memory budget (the most recent spectrum is always kept)
+        '''
+        while self.nbytes > self.budget and len(self.spectra) > 1:
+            key, spectrum = self.spectra.popitem(last = False)
+            self.nbytes -= spectrum.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.spectra.clear()
+            self.nbytes = 0
+
+    def get_path(self, key):
+        '''
+        Returns the file in 'directory' that the spectrum of 'key' is saved to
+        '''
+        name = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + '.npy')
+
+    def load(self, key):
+        '''
+        Loads the spectrum of 'key' memory-mapped from 'directory'
+        Returns None if it has not been saved
+        '''
+        if self.directory is None:
+            return None
+        path = self.get_path(key)
+        if not os.path.isfile(path):
+            return None
+        return np.load(path, mmap_mode = 'r')
+
+    def save(self, key, spectrum):
+        '''
+        Saves the spectrum of 'key' to 'directory' and returns it memory-mapped
+        The file is written under a temporary name and renamed, so concurrent
+        processes never see a partially written spectrum
+        '''
+        if self.directory is None:
+            return spectrum
+        try:
+            os.makedirs(self.directory)
+        except OSError:
+            if not os.path.isdir(self.directory):
+                raise
+        fd, tmp = tempfile.mkstemp(suffix = '.npy', dir = self.directory)
+        with os.fdopen(fd, 'wb') as fid:
+            np.save(fid, spectrum)
+        os.rename(tmp, self.get_path(key))
+        return np.load(self.get_path(key), mmap_mode = 'r')
+
+# spectra of the tool shapes shared by all computations in this process
+tool_spectra = SpectrumCache()
@@ -0,0 +1,176 @@
+#    MAD Lab, University at Buffalo
+#    Copyright (C) 2018  Prakhar Jaiswal <prakharj@buffalo.edu>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Orientation sweep for manufacturability.
+
+Computes the as-manufactured and non-manufacturable volume of a part (alpha)
+machined by a tool (beta) for every orientation of the part in a set of
+Euler angle samples (e.g. 'oim20.eul'), and ranks the orientations by their
+non-manufacturable volume.
+
+Rotating the part by R and keeping the tool fixed is the same as keeping the
+part fixed and rotating the tool by R^-1, so the part is padded and
+transformed once and only the (small) tool is rotated per orientation. The
+orientations are distributed over a process pool; the part's spectrum is
+written to a temporary file once and memory-mapped by every worker. Each
+orientation runs morphology.get_as_manufactured with the 'fft' engine,
+which transforms the rotated tool once and derives the spectrum of the
+reflected tool the erosion needs from it (see spectrum_cache.py).
+
+Usage: python sweep.py part.obj tool.obj [options], see 'python sweep.py -h'
+"""
+
+import os
+import shutil
+import tempfile
+import argparse
+import multiprocessing
+import numpy as np
+
+from shape import Shape, get_padded_dims
+from morphology import get_as_manufactured
+from rotation import read_rotation_samples, get_rot_mat, Rotator
+
+# fields of the table returned by 'sweep'
+TABLE_DTYPE = [('index', int), ('phi', 'd'), ('theta', 'd'), ('psi', 'd'),
+                    ('as_man', int), ('non_man', int)]
+
+_worker = {}
+
+def _init_worker(path, tool, dims, rot_mats):
+    '''
+    Loads the part (padded to 'dims') as its spectrum and packed voxels
+    memory-mapped in a worker process and sets up the rotation of the tool
+    '''
+    part = Shape()
+    part.set_packed(True)
+    part.set_bits(np.load(os.path.join(path, 'alpha_bits.npy'),
+                                        mmap_mode = 'r'), dims)
+    part.set_voxel_ft(np.load(os.path.join(path, 'alpha_ft.npy'),
+                                        mmap_mode = 'r'), dims)
+    _worker['part'] = part
+    _worker['rotator'] = Rotator(tool)
+    _worker['rot_mats'] = rot_mats
+
+def _sweep_orientation(index):
+    '''
+    Returns (index, as_man volume, non_man volume) for orientation 'index'
+    '''
+    part = _worker['part']
+    # rotating the tool by the inverse of the part's orientation
+    rot_mat = _worker['rot_mats'][index].T
+    beta = Shape()
+    beta.set_voxel(_worker['rotator'].rotate_voxel(rot_mat))
+    beta.pad_voxel(np.array(part.get_voxel_shape()))
+    if beta.get_volume() == 0:
+        return index, 0, part.get_volume()
+    as_man, non_man = get_as_manufactured(part, beta, 'fft')
+    return index, as_man.get_volume(), non_man.get_volume()
+
+def sweep(alpha, beta, samples, indices = None, nworkers = None):
+    '''
+    Computes the as manufactured and non-manufacturable volume of part
+    'alpha' machined by tool 'beta' (Shapes with unpadded voxel data) for
+    the orientations 'samples' (N x 3 Euler angles), or only for those in
+    'indices', using 'nworkers' processes (all cores if None)
+    Output: table (numpy record array with fields 'index', 'phi', 'theta',
+    'psi', 'as_man' and 'non_man') sorted by increasing non_man volume
+    '''
+    samples = np.asarray(samples, dtype = 'd')
+    if indices is None:
+        indices = range(len(samples))
+    if nworkers is None:
+        nworkers = multiprocessing.cpu_count()
+
+    # the tool is rotated about its centroid into a cube that holds it in
+    # any orientation
+    tool = beta.get_voxel()
+    szb = Rotator(tool).get_dims()
+
+    # padding and transforming the part once
+    part = Shape()
+    part.set_voxel(alpha.get_voxel())
+    part.pad_voxel(get_padded_dims(part.get_voxel_shape(), szb))
+    part.fourier_transform()
+
+    path = tempfile.mkdtemp()
+    try:
+        np.save(os.path.join(path, 'alpha_ft.npy'), part.get_voxel_ft())
+        np.save(os.path.join(path, 'alpha_bits.npy'), part.get_bits())
+        dims = part.get_voxel_shape()
+        del part
+        initargs = (path, tool, dims, get_rot_mat(samples))
+        if nworkers == 1:
+            _init_worker(*initargs)
+            results = [_sweep_orientation(index) for index in indices]
+        else:
+            pool = multiprocessing.Pool(nworkers, _init_worker, initargs)
+            try:
+                results = pool.map(_sweep_orientation, indices, chunksize = 4)
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        _worker.clear()
+        shutil.rmtree(path, ignore_errors = True)
+
+    table = np.zeros(len(results), dtype = TABLE_DTYPE)
+    for row, (index, as_man, non_man) in zip(table, results):
+        row['index'] = index
+        row['phi'], row['theta'], row['psi'] = samples[index]
+        row['as_man'] = as_man
+        row['non_man'] = non_man
+    return table[np.argsort(table['non_man'], kind = 'mergesort')]
+
+def write_table(table, filename):
+    '''
+    Writes the sweep table as whitespace separated text
+    '''
+    np.savetxt(filename, table, fmt = '%d %.6f %.6f %.6f %d %d',
+                header = ' '.join(name for name, dtype in TABLE_DTYPE))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description =
+                'Ranks part orientations by non-manufacturable volume')
+    parser.add_argument('part', help = 'triangulated part file (A)')
+    parser.add_argument('tool', help = 'triangulated tool file (B)')
+    parser.add_argument('--samples', default = 'oim20.eul',
+                        help = 'Euler angle samples (default: oim20.eul)')
+    parser.add_argument('--indices', type = int, nargs = '*',
+                        help = 'sweep only these orientations')
+    parser.add_argument('--resA', type = int, default = 64)
+    parser.add_argument('--resB', type = int, default = 64)
+    parser.add_argument('--scaleA', type = float, default = 1)
+    parser.add_argument('--scaleB', type = float, default = 0.3)
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--output', default = 'sweep.txt')
+    args = parser.parse_args()
+
+    alpha = Shape()
+    alpha.set_filename(args.part)
+    alpha.set_resolution(args.resA)
+    alpha.set_scale(args.scaleA)
+    alpha.read_voxel()
+    beta = Shape()
+    beta.set_filename(args.tool)
+    beta.set_resolution(args.resB)
+    beta.set_scale(args.scaleB)
+    beta.read_voxel()
+
+    table = sweep(alpha, beta, read_rotation_samples(args.samples),
+                                            args.indices, args.workers)
+    write_table(table, args.output)
@@ -0,0 +1,57 @@
+'''
+Synthetic parts and tools shared by the tests
+The tests run from the repository root, e.g. 'python -m unittest discover
+tests'
+'''
+
+import os
+import sys
+import numpy as np
+
+from scipy import ndimage
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                    '..'))
+
+from shape import Shape, get_padded_dims
+
+def get_blob(dims, seed, sigma = 2.0):
+    '''
+    Returns an irregular part of 'dims', half of its voxels set
+    '''
+    noise = ndimage.gaussian_filter(
+                        np.random.RandomState(seed).rand(*dims), sigma)
+    return (noise > np.median(noise)).astype(np.int64)
+
+def get_ball(radius2, n):
+    '''
+    Returns the digital ball of squared radius 'radius2' in a cube of 'n'
+    '''
+    coords = np.indices((n, n, n)) - n // 2
+    return (np.sum(coords ** 2, 0) <= radius2).astype(np.int64)
+
+def get_cylinder(radius2, n, length, axis):
+    '''
+    Returns the cylinder of 'length' voxels along 'axis' with the digital
+    disc of squared radius 'radius2' in a square of 'n' as section
+    '''
+    coords = np.indices((n, n)) - n // 2
+    disc = np.sum(coords ** 2, 0) <= radius2
+    return np.repeat(np.expand_dims(disc, axis), length,
+                                                axis).astype(np.int64)
+
+def get_shape(voxel):
+    shape = Shape()
+    shape.set_voxel(voxel)
+    return shape
+
+def get_padded(part, tool):
+    '''
+    Returns Shapes of 'part' and 'tool' padded as by prepare_shapes
+    '''
+    alpha = get_shape(part)
+    beta = get_shape(tool)
+    dims = get_padded_dims(alpha.get_voxel_shape(), beta.get_voxel_shape())
+    alpha.pad_voxel(dims)
+    beta.pad_voxel(dims)
+    return alpha, beta
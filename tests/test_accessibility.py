@@ -0,0 +1,144 @@
+'''
+Tests of the accessibility analysis against a direct computation of the
+voxels the swept tool reaches
+'''
+
+import unittest
+import numpy as np
+
+from helpers import get_blob, get_ball, get_cylinder, get_shape
+
+from morphology import crop_voxels
+from accessibility import get_accessibility, get_swept_tool, \
+                        get_sweep_offsets, get_exit_length, parse_direction
+
+def get_pocketed_cube():
+    '''
+    Returns a cube with a pocket open to +z and a slot through along x
+    '''
+    part = np.zeros((40, 40, 40), dtype = np.int64)
+    part[4:36, 4:36, 4:36] = 1
+    part[14:26, 14:26, 20:36] = 0
+    part[4:36, 8:11, 8:11] = 0
+    return part
+
+def get_reached(part, tool, direction):
+    '''
+    Returns the voxels of the grid of 'part' the tool reaches from
+    'direction', by shifting the part once per voxel of the tool and once
+    per step of the sweep, and the positions reached once per voxel of the
+    tool
+    '''
+    part = part > 0
+    tool = crop_voxels(tool > 0)[1]
+    n = np.array(part.shape)
+    b = np.array(tool.shape)
+    length = get_exit_length(n, b, direction)
+    swept, corner = get_swept_tool(tool, direction, length)
+    s = np.array(swept.shape)
+    # the part with s - 1 free voxels on every side, position i of the
+    # swept tool's box starting at voxel i - (s - 1) of the part
+    grid = np.zeros(n + 2 * (s - 1), dtype = bool)
+    grid[tuple(slice(c - 1, c - 1 + a) for a, c in zip(n, s))] = part
+    overlap = np.zeros(n + 2 * (s - 1) - b + 1, dtype = bool)
+    for q in np.argwhere(tool):
+        overlap |= grid[tuple(slice(o, o + m)
+                                    for o, m in zip(q, overlap.shape))]
+    hit = np.zeros(n + s - 1, dtype = bool)
+    for o in get_sweep_offsets(direction, length) + corner:
+        hit |= overlap[tuple(slice(c, c + m) for c, m in zip(o, hit.shape))]
+    reached = np.zeros(part.shape, dtype = bool)
+    for q in np.argwhere(tool):
+        reached |= ~hit[tuple(slice(m - 1 - c - o, m - 1 - c - o + a)
+                            for o, c, a, m in zip(q, corner, n, s))]
+    return reached
+
+class AccessibilityTest(unittest.TestCase):
+
+    def check(self, part, tool, directions):
+        '''
+        Compares the results for each direction with the direct
+        computation, on the grid of the part
+        '''
+        table, union, common = get_accessibility(get_shape(part),
+                                    get_shape(tool), directions, batch = 2)
+        self.assertEqual(tuple(union.get_voxel_shape()), part.shape)
+        expected_union = np.zeros(part.shape, dtype = bool)
+        expected_common = ~expected_union
+        non_mans = []
+        for row, direction in zip(table, directions):
+            as_man = ~get_reached(part, tool, direction)
+            non_man = as_man & (part == 0)
+            self.assertEqual(row['as_man'], np.count_nonzero(as_man))
+            self.assertEqual(row['non_man'], np.count_nonzero(non_man))
+            expected_union |= non_man
+            expected_common &= non_man
+            non_mans.append(non_man)
+        self.assertTrue(np.array_equal(union.get_voxel() > 0.5,
+                                                        expected_union))
+        self.assertTrue(np.array_equal(common.get_voxel() > 0.5,
+                                                        expected_common))
+        return table, non_mans
+
+    def test_axes(self):
+        names = ('x', '-x', 'y', '-y', 'z', '-z')
+        part = get_pocketed_cube()
+        table, non_mans = self.check(part, np.ones((3, 3, 3), dtype = int),
+                                    [parse_direction(d) for d in names])
+        non_man = dict(zip(names, non_mans))
+        pocket = (slice(14, 26), slice(14, 26), slice(20, 36))
+        # the pocket open only on +z is cut from +z and not from -z
+        self.assertFalse(non_man['z'][pocket].any())
+        self.assertTrue(non_man['-z'][pocket].all())
+        self.assertTrue(non_man['x'][pocket].all())
+        # the slot through along x is cut from both ends, from x only
+        slot = (slice(4, 36), slice(8, 11), slice(8, 11))
+        self.assertFalse(non_man['x'][slot].any())
+        self.assertFalse(non_man['-x'][slot].any())
+        self.assertTrue(non_man['z'][slot].all())
+        self.assertTrue(non_man['y'][slot].all())
+        self.assertEqual(list(table['length']), [43] * 6)
+
+    def test_oblique(self):
+        directions = [parse_direction(d)
+                        for d in ('1,1,0', '1,2,3', '-0.3,0.1,1')]
+        part = get_blob((36, 30, 40), 1, 2.5)
+        self.check(part, get_ball(4, 5), directions)
+        self.check(get_pocketed_cube(), get_cylinder(4, 5, 7, 2),
+                                                            directions[1:])
+
+    def test_large_tool(self):
+        # a tool larger than the part is valid, it only cuts outside
+        part = np.zeros((20, 20, 20), dtype = np.int64)
+        part[2:18, 2:18, 2:18] = 1
+        part[7:13, 7:13, 10:18] = 0
+        table, non_mans = self.check(part, get_ball(121, 23),
+                            [parse_direction(d) for d in ('z', '-y')])
+        # the tool dips into the pocket from above, but not to its bottom
+        pocket = (slice(7, 13), slice(7, 13), slice(10, 16))
+        for non_man in non_mans:
+            self.assertTrue(non_man[pocket].all())
+
+    def test_sweep(self):
+        tool = get_ball(4, 5).astype(bool)
+        for text in ('x', '-y', '1,2,3', '-0.3,0.1,1'):
+            direction = parse_direction(text)
+            offsets = get_sweep_offsets(direction, 7)
+            # a connected digital segment from the origin
+            self.assertTrue(np.array_equal(offsets[0], [0, 0, 0]))
+            self.assertTrue(np.all(np.abs(np.diff(offsets, axis = 0)) <= 1))
+            swept, corner = get_swept_tool(tool, direction, 7)
+            self.assertTrue(np.array_equal(swept.shape, 5 +
+                                    offsets.max(0) - offsets.min(0)))
+            self.assertTrue(np.array_equal(corner, -offsets.min(0)))
+            self.assertTrue(swept[tuple(slice(c, c + 5)
+                                        for c in corner)][tool].all())
+        self.assertEqual(get_exit_length((40, 30, 20), (5, 5, 9),
+                                                parse_direction('-z')), 29)
+        self.assertEqual(get_exit_length((40, 30, 20), (5, 5, 9),
+                                                parse_direction('1,1,0')), 50)
+        self.assertRaises(ValueError, parse_direction, '0,0,0')
+        self.assertRaises(ValueError, parse_direction, '1,0')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+'''
+Tests of the slab-wise binvox reading and writing
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from io import BytesIO
+
+from helpers import get_blob, get_shape
+
+import binvox_rw
+from morphology import get_packed_shape
+
+def encode(voxels_flat):
+    '''
+    Returns the binvox data of 'voxels_flat' as the former per-voxel
+    encoder wrote it
+    '''
+    out = []
+    state = voxels_flat[0]
+    ctr = 0
+    for c in voxels_flat:
+        if c == state:
+            ctr += 1
+            if ctr == 255:
+                out += [state, ctr]
+                ctr = 0
+        else:
+            out += [state, ctr]
+            state = c
+            ctr = 1
+    if ctr > 0:
+        out += [state, ctr]
+    return np.array(out, dtype = np.uint8).tostring()
+
+def get_models():
+    '''
+    Yields voxel arrays with short runs, runs across x-layers, runs of
+    multiples of 255 voxels and empty and full models
+    '''
+    yield get_blob((13, 17, 11), 1, 1.0).astype(bool)
+    solid = np.zeros((9, 30, 17), dtype = bool)
+    solid[2:7] = True
+    yield solid
+    # one run of exactly 255 voxels, followed by another
+    voxel = np.zeros((4, 15, 17), dtype = bool)
+    voxel.reshape(-1)[:255] = True
+    yield voxel
+    yield np.zeros((5, 6, 7), dtype = bool)
+    yield np.ones((5, 6, 7), dtype = bool)
+
+def write(data, dims, axis_order = 'xyz'):
+    fp = BytesIO()
+    model = binvox_rw.Voxels(data, list(dims), [0.0, 0.0, 0.0], 1.0,
+                                                                axis_order)
+    binvox_rw.write(model, fp)
+    fp.seek(0)
+    return fp
+
+def get_binvox_dims(voxel):
+    # binvox dims are in x, z, y order for xyz data
+    return [voxel.shape[0], voxel.shape[2], voxel.shape[1]]
+
+class BinvoxTest(unittest.TestCase):
+
+    def test_encoding(self):
+        for voxel in get_models():
+            data = write(voxel, get_binvox_dims(voxel)).getvalue()
+            expected = encode(np.transpose(voxel, (0, 2, 1)).flatten())
+            self.assertEqual(data[data.index('data\n') + 5:], expected)
+
+    def test_round_trip(self):
+        for voxel in get_models():
+            dims = get_binvox_dims(voxel)
+            model = binvox_rw.read_as_3d_array(write(voxel, dims))
+            self.assertEqual(model.dims, dims)
+            self.assertTrue(np.array_equal(model.data, voxel))
+            # into a given array, in the file's own axis order
+            out = np.zeros(dims, dtype = bool)
+            model = binvox_rw.read_as_3d_array(write(voxel, dims), False, out)
+            self.assertTrue(model.data is out)
+            self.assertTrue(np.array_equal(out,
+                                        np.transpose(voxel, (0, 2, 1))))
+
+    def test_slabs(self):
+        for voxel in get_models():
+            dims = get_binvox_dims(voxel)
+            data = write(voxel, dims).getvalue()
+            for slab_size in (1, dims[1] * dims[2] + 1, 100):
+                model = binvox_rw.read_as_slabs(BytesIO(data),
+                                                    slab_size = slab_size)
+                # writing the slabs while they are read
+                out = write(model.data, dims).getvalue()
+                self.assertEqual(out, data)
+            slabs = list(binvox_rw.read_as_slabs(BytesIO(data),
+                                                    slab_size = 1).data)
+            self.assertEqual(len(slabs), voxel.shape[0])
+            self.assertTrue(np.array_equal(np.concatenate(slabs), voxel))
+
+    def test_runs_in_chunks(self):
+        # runs split across the chunks of the file
+        voxel = get_blob((13, 17, 11), 2, 1.0).astype(bool)
+        fp = write(voxel, get_binvox_dims(voxel))
+        binvox_rw.read_header(fp)
+        start = fp.tell()
+        runs = list(binvox_rw.iter_runs(fp))
+        fp.seek(start)
+        for chunk_bytes in (1, 3, 8):
+            chunks = list(binvox_rw.iter_runs(fp, chunk_bytes))
+            fp.seek(start)
+            for index in (0, 1):
+                self.assertTrue(np.array_equal(
+                        np.concatenate([c[index] for c in chunks]),
+                        np.concatenate([r[index] for r in runs])))
+
+    def test_other_readers(self):
+        for voxel in get_models():
+            dims = get_binvox_dims(voxel)
+            data = write(voxel, dims).getvalue()
+            model = binvox_rw.read_as_block_array(BytesIO(data), 4)
+            self.assertTrue(np.array_equal(model.data.to_dense(), voxel))
+            # block-sparse data is written as dense data
+            self.assertEqual(write(model.data, dims).getvalue(), data)
+
+    def test_coords(self):
+        # the coordinates are only right for cubic models
+        voxel = get_blob((15, 15, 15), 4, 1.0).astype(bool)
+        data = write(voxel, voxel.shape).getvalue()
+        model = binvox_rw.read_as_coord_array(BytesIO(data))
+        self.assertTrue(np.array_equal(binvox_rw.sparse_to_dense(
+                                    model.data, voxel.shape), voxel))
+
+    def test_shape(self):
+        directory = tempfile.mkdtemp()
+        try:
+            voxel = get_blob((19, 14, 16), 3, 1.5)
+            filename = os.path.join(directory, 'voxel.binvox')
+            shape = get_shape(voxel)
+            shape.write_voxel(filename)
+            with open(filename, 'rb') as fp:
+                model = binvox_rw.read_as_3d_array(fp)
+            self.assertTrue(np.array_equal(model.data, voxel > 0))
+            # from bit-packed data
+            get_packed_shape(shape.get_bits(),
+                                    voxel.shape).write_voxel(filename)
+            with open(filename, 'rb') as fp:
+                self.assertTrue(np.array_equal(
+                        binvox_rw.read_as_3d_array(fp).data, voxel > 0))
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    unittest.main()
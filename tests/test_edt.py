@@ -0,0 +1,61 @@
+'''
+Tests of the edt engine against the spatial engine
+'''
+
+import unittest
+import numpy as np
+
+from helpers import get_blob, get_ball, get_cylinder, get_padded
+
+import morphology
+from morphology import get_minkowski_sum_and_diff, get_as_manufactured, \
+                        choose_engine, crop_voxels, get_edt_model
+
+class EdtTest(unittest.TestCase):
+
+    def check(self, part, tool):
+        alpha, beta = get_padded(part, tool)
+        self.assertIsNotNone(get_edt_model(
+                                crop_voxels(beta.get_voxel() > 0.5)[1]))
+        results = []
+        for engine in ('spatial', 'edt'):
+            msum, mdiff = get_minkowski_sum_and_diff(alpha, beta, engine)
+            as_man, non_man = get_as_manufactured(alpha, beta, engine)
+            results.append([shape.get_bits()
+                                for shape in (msum, mdiff, as_man, non_man)])
+        for spatial, edt in zip(*results):
+            self.assertTrue(np.array_equal(spatial, edt))
+
+    def test_small_balls(self):
+        part = get_blob((30, 27, 33), 1, 2.5)
+        for radius2, n in ((0, 1), (1, 3), (2, 3), (3, 3), (8, 5)):
+            self.check(part, get_ball(radius2, n))
+
+    def test_large_balls(self):
+        # up to the largest ball the levels are exact for
+        part = get_blob((48, 44, 40), 2, 4)
+        for radius2, n in ((49, 15), (100, 21), (110, 21)):
+            self.check(part, get_ball(radius2, n))
+
+    def test_cylinders(self):
+        part = get_blob((36, 40, 32), 3, 3)
+        for axis in range(3):
+            for length in (1, 2, 5):
+                self.check(part, get_cylinder(5, 5, length, axis))
+        self.check(part, get_cylinder(64, 17, 18, 2))
+
+    def test_too_large_tools(self):
+        # the levels of larger tools threshold counts edt does not have
+        part = get_blob((40, 40, 40), 4, 4)
+        for tool in (get_ball(121, 23), get_cylinder(100, 21, 20, 0)):
+            self.assertGreater(np.count_nonzero(tool), 5000)
+            self.assertIsNone(get_edt_model(tool.astype(bool)))
+            alpha, beta = get_padded(part, tool)
+            self.assertRaises(ValueError, get_minkowski_sum_and_diff,
+                                                        alpha, beta, 'edt')
+            costs, ntransforms = morphology.get_engine_costs(alpha, beta)
+            self.assertNotIn('edt', [engine for cost, engine in costs])
+            self.assertNotEqual(choose_engine(alpha, beta, 'test'), 'edt')
+
+if __name__ == '__main__':
+    unittest.main()
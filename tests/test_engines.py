@@ -0,0 +1,116 @@
+'''
+Tests that the convolution engines give identical results
+'''
+
+import os
+import unittest
+import numpy as np
+
+from helpers import get_blob, get_ball, get_cylinder, get_padded
+
+from morphology import ENGINES, get_minkowski_sum_and_diff, \
+                        get_minkowski_sum, get_minkowski_diff, \
+                        get_as_manufactured, choose_engine, crop_voxels, \
+                        get_edt_model, get_levels, get_spatial_corr, \
+                        get_blocked_sets
+from spectrum_cache import tool_spectra
+
+MESH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                                                    'data', 'testpart1.obj')
+
+def get_engines(beta):
+    '''
+    Returns the engines that apply to the tool 'beta'
+    '''
+    tool = crop_voxels(beta.get_voxel() > 0.5)[1]
+    if get_edt_model(tool) is None:
+        return [engine for engine in ENGINES if engine != 'edt']
+    return list(ENGINES)
+
+class EnginesTest(unittest.TestCase):
+
+    def check(self, part, tool):
+        alpha, beta = get_padded(part, tool)
+        results = {}
+        for engine in get_engines(beta):
+            msum, mdiff = get_minkowski_sum_and_diff(alpha, beta, engine)
+            as_man, non_man = get_as_manufactured(alpha, beta, engine)
+            results[engine] = [shape.get_bits()
+                                for shape in (msum, mdiff, as_man, non_man)]
+        for engine, bits in results.items():
+            for name, expected, actual in zip(('sum', 'diff', 'as_man',
+                            'non_man'), results['spatial'], bits):
+                self.assertTrue(np.array_equal(expected, actual),
+                                        '%s of %s engine' % (name, engine))
+        return results['spatial']
+
+    def test_irregular_tool(self):
+        part = get_blob((30, 26, 34), 1, 2.5)
+        tool = get_blob((7, 9, 5), 2, 1.0)
+        self.check(part, tool)
+
+    def test_off_center_tool(self):
+        # the tool in a corner of its grid, as read from a mesh off-center
+        part = get_blob((28, 32, 30), 3, 2.5)
+        tool = np.zeros((16, 12, 14), dtype = np.int64)
+        tool[9:14, 1:6, 2:9] = get_cylinder(4, 5, 7, 2)
+        self.check(part, tool)
+        tool = np.zeros((15, 15, 15), dtype = np.int64)
+        tool[:7, 8:, 3:10] = get_blob((7, 7, 7), 4, 1.0)
+        self.check(part, tool)
+
+    def test_large_tool(self):
+        # beyond the tool volume (about 10000 voxels) where the sum level
+        # leaves out counts of one voxel
+        part = get_blob((30, 28, 26), 5, 4)
+        tool = get_ball(196, 29)
+        self.assertGreater(np.count_nonzero(tool), 10000)
+        msum, mdiff, as_man, non_man = self.check(part, tool)
+        self.assertTrue(np.any(msum))
+
+    def test_single_operations(self):
+        # the operations on their own give the combined results
+        alpha, beta = get_padded(get_blob((24, 24, 24), 6), get_ball(4, 5))
+        for engine in get_engines(beta):
+            msum, mdiff = get_minkowski_sum_and_diff(alpha, beta, engine)
+            self.assertTrue(np.array_equal(msum.get_bits(),
+                        get_minkowski_sum(alpha, beta, engine).get_bits()))
+            self.assertTrue(np.array_equal(mdiff.get_bits(),
+                        get_minkowski_diff(alpha, beta, engine).get_bits()))
+
+    def test_blocked_tiles(self):
+        # many tiles, thresholded straight into the outputs, the tool's
+        # kernel spectra taken from the cache
+        alpha, beta = get_padded(get_blob((30, 26, 34), 8, 2.5),
+                                                get_blob((7, 9, 5), 2, 1.0))
+        beta.set_filename(MESH)
+        self.addCleanup(tool_spectra.clear)
+        levels = get_levels(beta)
+        tile = (16, 18, 16)
+        for reflect in (False, True):
+            corr = get_spatial_corr(alpha, beta, reflect)
+            for offsets in ((0, 0, 0), (1, 1, 1)):
+                for packed in (False, True):
+                    expected = corr.get_sublevel_sets(levels, False, packed,
+                                                                    offsets)
+                    actual = get_blocked_sets(alpha, beta, levels, reflect,
+                                                    packed, offsets, tile)
+                    for e, a in zip(expected, actual):
+                        self.assertTrue(np.array_equal(e, a))
+            self.assertTrue(tool_spectra.has_spectrum(beta, True, reflect,
+                                                                    tile))
+        actual = get_blocked_sets(alpha, beta, levels, True, True,
+                                            (1, 1, 1), tile, nworkers = 2)
+        for e, a in zip(expected, actual):
+            self.assertTrue(np.array_equal(e, a))
+
+    def test_choose_engine(self):
+        alpha, beta = get_padded(get_blob((20, 20, 20), 7), get_ball(2, 3))
+        self.assertIn(choose_engine(alpha, beta, 'test'), ENGINES)
+        self.assertEqual(choose_engine(alpha, beta, 'test', 1, 'blocked'),
+                                                                'blocked')
+        self.assertRaises(ValueError, choose_engine, alpha, beta, 'test', 1,
+                                                                'unknown')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+'''
+Tests of the coarse-to-fine as manufactured model against the full grid
+'''
+
+import unittest
+import numpy as np
+
+from helpers import get_blob, get_ball, get_padded
+
+import multires
+from morphology import get_as_manufactured
+from multires import get_as_manufactured_multires
+
+class MultiresTest(unittest.TestCase):
+
+    def setUp(self):
+        # making the full grid look expensive, so that the windows are
+        # refined however small the problem
+        self.get_engine_costs = multires.get_engine_costs
+        multires.get_engine_costs = lambda alpha, beta, nconv: \
+                                    ([(1e40, 'fft'), (1e40, 'spatial')], 6)
+
+    def tearDown(self):
+        multires.get_engine_costs = self.get_engine_costs
+
+    def check(self, part, tool, block = multires.BLOCK, engine = None):
+        alpha, beta = get_padded(part, tool)
+        as_man, non_man = get_as_manufactured(alpha, beta, engine)
+        stats = {}
+        multi_as_man, multi_non_man = get_as_manufactured_multires(alpha,
+                                    beta, engine, block, stats = stats)
+        self.assertGreater(stats['windows'], 0)
+        self.assertTrue(np.array_equal(as_man.get_bits(),
+                                                multi_as_man.get_bits()))
+        self.assertTrue(np.array_equal(non_man.get_bits(),
+                                                multi_non_man.get_bits()))
+        return stats
+
+    def test_blob(self):
+        part = get_blob((40, 37, 45), 1)
+        self.check(part, get_ball(9, 7))
+        # blocks not dividing the grid
+        self.check(part, get_ball(9, 7), 5)
+        self.check(part, get_ball(4, 5), 3, 'spatial')
+
+    def test_irregular_tool(self):
+        tool = np.ones((3, 5, 2), dtype = np.int64)
+        tool[0, 0, 0] = 0
+        self.check(get_blob((36, 32, 30), 2), tool, 8)
+
+    def test_solid_part(self):
+        # large certain blocks inside and outside, a pocket and a slot
+        part = np.zeros((60, 56, 50), dtype = np.int64)
+        part[5:55, 8:50, 10:45] = 1
+        part[20:30, 20:30, 20:48] = 0
+        part[15:18, 15:40, 15:18] = 0
+        stats = self.check(part, get_ball(16, 9), 4)
+        self.assertGreater(stats['certain_in'], 0)
+        self.assertGreater(stats['certain_out'], 0)
+        # a tool of more than 5000 voxels
+        tool = np.ones((19, 20, 18), dtype = np.int64)
+        tool[0] = 0
+        self.check(part, tool, 8)
+
+    def test_verify(self):
+        alpha, beta = get_padded(get_blob((30, 30, 30), 3), get_ball(4, 5))
+        stats = {}
+        get_as_manufactured_multires(alpha, beta, verify = True,
+                                                        stats = stats)
+        self.assertTrue(stats['match'])
+
+if __name__ == '__main__':
+    unittest.main()
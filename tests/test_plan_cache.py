@@ -0,0 +1,48 @@
+'''
+Tests of the FFTW plan cache
+'''
+
+import unittest
+import numpy as np
+
+# setting the path to the modules
+import helpers
+from plan_cache import PlanCache
+
+class PlanCacheTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        cache = PlanCache(wisdom = None)
+        voxel = np.random.RandomState(0).rand(12, 10, 8).astype('f')
+        for real in (True, False):
+            out = np.zeros((12, 10, 5) if real else voxel.shape, dtype = 'F')
+            self.assertTrue(cache.forward(voxel, real, out) is out)
+            back = cache.backward(out, voxel.shape if real else None)
+            self.assertTrue(np.allclose(back.real / voxel.size, voxel,
+                                                        atol = 1e-5))
+
+    def test_shared_arrays(self):
+        cache = PlanCache(wisdom = None)
+        plan, inarray, outarray = cache.get_plan((8, 8, 8), 'forward')
+        plan, spectrum, space = cache.get_plan((8, 8, 8), 'backward')
+        self.assertTrue(inarray is space and outarray is spectrum)
+        self.assertEqual(cache.nbytes, 8**3 * 4 + 8 * 8 * 5 * 8)
+
+    def test_budget(self):
+        cache = PlanCache(wisdom = None, budget = 20000)
+        kept = []
+        for n in (8, 12, 16, 8, 24):
+            voxel = np.random.RandomState(n).rand(n, n, n).astype('f')
+            back = cache.backward(cache.forward(voxel), voxel.shape)
+            self.assertTrue(np.allclose(back / voxel.size, voxel,
+                                                        atol = 1e-5))
+            self.assertLessEqual(cache.nbytes, cache.budget)
+            self.assertEqual(cache.nbytes, sum(array.nbytes for entry in
+                        cache.plans.values() for array in entry['arrays']))
+            kept.append(sorted(key[0][0] for key in cache.plans))
+        # grids beyond the budget on their own are not kept, even the latest
+        # one, and do not push out the others
+        self.assertEqual(kept, [[8], [8, 12], [8, 12], [8, 12], [8, 12]])
+
+if __name__ == '__main__':
+    unittest.main()
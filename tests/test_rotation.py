@@ -0,0 +1,138 @@
+'''
+Tests of the vectorized rotations against the per-point rotation of the
+notebook
+'''
+
+import unittest
+import numpy as np
+
+from scipy.ndimage import map_coordinates
+
+from helpers import get_blob
+
+from rotation import get_rot_mat, rotate, rotate_voxel, Rotator
+
+def get_old_rot_mat(angles):
+    '''
+    The rotation matrix of one set of Euler angles, as in the notebook
+    '''
+    phi, theta, psi = angles
+    cphi = np.cos(phi)
+    sphi = np.sin(phi)
+    ctheta = np.cos(theta)
+    stheta = np.sin(theta)
+    cpsi = np.cos(psi)
+    spsi = np.sin(psi)
+    rot = np.zeros([3, 3])
+    rot[0, :] = [cpsi*cphi-spsi*ctheta*sphi, -cpsi*sphi-spsi*ctheta*cphi,
+                                                                spsi*stheta]
+    rot[1, :] = [spsi*cphi+cpsi*ctheta*sphi, -spsi*sphi+cpsi*ctheta*cphi,
+                                                                -cpsi*stheta]
+    rot[2, :] = [stheta*sphi, stheta*cphi, ctheta]
+    return np.matrix(rot)
+
+def old_rotate(pts, rot_mat):
+    '''
+    Rotates the points one at a time, as in the notebook
+    '''
+    if pts.ndim == 1:
+        return np.squeeze(np.asarray(np.dot(rot_mat, pts)))
+    return np.array([np.squeeze(np.asarray(np.dot(rot_mat, point)))
+                                                        for point in pts])
+
+def get_angles(n, seed):
+    '''
+    Returns 'n' random Euler angles
+    '''
+    return np.random.RandomState(seed).uniform(-np.pi, np.pi, (n, 3))
+
+class RotationTest(unittest.TestCase):
+
+    def test_rot_mat(self):
+        angles = get_angles(20, 0)
+        rot_mats = get_rot_mat(angles)
+        self.assertEqual(rot_mats.shape, (20, 3, 3))
+        for angle, rot_mat in zip(angles, rot_mats):
+            self.assertTrue(np.allclose(rot_mat, get_old_rot_mat(angle)))
+            self.assertTrue(np.allclose(get_rot_mat(angle), rot_mat))
+            self.assertTrue(np.allclose(np.dot(rot_mat, rot_mat.T),
+                                                                np.eye(3)))
+            self.assertAlmostEqual(np.linalg.det(rot_mat), 1)
+
+    def test_rotate(self):
+        pts = np.random.RandomState(1).uniform(-10, 10, (50, 3))
+        center = np.array([1.5, -2, 0.25])
+        angles = get_angles(8, 2)
+        rot_mats = get_rot_mat(angles)
+        # all rotations at once
+        batch = rotate(pts, rot_mats)
+        self.assertEqual(batch.shape, (8, 50, 3))
+        for angle, rotated in zip(angles, batch):
+            old_mat = get_old_rot_mat(angle)
+            expected = old_rotate(pts, old_mat)
+            self.assertTrue(np.allclose(rotate(pts, old_mat.A), expected))
+            self.assertTrue(np.allclose(rotated, expected))
+            self.assertTrue(np.allclose(rotate(pts[7], old_mat.A),
+                                            old_rotate(pts[7], old_mat)))
+            self.assertTrue(np.allclose(rotate(pts, old_mat.A, center),
+                                old_rotate(pts - center, old_mat) + center))
+
+    def test_rotate_voxel(self):
+        voxel = get_blob((9, 7, 8), 3, 1.0)
+        rotator = Rotator(voxel)
+        dims = rotator.get_dims()
+        center = rotator.center
+        out_center = np.floor((np.array(dims) - 1) / 2.0) + \
+                                                (center - np.floor(center))
+        points = np.indices(dims).reshape(3, -1).T
+        rot_mats = get_rot_mat(get_angles(4, 4))
+        for rot_mat, rotated in zip(rot_mats,
+                                        rotator.rotate_voxels(rot_mats)):
+            # every output voxel mapped back by the inverse rotation one at
+            # a time and interpolated there, zero outside the grid
+            src = old_rotate(points - out_center,
+                                np.matrix(rot_mat).T) + center
+            values = map_coordinates(np.pad(voxel.astype('f'), 1,
+                                    'constant'), src.T + 1, order = 1)
+            expected = (values > 0.5).reshape(dims)
+            actual = rotator.rotate_voxel(rot_mat)
+            # voxels right at the threshold may round either way
+            self.assertLessEqual(np.count_nonzero(actual != expected), 2)
+            self.assertTrue(np.array_equal(rotated, actual))
+            self.assertTrue(np.array_equal(rotate_voxel(voxel, rot_mat),
+                                                                    actual))
+
+    def test_quarter_turn(self):
+        # a quarter turn about z moves every voxel onto a voxel
+        voxel = get_blob((9, 7, 8), 5, 1.0)
+        rotator = Rotator(voxel)
+        rot_mat = get_rot_mat([np.pi / 2, 0, 0])
+        center = rotator.center
+        out_center = np.floor((np.array(rotator.get_dims()) - 1) / 2.0) + \
+                                                (center - np.floor(center))
+        moved = np.rint(rotate(np.argwhere(voxel), rot_mat, center) -
+                                        center + out_center).astype(int)
+        expected = np.zeros(rotator.get_dims(), dtype = bool)
+        expected[tuple(moved.T)] = True
+        self.assertTrue(np.array_equal(rotator.rotate_voxel(rot_mat),
+                                                                expected))
+
+    def test_identity(self):
+        voxel = get_blob((9, 7, 8), 6, 1.0).astype(bool)
+        # about the grid center into a grid of the same dims
+        center = (np.array(voxel.shape) - 1) / 2.0
+        self.assertTrue(np.array_equal(rotate_voxel(voxel, np.eye(3),
+                                        voxel.shape, center), voxel))
+        # about the centroid into a larger grid, only moved
+        rotator = Rotator(voxel)
+        for rotated in (rotator.rotate_voxel(np.eye(3)),
+                            rotator.rotate_voxels([np.eye(3)])[0]):
+            coords = np.argwhere(rotated)
+            offset = coords.min(0) - np.argwhere(voxel).min(0)
+            self.assertTrue(np.array_equal(coords - offset,
+                                                    np.argwhere(voxel)))
+        pts = np.random.RandomState(7).rand(10, 3)
+        self.assertTrue(np.array_equal(rotate(pts, np.eye(3)), pts))
+
+if __name__ == '__main__':
+    unittest.main()
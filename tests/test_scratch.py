@@ -0,0 +1,43 @@
+'''
+Tests of the morphological operations on memory-mapped grids
+'''
+
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from helpers import get_blob, get_padded
+
+from morphology import choose_engine, get_as_manufactured, \
+                        get_minkowski_sum_and_diff
+
+class ScratchTest(unittest.TestCase):
+
+    def test_blocked(self):
+        scratch = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, scratch)
+        part = get_blob((30, 26, 34), 1, 2.5)
+        tool = get_blob((7, 9, 5), 2, 1.0)
+        alpha, beta = get_padded(part, tool)
+        expected = get_minkowski_sum_and_diff(alpha, beta, 'spatial') + \
+                            get_as_manufactured(alpha, beta, 'spatial')
+
+        alpha.set_scratch(scratch)
+        beta.set_scratch(scratch)
+        alpha.pad_voxel(alpha.get_voxel_shape())
+        beta.pad_voxel(beta.get_voxel_shape())
+        self.assertTrue(isinstance(alpha.get_voxel(), np.memmap))
+        # memory-mapped grids go to the engine that works tile by tile
+        self.assertEqual(choose_engine(alpha, beta, 'test'), 'blocked')
+        actual = get_minkowski_sum_and_diff(alpha, beta) + \
+                            get_as_manufactured(alpha, beta)
+        for e, a in zip(expected, actual):
+            self.assertTrue(np.array_equal(e.get_bits(), a.get_bits()))
+        # the sum, difference and as manufactured model are written into
+        # the scratch directory
+        for a in actual[:3]:
+            self.assertTrue(isinstance(a.get_bits(), np.memmap))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+'''
+Tests of the keys and spectra of the tool spectrum cache
+'''
+
+import os
+import unittest
+import numpy as np
+
+from helpers import get_blob, get_ball, get_shape
+
+from spectrum_cache import SpectrumCache
+
+MESH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                                                    'data', 'testpart1.obj')
+
+class SpectrumCacheTest(unittest.TestCase):
+
+    def test_keys(self):
+        cache = SpectrumCache(directory = 'spectra')
+        shape = get_shape(get_ball(4, 5))
+        self.assertIsNone(cache.get_key(shape))
+        shape.set_filename(MESH)
+        key = cache.get_key(shape)
+        self.assertEqual(cache.get_key(shape), key)
+        # the voxelizations of the same file differ
+        shape.set_voxelizer('native')
+        self.assertNotEqual(cache.get_key(shape), key)
+        self.assertNotEqual(cache.get_path(cache.get_key(shape)),
+                                                    cache.get_path(key))
+        self.assertNotEqual(cache.get_key(shape, reflect = True),
+                                                    cache.get_key(shape))
+
+    def test_reflected(self):
+        # the reflected spectrum is derived from the one the shape keeps
+        cache = SpectrumCache()
+        voxel = get_blob((10, 12, 9), 3, 1.0)
+        shape = get_shape(voxel)
+        for real in (True, False):
+            reflected = cache.get_spectrum(shape, real, True)
+            spectrum = shape.get_voxel_ft()
+            self.assertTrue(cache.get_spectrum(shape, real) is spectrum)
+            expected = get_shape(voxel[::-1, ::-1, ::-1])
+            expected.fourier_transform(real)
+            self.assertTrue(np.allclose(reflected, expected.get_voxel_ft(),
+                                                        atol = 1e-3))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+'''
+Tests of the orientation sweep against get_as_manufactured
+'''
+
+import unittest
+import numpy as np
+
+from helpers import get_blob, get_cylinder, get_shape
+
+from shape import get_padded_dims
+from morphology import get_as_manufactured
+from rotation import get_rot_mat, Rotator
+from sweep import sweep
+
+class SweepTest(unittest.TestCase):
+
+    def test_ranking(self):
+        part = get_blob((30, 26, 34), 1, 2.5)
+        # a flat tool, which fits the part better in some orientations
+        tool = get_cylinder(9, 7, 2, 2)
+        samples = np.array([[0, 0, 0], [0, np.pi / 2, 0],
+                        [np.pi / 2, np.pi / 2, 0], [0.3, 1.1, -0.7],
+                        [-2.1, 0.4, 1.3], [1.2, 2.5, 0.2]])
+        table = sweep(get_shape(part), get_shape(tool), samples,
+                                                            nworkers = 1)
+
+        # the part fixed and the tool rotated by the inverse orientation,
+        # on the sweep's grid
+        rotator = Rotator(tool)
+        dims = np.array(get_padded_dims(part.shape, rotator.get_dims()))
+        expected = []
+        for rot_mat in get_rot_mat(samples):
+            alpha = get_shape(part)
+            alpha.pad_voxel(dims)
+            beta = get_shape(rotator.rotate_voxel(rot_mat.T))
+            beta.pad_voxel(dims)
+            as_man, non_man = get_as_manufactured(alpha, beta, 'spatial')
+            expected.append((as_man.get_volume(), non_man.get_volume()))
+        expected = np.array(expected)
+
+        # ranked by increasing non-manufacturable volume, ties by index
+        order = np.lexsort((np.arange(len(samples)), expected[:, 1]))
+        self.assertEqual(list(table['index']), list(order))
+        self.assertTrue(np.array_equal(table['as_man'], expected[order, 0]))
+        self.assertTrue(np.array_equal(table['non_man'], expected[order, 1]))
+        self.assertTrue(np.allclose([list(row) for row in table[['phi',
+                                'theta', 'psi']]], samples[order]))
+        self.assertGreater(table['non_man'][-1], table['non_man'][0])
+
+        # a subset of the orientations, on a process pool
+        subset = sweep(get_shape(part), get_shape(tool), samples,
+                                                    [4, 1, 3], nworkers = 2)
+        self.assertEqual(list(subset), [row for row in table
+                                                if row['index'] in (4, 1, 3)])
+
+if __name__ == '__main__':
+    unittest.main()
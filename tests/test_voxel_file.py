@@ -0,0 +1,108 @@
+'''
+Tests of the native voxel file reading and writing
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from io import BytesIO
+
+from helpers import get_blob, get_shape
+
+import voxel_file
+from shape import Shape
+
+class VoxelFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, voxel, compress, name = 'voxel.m3d', **header):
+        filename = os.path.join(self.directory, name)
+        with open(filename, 'wb') as fp:
+            voxel_file.write(fp, np.packbits(voxel), voxel.shape, compress,
+                                                                    **header)
+        return filename
+
+    def test_round_trip(self):
+        voxels = [get_blob((13, 17, 11), 1, 1.0).astype(bool),
+                    np.zeros((5, 6, 7), dtype = bool),
+                    np.ones((8, 8, 8), dtype = bool)]
+        for voxel in voxels:
+            for compress in (False, True):
+                filename = self.write(voxel, compress)
+                bits, header = voxel_file.read(filename)
+                self.assertEqual(header['dims'], list(voxel.shape))
+                self.assertEqual(header['nbytes'], len(bits))
+                self.assertEqual(header['compression'],
+                                            'zlib' if compress else 'none')
+                self.assertEqual(header['offset'] % voxel_file.ALIGN, 0)
+                unpacked = np.unpackbits(bits)[:voxel.size]
+                self.assertTrue(np.array_equal(unpacked.reshape(voxel.shape),
+                                                                    voxel))
+
+    def test_chunks(self):
+        # data longer than one chunk, compressed or not
+        voxel = get_blob((24, 20, 16), 2, 1.0).astype(bool)
+        chunk = voxel_file.CHUNK
+        voxel_file.CHUNK = 100
+        self.addCleanup(setattr, voxel_file, 'CHUNK', chunk)
+        for compress in (False, True):
+            bits, header = voxel_file.read(self.write(voxel, compress))
+            self.assertTrue(np.array_equal(bits, np.packbits(voxel)))
+
+    def test_memmap(self):
+        voxel = get_blob((13, 17, 11), 3, 1.0).astype(bool)
+        bits, header = voxel_file.read(self.write(voxel, False))
+        self.assertTrue(isinstance(bits, np.memmap))
+        self.assertFalse(bits.flags.writeable)
+        self.assertTrue(np.array_equal(bits, np.packbits(voxel)))
+        bits, header = voxel_file.read(self.write(voxel, True, 'zlib.m3d'))
+        self.assertFalse(isinstance(bits, np.memmap))
+
+    def test_shape(self):
+        voxel = get_blob((19, 14, 16), 4, 1.5)
+        shape = get_shape(voxel)
+        shape.set_resolution(19)
+        shape.set_scale(2)
+        for compress in (False, True):
+            filename = os.path.join(self.directory, 'shape.m3d')
+            shape.write_voxel(filename, compress, {'operation': 'test'})
+            result = Shape()
+            self.assertEqual(result.read_native(filename),
+                                                    {'operation': 'test'})
+            # the data is kept bit-packed, memory-mapped if uncompressed
+            self.assertTrue(result.is_packed())
+            self.assertEqual(isinstance(result.get_bits(), np.memmap),
+                                                            not compress)
+            self.assertEqual(tuple(result.get_voxel_shape()), voxel.shape)
+            self.assertEqual(result.get_resolution(), 19)
+            self.assertEqual(result.get_scale(), 2)
+            self.assertTrue(np.array_equal(result.get_voxel() > 0.5,
+                                                                voxel > 0.5))
+            # the header is plain text
+            with open(filename, 'rb') as fp:
+                header = voxel_file.read_header(fp)
+            self.assertEqual(header['dims'], list(voxel.shape))
+            self.assertEqual(header['resolution'], 19)
+
+    def test_errors(self):
+        voxel = get_blob((13, 17, 11), 5, 1.0).astype(bool)
+        for compress in (False, True):
+            filename = self.write(voxel, compress)
+            with open(filename, 'rb') as fp:
+                data = fp.read()
+            with open(filename, 'wb') as fp:
+                fp.write(data[:-10])
+            self.assertRaises(IOError, voxel_file.read, filename)
+        self.assertRaises(IOError, voxel_file.read_header,
+                                        BytesIO('#binvox 1\ndim 1 1 1\n'))
+        self.assertTrue(voxel_file.is_voxel_file('part.M3D'))
+        self.assertFalse(voxel_file.is_voxel_file('part.binvox'))
+
+if __name__ == '__main__':
+    unittest.main()
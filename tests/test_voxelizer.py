@@ -0,0 +1,74 @@
+'''
+Tests of the native voxelizer against binvox
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from helpers import get_ball
+
+import binvox_rw
+import voxelizer
+from voxel_cache import VoxelCache
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+MESH = os.path.join(DATA, 'testpart0.obj')
+SIZE = 64
+# binvox's voxelization of MESH at SIZE, made by the bundled executable if
+# it is not stored
+REFERENCE = os.path.join(DATA, 'testpart0_%d.binvox' % SIZE)
+
+def read_reference():
+    '''
+    Returns the binvox voxelization of MESH, None if binvox cannot run
+    '''
+    if os.path.isfile(REFERENCE):
+        with open(REFERENCE, 'rb') as fp:
+            return binvox_rw.read_as_3d_array(fp).data
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'reference.binvox')
+        VoxelCache(directory).voxelize(MESH, SIZE, path)
+        with open(path, 'rb') as fp:
+            return binvox_rw.read_as_3d_array(fp).data
+    except (OSError, IOError):
+        # binvox needs an X display and its libraries
+        return None
+    finally:
+        shutil.rmtree(directory, ignore_errors = True)
+
+class VoxelizerTest(unittest.TestCase):
+
+    def test_binvox(self):
+        reference = read_reference()
+        if reference is None:
+            self.skipTest('binvox cannot run and ' + REFERENCE +
+                                                        ' is not stored')
+        voxel = voxelizer.voxelize_file(MESH, SIZE)
+        self.assertEqual(voxel.shape, reference.shape)
+        self.assertTrue(voxelizer.agrees_with(voxel, reference))
+        # most of the part is filled by both
+        self.assertGreater(np.count_nonzero(voxel & reference),
+                                        0.9 * np.count_nonzero(reference))
+
+    def test_agrees_with(self):
+        reference = get_ball(49, 21).astype(bool)
+        voxel = reference.copy()
+        # a voxel on the boundary and one next to it are within tolerance
+        voxel[10, 10, 17] = ~voxel[10, 10, 17]
+        voxel[10, 10, 18] = ~voxel[10, 10, 18]
+        self.assertTrue(voxelizer.agrees_with(voxel, reference))
+        # the center and a voxel two off the boundary are not
+        voxel = reference.copy()
+        voxel[10, 10, 10] = False
+        self.assertFalse(voxelizer.agrees_with(voxel, reference))
+        voxel = reference.copy()
+        voxel[10, 10, 19] = True
+        self.assertFalse(voxelizer.agrees_with(voxel, reference))
+        self.assertTrue(voxelizer.agrees_with(voxel, reference, 2))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+#    MAD Lab, University at Buffalo
+#    Copyright (C) 2018  Prakhar Jaiswal <prakharj@buffalo.edu>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import subprocess
+import threading
+from collections import OrderedDict
+import binvox_rw
+import voxelizer
+from block_grid import BLOCK, dense_to_blocks
+
+# the bundled binvox executable
+BINVOX = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'binvox')
+# default directory the voxelized models are cached in
+VOXEL_DIR = os.path.join(os.path.expanduser('~'), '.morph3d', 'voxels')
+
+class VoxelCache:
+    '''
+    The VoxelCache class keeps the voxelized (binvox) models of input meshes
+    in a cache directory, keyed by the SHA-1 of the mesh contents and the
+    voxelization size, so several resolutions of the same mesh coexist and
+    the input directory is never written to
+    Files are written under temporary names and renamed, so concurrent
+    processes never see partial files. The least recently used files are
+    removed once the directory grows beyond 'budget' bytes
+    Decoded models are also kept in memory (up to 'hot_budget' bytes) so
+    recomputing with unchanged inputs does not read the files again
+    Models rasterized by the native voxelizer are cheap to recompute and are
+    kept in memory only
+    A lock serializes the threads of a process using the cache, e.g. the
+    GUI's readers and its background computation
+    '''
+
+    def __init__(self, directory = VOXEL_DIR, budget = 1 << 30,
+                                                hot_budget = 256 << 20):
+        self.directory = directory
+        self.budget = budget
+        self.hot_budget = hot_budget
+        self.voxels = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.RLock()
+
+    def get_key(self, shape):
+        return (shape.get_filehash(), int(shape.get_size()),
+                                        shape.get_voxelizer())
+
+    def get_path(self, key):
+        return os.path.join(self.directory, '%s_%d.binvox' % key[:2])
+
+    def get_voxel(self, shape):
+        '''
+        Returns the voxelized model of the mesh file of 'shape' at its size
+        as 3D numpy boolean array, which must not be modified
+        The model is rasterized by the voxelizer selected for 'shape'
+        '''
+        with self.lock:
+            key = self.get_key(shape)
+            if key in self.voxels:
+                entry = self.voxels.pop(key)
+                self.voxels[key] = entry
+                return entry[0]
+        
+            path = self.get_path(key)
+            data = None
+            if key[2] == 'native':
+                data = voxelizer.voxelize_file(shape.get_filename(), key[1])
+            elif os.path.isfile(path):
+                try:
+                    # marking the file as recently used
+                    os.utime(path, None)
+                    with open(path, 'rb') as fid:
+                        data = binvox_rw.read_as_3d_array(fid).data
+                except (IOError, OSError):
+                    # evicted by another process in the meantime
+                    data = None
+            if data is None:
+                self.voxelize(shape.get_filename(), key[1], path)
+                with open(path, 'rb') as fid:
+                    data = binvox_rw.read_as_3d_array(fid).data
+        
+            self.insert(key, data, data.nbytes)
+            return data
+
+    def get_block_grid(self, shape, block = BLOCK):
+        '''
+        Returns the voxelized model of the mesh file of 'shape' at its size
+        as block_grid.BlockGrid, which must not be modified
+        binvox files are decoded slab by slab, never allocating the dense
+        model
+        '''
+        with self.lock:
+            key = self.get_key(shape) + ('blocks', block)
+            if key in self.voxels:
+                entry = self.voxels.pop(key)
+                self.voxels[key] = entry
+                return entry[0]
+
+            if key[2] == 'native':
+                data = dense_to_blocks(self.get_voxel(shape), block)
+            else:
+                path = self.get_path(key)
+                data = None
+                if os.path.isfile(path):
+                    try:
+                        os.utime(path, None)
+                        with open(path, 'rb') as fid:
+                            data = binvox_rw.read_as_block_array(fid,
+                                                                block).data
+                    except (IOError, OSError):
+                        data = None
+                if data is None:
+                    self.voxelize(shape.get_filename(), key[1], path)
+                    with open(path, 'rb') as fid:
+                        data = binvox_rw.read_as_block_array(fid, block).data
+
+            self.insert(key, data, data.get_nbytes())
+            return data
+
+    def insert(self, key, data, nbytes):
+        '''
+        Keeps 'data' in memory, dropping the least recently used models
+        beyond the hot budget
+        '''
+        self.voxels[key] = (data, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.hot_budget and len(self.voxels) > 1:
+            key, (old, size) = self.voxels.popitem(last = False)
+            self.nbytes -= size
+
+    def voxelize(self, filename, size, path):
+        '''
+        Rasterizes the mesh 'filename' with binvox at 'size' and stores the
+        result as 'path'
+        binvox writes its output next to its input, so it is run on a copy
+        of the mesh in a private temporary directory
+        '''
+        try:
+            os.makedirs(self.directory)
+        except OSError:
+            if not os.path.isdir(self.directory):
+                raise
+        tmpdir = tempfile.mkdtemp(dir = self.directory)
+        try:
+            mesh = os.path.join(tmpdir, 'mesh' +
+                                        os.path.splitext(filename)[1])
+            shutil.copyfile(filename, mesh)
+            subprocess.call([BINVOX, '-d', str(size), mesh])
+            os.rename(os.path.join(tmpdir, 'mesh.binvox'), path)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors = True)
+        self.evict(path)
+
+    def evict(self, keep = None):
+        '''
+        Removes the least recently used files until the cache directory fits
+        in the budget, never removing 'keep'
+        '''
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.binvox') and path != keep:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        total = sum(f[1] for f in files)
+        if keep is not None and os.path.isfile(keep):
+            total += os.path.getsize(keep)
+        for mtime, size, path in sorted(files):
+            if total <= self.budget:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        with self.lock:
+            self.voxels.clear()
+            self.nbytes = 0
+
+# voxelized models shared by all shapes in this process
+voxel_cache = VoxelCache()
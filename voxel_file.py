@@ -0,0 +1,127 @@
+#    MAD Lab, University at Buffalo
+#    Copyright (C) 2018  Prakhar Jaiswal <prakharj@buffalo.edu>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Native file format for voxel models and results.
+
+A file holds the voxels bit-packed (numpy.packbits of the 3D grid in C
+order, as stored by Shape.set_bits) after a short text header:
+
+    #morph3d 1
+    {"dims": [128, 128, 128], "compression": "none", "nbytes": 262144, ...}
+
+The second line is a JSON object with the dims of the grid, the number of
+packed bytes, the compression ('none' or 'zlib') and the provenance of the
+model: resolution, scale, input file, its SHA-1 and voxelizer, the time of
+writing and an optional 'info' object (e.g. the operation and input parts
+of a result). It is padded with spaces so that the data starts at a
+multiple of ALIGN bytes. Uncompressed data is loaded as a read-only
+numpy.memmap without copying; zlib (at a fast level) makes files of large,
+mostly empty grids much smaller but has to be decompressed on loading.
+"""
+
+import os
+import json
+import time
+import zlib
+import numpy as np
+
+MAGIC = '#morph3d 1'
+EXTENSION = '.m3d'
+# the data starts at a multiple of ALIGN bytes
+ALIGN = 64
+# bytes of packed data compressed or written at once
+CHUNK = 1 << 24
+# zlib level of compressed files, fast rather than small
+LEVEL = 1
+
+def is_voxel_file(filename):
+    '''
+    Returns whether 'filename' has the extension of the native format
+    '''
+    return filename.lower().endswith(EXTENSION)
+
+def write(fp, bits, dims, compress = False, **header):
+    '''
+    Writes the packed voxels 'bits' of a grid of 'dims' to the file object
+    'fp' (opened in binary mode), zlib-compressed if 'compress' is set
+    The keyword arguments are stored in the header
+    '''
+    header = dict(header)
+    header['dims'] = [int(dim) for dim in dims]
+    header['nbytes'] = int(len(bits))
+    header['compression'] = 'zlib' if compress else 'none'
+    header.setdefault('created', time.strftime('%Y-%m-%dT%H:%M:%S'))
+    line = json.dumps(header, sort_keys = True)
+    size = len(MAGIC) + len(line) + 2
+    fp.write(MAGIC + '\n' + line + ' ' * (-size % ALIGN) + '\n')
+
+    compressor = zlib.compressobj(LEVEL) if compress else None
+    for start in range(0, len(bits), CHUNK):
+        chunk = np.asarray(bits[start:start + CHUNK]).tostring()
+        if compressor is not None:
+            chunk = compressor.compress(chunk)
+        fp.write(chunk)
+    if compressor is not None:
+        fp.write(compressor.flush())
+
+def read_header(fp):
+    '''
+    Reads the header of a native file, leaving 'fp' at the start of the data
+    Output: the header (dict) with the data 'offset' in the file added
+    '''
+    if fp.readline().rstrip('\n') != MAGIC:
+        raise IOError('Not a morph3d voxel file')
+    header = json.loads(fp.readline())
+    header['offset'] = fp.tell()
+    return header
+
+def read(filename):
+    '''
+    Reads the native file 'filename'
+    Output: the packed voxels, as read-only numpy.memmap if uncompressed,
+    and the header (see read_header)
+    '''
+    with open(filename, 'rb') as fp:
+        header = read_header(fp)
+        nbytes = header['nbytes']
+        if header['compression'] == 'none':
+            if os.fstat(fp.fileno()).st_size < header['offset'] + nbytes:
+                raise IOError('Truncated morph3d voxel file')
+            bits = np.memmap(filename, dtype = np.uint8, mode = 'r',
+                            offset = header['offset'], shape = (nbytes,)) \
+                            if nbytes > 0 else np.zeros(0, dtype = np.uint8)
+        elif header['compression'] == 'zlib':
+            bits = np.empty(nbytes, dtype = np.uint8)
+            decompressor = zlib.decompressobj()
+            start = 0
+            while True:
+                chunk = fp.read(CHUNK)
+                if not chunk:
+                    break
+                chunk = decompressor.decompress(chunk)
+                bits[start:start + len(chunk)] = np.frombuffer(chunk,
+                                                        dtype = np.uint8)
+                start += len(chunk)
+            chunk = decompressor.flush()
+            bits[start:start + len(chunk)] = np.frombuffer(chunk,
+                                                        dtype = np.uint8)
+            start += len(chunk)
+            if start != nbytes:
+                raise IOError('Truncated morph3d voxel file')
+        else:
+            raise IOError('Unknown compression ' + header['compression'])
+    return bits, header
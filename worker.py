@@ -0,0 +1,76 @@
+#    MAD Lab, University at Buffalo
+#    Copyright (C) 2018  Prakhar Jaiswal <prakharj@buffalo.edu>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Background computation for the GUI.
+
+The computation runs in a QThread so the window stays responsive. The
+thread works on its own copies of the input shapes and hands the results
+back through a signal, so the shapes displayed by the window are never
+modified while it runs. It can only be cancelled between stages (see the
+'progress' callbacks in morphology.py); a stage already running, such as an
+FFT, is finished first.
+
+This module must be imported after the Qt API has been selected (see the
+'sip' setup at the top of main.py).
+"""
+
+import traceback
+from PyQt4 import QtCore
+
+from morphology import Cancelled
+
+class ComputeThread(QtCore.QThread):
+    '''
+    The ComputeThread class runs 'job(progress)' in a background thread
+    'progress(fraction, message)' is forwarded to the 'progress' signal and
+    aborts the job once 'cancel' was called. The return value of the job
+    is emitted with the 'done' signal, the traceback of an error with the
+    'failed' signal; neither is emitted for a cancelled job
+    '''
+    progress = QtCore.pyqtSignal(float, str)
+    done = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, job, parent = None):
+        QtCore.QThread.__init__(self, parent)
+        self.job = job
+        self.cancelled = False
+
+    def cancel(self):
+        '''
+        Requests the job to stop at the start of its next stage
+        '''
+        self.cancelled = True
+
+    def is_cancelled(self):
+        return self.cancelled
+
+    def report(self, fraction, message):
+        if self.cancelled:
+            raise Cancelled()
+        self.progress.emit(fraction, message)
+
+    def run(self):
+        try:
+            result = self.job(self.report)
+        except Cancelled:
+            return
+        except Exception:
+            self.failed.emit(traceback.format_exc())
+            return
+        if not self.cancelled:
+            self.done.emit(result)